@@ -1,71 +1,165 @@
+# This code measures the response of the pressure controller to every command step of any number of experiment folders
+# (each with a pressure-reading.csv: pressure reading, loop iteration and command pressure columns). The folders are
+# analysed in a process pool, and the rise, entry and settling times of every step are written to one results table.
+# Optionally, the pressure readings around the first 0.2 -> 0 psi step of every folder are plotted one above the other.
+
+# imports
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
+import click
+import glob
 import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from utils import set_text_rendering, get_command_steps, get_step_response_times
+
+# constant definitions
+PRESSURE_FILE_NAME = 'pressure-reading.csv'
+RESULTS_COLUMNS = ['folder', 'step', 'step_time', 'initial_command', 'final_command', 'step_size', 'rise_time', 'entry_time', 'settling_time', 'overshoot']
+
+def read_pressure_reading(folder_dir):
+    """
+    Reads the pressure reading, loop iteration and command pressure columns of a folder's pressure-reading.csv.
+    """
+    data = pd.read_csv(os.path.join(folder_dir, PRESSURE_FILE_NAME), delimiter=',', skiprows=1, header=None, usecols=[0, 1, 2], dtype=np.float64).to_numpy()
+
+    return data[:, 0], data[:, 1], data[:, 2]
+
+def analyze_pressure_folder(folder_dir, loop_delay, tolerance, rise_limits):
+    """
+    Measures the response to every command step of one folder. Returns (folder, dataframe of the steps, error message
+    or None), so that a failing folder does not stop the batch.
+    """
+    try:
+        pressure, loop_iteration, command = read_pressure_reading(folder_dir)
+        steps = get_step_response_times(pressure, command, loop_iteration * loop_delay, tolerance=tolerance, rise_limits=rise_limits)
+        steps.insert(0, 'step', np.arange(len(steps)))
+        steps.insert(0, 'folder', os.path.basename(folder_dir))
+        return folder_dir, steps, None
+    except Exception as e:
+        return folder_dir, pd.DataFrame(columns=RESULTS_COLUMNS), f'{type(e).__name__}: {e}'
+
+def analyze_pressure_folders(folders, loop_delay=0.01, tolerance=0.05, rise_limits=(0.1, 0.9), num_workers=None):
+    """
+    Analyses the folders in parallel and returns the steps of all of them in one dataframe (in the order of the
+    folders), and a dict of the folders that failed with their error messages.
+    """
+    results, errors = {}, {}
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        futures = [executor.submit(analyze_pressure_folder, folder, loop_delay, tolerance, rise_limits) for folder in folders]
+        for future in as_completed(futures):
+            folder_dir, steps, error = future.result()
+            results[folder_dir] = steps
+            if error is not None:
+                errors[folder_dir] = error
+
+    steps = [results[folder] for folder in folders if len(results[folder]) > 0]
+    table = pd.concat(steps, ignore_index=True) if len(steps) > 0 else pd.DataFrame(columns=RESULTS_COLUMNS)
+
+    return table, errors
+
+def plot_pressure_transitions(folders, table, loop_delay, step_from=0.2, step_to=0.0):
+    """
+    Plots the pressure reading and command of every folder, aligned to its first step_from -> step_to command step, one
+    subplot per folder, with the entry time of that step in the legend.
+    """
+    # change font size to 6 for legend
+    plt.rcParams.update({'font.size': 6})
+
+    # set up the subplot figure
+    fig, axs = plt.subplots(len(folders), 1, squeeze=False)
+    axs = axs[:, 0]
+
+    for i, folder_dir in enumerate(folders):
+        pressure, loop_iteration, command = read_pressure_reading(folder_dir)
+
+        # find the first transition of this folder
+        step_indices, initial_values, final_values = get_command_steps(command)
+        transitions = np.flatnonzero((initial_values == step_from) & (final_values == step_to))
+        if len(transitions) == 0:
+            axs[i].set_yticks([])
+            continue
+        transition = transitions[0]
+        transition_start = step_indices[transition]
+        entry_time = table[(table['folder'] == os.path.basename(folder_dir)) & (table['step'] == transition)]['entry_time'].iloc[0]
+
+        # create time variable for plotting
+        time = loop_iteration * loop_delay
+        time = time - time[transition_start]
+
+        # set ylabel for the middle subplot only
+        if i == len(folders) // 2:
+            axs[i].set_ylabel('Pressure (psi)')
+            axs[i].set_yticks([0, 0.25])
+        else:
+            axs[i].set_yticks([])
+            axs[i].set_yticklabels([])
+
+        # plotting the data
+        axs[i].plot(time, pressure, label=f'Pressure Reading, Transition Time: {entry_time:.2f} s')
+        axs[i].plot(time, command, label='Command Pressure')
+        axs[i].set_ylim([0, 0.25])
+        axs[i].set_xlim([0, 5])
+        axs[i].legend()
+
+    plt.xlabel('Time (s)')
+    plt.tight_layout()
+
+    # remove vertical space between subplots
+    plt.subplots_adjust(hspace=-0.02)
+
+    plt.show()
+
+@click.command()
+@click.option('--directory', '-d', default='~/Dropbox (MIT)/Qatar 3D Printing/Reports/report-data-dump', help='Directory where the experiment folders are stored.')
+@click.option('--folder-pattern', '-p', default='*', help='Glob pattern (relative to the directory) of the experiment folders (only the ones with a pressure-reading.csv are analysed).')
+@click.option('--loop-delay', '-l', default=0.01, help='Loop delay of the pressure readings in seconds.')
+@click.option('--tolerance', '-t', default=0.05, help='Settling band around the new command, as a fraction of the step size.')
+@click.option('--rise-limits', '-r', default='0.1,0.9', help='Comma separated fractions of the step size between which the rise time is measured.')
+@click.option('--workers', '-j', default=os.cpu_count(), help='Number of worker processes.')
+@click.option('--output-file', '-o', default='pressure-steps.csv', help='CSV file to write the results to (relative to the directory).')
+@click.option('--plot', '-P', default=False, help='Plot the first 0.2 to 0 psi transition of every folder.')
+
+def main(directory, folder_pattern, loop_delay, tolerance, rise_limits, workers, output_file, plot):
+    """
+    Measures the rise, entry and settling times of every pressure command step of the matching folders, and writes
+    them to one results table.
+    """
+    # expand the directory and find the folders with pressure readings
+    directory = os.path.expanduser(directory)
+    folders = sorted(path for path in glob.glob(os.path.join(directory, folder_pattern)) if os.path.isfile(os.path.join(path, PRESSURE_FILE_NAME)))
+
+    # if no folder matches, print an error message and exit
+    if len(folders) == 0:
+        print('No folders matching {} with a {} in {}!'.format(folder_pattern, PRESSURE_FILE_NAME, directory))
+        exit()
+
+    # analyse the folders in parallel
+    print(f'\n\n Analysing {len(folders)} folders with {workers} workers\n\n')
+    start_time = time.perf_counter()
+    table, errors = analyze_pressure_folders(folders, loop_delay, tolerance, tuple(float(value) for value in rise_limits.split(',')), workers)
+    total_time = time.perf_counter() - start_time
+
+    for folder_dir, error in errors.items():
+        print(f' {os.path.basename(folder_dir)}: FAILED ({error})')
+
+    # save the results
+    output_path = os.path.join(directory, output_file)
+    table.to_csv(output_path, index=False)
+    print(f' Measured {len(table)} steps of {len(folders) - len(errors)} folders in {total_time:.2f} s, results saved to {output_path}\n')
+
+    # print the mean times of every kind of step
+    if len(table) > 0:
+        summary = table.groupby(['initial_command', 'final_command'])[['rise_time', 'entry_time', 'settling_time', 'overshoot']].mean()
+        with pd.option_context('display.max_rows', 50, 'display.width', 200):
+            print(summary)
+
+    # plot the transitions of the folders that were analysed
+    if plot:
+        # use latex for font rendering (set AFM_MATHTEXT=1 to use mathtext instead, which starts faster)
+        set_text_rendering()
+        plot_pressure_transitions([folder for folder in folders if folder not in errors], table, loop_delay)
 
-# use latex for font rendering, use serif font
-plt.rc('text', usetex=True)
-plt.rc('font', family='serif')
-
-# change font size to 6 for legend
-plt.rcParams.update({'font.size': 6})
-
-# Define the paths to the data
-data_paths = [
-    "/Users/malek8/Dropbox (MIT)/Qatar 3D Printing/Reports/report-data-dump/p=1-data-log-[18-21-49]-experiment",
-    "/Users/malek8/Dropbox (MIT)/Qatar 3D Printing/Reports/report-data-dump/p=2-data-log-[18-20-49]-experiment",
-    "/Users/malek8/Dropbox (MIT)/Qatar 3D Printing/Reports/report-data-dump/p=3-data-log-[18-19-45]-experiment",
-    "/Users/malek8/Dropbox (MIT)/Qatar 3D Printing/Reports/report-data-dump/p=4-data-log-[18-18-23]-experiment",
-    "/Users/malek8/Dropbox (MIT)/Qatar 3D Printing/Reports/report-data-dump/p=5-data-log-[18-10-00]-experiment",
-    "/Users/malek8/Dropbox (MIT)/Qatar 3D Printing/Reports/report-data-dump/p=6-data-log-[18-16-21]-experiment",
-    "/Users/malek8/Dropbox (MIT)/Qatar 3D Printing/Reports/report-data-dump/p=7-data-log-[18-17-23]-experiment",
-]
-
-# Define the loop delay in seconds
-loop_delay = 0.01  # 10ms
-
-# Set up the subplot figure
-fig, axs = plt.subplots(7, 1)
-
-
-# Loop over the data paths
-for i, data_path in enumerate(data_paths):
-    # Get the pressure setting from the data path
-    pressure_setting = int(data_path.split('=')[1].split('-')[0])
-
-    # Load the data
-    data = pd.read_csv(os.path.join(data_path, "pressure-reading.csv"),delimiter=',',skiprows=1,header=None)[0:2100]
-    
-    # Compute the time for pressure to go from 0.2 psi back to 0 psi
-    transition_start = data[(data.iloc[:, 2] == 0) & (data.iloc[:, 2].shift(1) == 0.2)].index[0]
-    settling_data = data[transition_start:]
-    settling_time_idx = settling_data[(settling_data.iloc[:, 0] <= 0.05 * 0.2)].index[0]
-    settling_time = (settling_time_idx - transition_start) * loop_delay
-
-    # Create time variable for plotting
-    time = (data.iloc[:, 1]) * loop_delay
-    time = time - time[transition_start]
-
-    # Set ylabel for the first subplot only
-    if i == 3:
-        axs[i].set_ylabel('Pressure (psi)')
-        axs[i].set_yticks([0,0.25])
-    else:
-        axs[i].set_yticks([])
-        axs[i].set_yticklabels([])
-
-    # Plotting the data
-    axs[i].plot(time, data.iloc[:, 0], label=f'Pressure Reading, Transition Time: {settling_time} s')
-    axs[i].plot(time, data.iloc[:, 2], label='Command Pressure')
-    axs[i].set_ylim([0, 0.25])
-    axs[i].set_xlim([0,5])
-    axs[i].legend()
-
-
-plt.xlabel('Time (s)')
-plt.tight_layout()
-
-# Remove vertical space between subplots
-plt.subplots_adjust(hspace=-0.02)
-
-plt.show()
+if __name__ == '__main__':
+    main()
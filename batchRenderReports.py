@@ -0,0 +1,129 @@
+# This code renders the data log figures (plot_data, pressure and OBD distributions) of many experiment folders at once,
+# without opening any windows, so that a whole campaign can be reprocessed in one command.
+
+# Import libraries (the Agg backend has to be selected before pyplot is imported by the plotting scripts)
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import click
+import glob
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from plotDataLog import plot_data
+from plotOBDSignalsWithDistributions import plot_obd_with_distributions
+from utils import set_text_rendering
+
+# constant definitions
+PLOT_SAVE_NAME = 'plot-analysis'
+OBD_SAVE_NAME = 'obd-distributions'
+
+def get_report_inputs(folder_dir):
+    """
+    Returns the paths of the files of a data log folder that the figures are made from.
+    """
+    return [os.path.join(folder_dir, name) for name in os.listdir(folder_dir) if name.endswith('.csv') or name == 'metadata.txt']
+
+def get_report_outputs(folder_dir, save_format):
+    """
+    Returns the paths of the figures rendered for a data log folder (the pressure figure only if there is pressure data).
+    """
+    outputs = [os.path.join(folder_dir, PLOT_SAVE_NAME + '.' + save_format), os.path.join(folder_dir, OBD_SAVE_NAME + '.' + save_format)]
+    if os.path.isfile(os.path.join(folder_dir, 'pressure.csv')):
+        outputs.append(os.path.join(folder_dir, 'pressure.' + save_format))
+
+    return outputs
+
+def is_report_up_to_date(folder_dir, save_format):
+    """
+    Returns True if all the figures of a folder exist and are newer than all of its input files.
+    """
+    outputs = get_report_outputs(folder_dir, save_format)
+    if not all(os.path.isfile(output) for output in outputs):
+        return False
+
+    inputs = get_report_inputs(folder_dir)
+    newest_input = max((os.path.getmtime(path) for path in inputs), default=0)
+    oldest_output = min(os.path.getmtime(path) for path in outputs)
+
+    return oldest_output >= newest_input
+
+def render_folder_reports(folder_dir, scale_factor, time_units, save_format):
+    """
+    Renders and saves the figures of one data log folder. Returns (folder, elapsed time in s, input size in bytes, error
+    message or None), so that a failing folder does not stop the batch.
+    """
+    start_time = time.perf_counter()
+    input_bytes = sum(os.path.getsize(path) for path in get_report_inputs(folder_dir))
+
+    try:
+        # render the data log and pressure figures, then the OBD distributions figure
+        plot_data(folder_dir, scale_factor, time_units, False, True, PLOT_SAVE_NAME, save_format, False)
+        plt.close('all')
+        plot_obd_with_distributions(folder_dir, scale_factor, time_units, False, True, OBD_SAVE_NAME, save_format, False)
+        error = None
+    except Exception as e:
+        error = f'{type(e).__name__}: {e}'
+    finally:
+        # free the figures before the worker moves on to the next folder
+        plt.close('all')
+
+    return folder_dir, time.perf_counter() - start_time, input_bytes, error
+
+# define a click argument for the folder pattern, add optional arguments for the figures and the worker pool
+@click.command()
+@click.option('--directory', '-d', default='~/Dropbox (MIT)/Qatar 3D Printing/LabVIEW Files (Malek)/2023-Qatar-3D-Printing/afm-data-logs/', help='Directory where the data is stored')
+@click.option('--folder-pattern', '-p', default='data-log-*', help='Glob pattern (relative to the directory) of the data log folders to render.')
+@click.option('--scale_factor', '-s', default=1.25, help='Scale factor for the data plots y-axis scaling.')
+@click.option('--time-units', '-t', default='min', help='Time units for the x-axis of the plots. Options are min, s, and ms.')
+@click.option('--save-format', '-f', default='pdf', help='Save format for the figures. Options are png, pdf, and svg.')
+@click.option('--workers', '-j', default=os.cpu_count(), help='Number of worker processes.')
+@click.option('--force', '-F', default=False, help='Render all folders, even the ones whose figures are newer than their data.')
+@click.option('--mathtext', '-M', default=False, help='Render the labels with mathtext instead of LaTeX (no TeX process per label).')
+
+def main(directory, folder_pattern, scale_factor, time_units, save_format, workers, force, mathtext):
+    """
+    Renders the figures of every data log folder matching the pattern in a process pool, skipping the folders whose
+    figures are up to date, and prints a throughput summary.
+    """
+    # select the text rendering (also through the environment, so worker processes that are not forked pick it up)
+    if mathtext:
+        os.environ['AFM_MATHTEXT'] = '1'
+        set_text_rendering(mathtext=True)
+
+    # expand the directory and find the data log folders
+    directory = os.path.expanduser(directory)
+    folders = sorted(path for path in glob.glob(os.path.join(directory, folder_pattern)) if os.path.isdir(path))
+
+    # if no folder matches, print an error message and exit
+    if len(folders) == 0:
+        print('No folders matching {} in {}!'.format(folder_pattern, directory))
+        exit()
+
+    # only render the folders whose figures are missing or older than their data
+    stale_folders = [folder for folder in folders if force or not is_report_up_to_date(folder, save_format)]
+    print(f'\n\n Rendering {len(stale_folders)} of {len(folders)} folders ({len(folders) - len(stale_folders)} up to date) with {workers} workers\n\n')
+
+    # render the folders in parallel
+    start_time = time.perf_counter()
+    rendered, failed, total_bytes = 0, 0, 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(render_folder_reports, folder, scale_factor, time_units, save_format) for folder in stale_folders]
+        for future in as_completed(futures):
+            folder_dir, elapsed, input_bytes, error = future.result()
+            if error is None:
+                rendered += 1
+                total_bytes += input_bytes
+                print(f' {os.path.basename(folder_dir)}: {elapsed:.2f} s')
+            else:
+                failed += 1
+                print(f' {os.path.basename(folder_dir)}: FAILED ({error})')
+    total_time = time.perf_counter() - start_time
+
+    # print the throughput summary
+    print(f'\n\n Rendered {rendered} folders ({failed} failed, {len(folders) - len(stale_folders)} skipped) in {total_time:.2f} s')
+    if rendered > 0 and total_time > 0:
+        print(f' Throughput: {rendered / total_time:.2f} folders/s, {total_bytes / 1e6 / total_time:.2f} MB/s of data\n\n')
+
+if __name__ == '__main__':
+    main()
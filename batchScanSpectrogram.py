@@ -0,0 +1,55 @@
+# This code computes the spectrograms of several scan signals of many log files at once (with a single batched STFT)
+# and saves them to disk as a 3D (spectrogram, frequency bin, frame) .npy array instead of plotting them one by one.
+
+# import modules
+import numpy as np
+import click
+import glob
+import os
+from utils import *
+
+# define a click argument for the input file pattern, add optional arguments for the spectrogram parameters
+@click.command()
+@click.option('--file-directory', '-d', default='~/Dropbox (MIT)/Qatar 3D Printing/LabVIEW Files (Malek)/2023-Qatar-3D-Printing/afm-data-logs/', help='Directory where the data is stored')
+@click.option('--file-pattern', '-p', default='*.csv', help='Glob pattern (relative to the directory) of the log files to process.')
+@click.option('--signal-types', '-s', default='X Command (um),Y Command (um)', help='Comma separated signal types (column names) to compute the spectrograms of.')
+@click.option('--sampling-rate', '-r', default=44100, help='Sampling rate of the signals in Hz.')
+@click.option('--spectrogram-type', '-t', default='mel', help='Type of spectrogram to compute. Options are mel or linear.')
+@click.option('--window-size', '-w', default=2048, help='Window size for the spectrogram in samples.')
+@click.option('--n-mels', '-m', default=265, help='Number of mel bins to use for the spectrogram.')
+@click.option('--output-file', '-o', default='spectrograms.npy', help='Output .npy file (relative to the directory) for the spectrograms.')
+
+def main(file_directory, file_pattern, signal_types, sampling_rate, spectrogram_type, window_size, n_mels, output_file):
+    """
+    Computes the spectrograms of the given signal types for every log file matching the pattern and saves them as one 3D
+    array. The order of the spectrograms (file, signal type) is saved next to it in a text file.
+    """
+    # expand the file directory and find the log files
+    file_directory = os.path.expanduser(file_directory)
+    log_files = sorted(glob.glob(os.path.join(file_directory, file_pattern)))
+
+    # if no file matches, print an error message and exit
+    if len(log_files) == 0:
+        print('No files matching {} in {}!'.format(file_pattern, file_directory))
+        exit()
+
+    # get the list of signal types
+    signal_types = [signal_type.strip() for signal_type in signal_types.split(',')]
+
+    # compute all the spectrograms in one batch and write them to disk
+    output_path = os.path.join(file_directory, output_file)
+    spectrograms = log_files2spec(log_files, signal_types, sampling_rate, output_path=output_path, f_max=sampling_rate/2,
+                                  spectrogram_type=spectrogram_type, window_size=window_size, n_mels=n_mels)
+
+    # save the order of the spectrograms
+    rows_path = os.path.splitext(output_path)[0] + '-rows.txt'
+    with open(rows_path, 'w') as f:
+        for log_file in log_files:
+            for signal_type in signal_types:
+                f.write(f'{os.path.basename(log_file)}\t{signal_type}\n')
+
+    # print sucess message
+    print(f'\n\n Spectrograms of shape {spectrograms.shape} saved successfully at {output_path}!\n\n')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+# Benchmark of utils.get_signal_period_overlay (vectorized) against the original implementation that fills the
+# periods with a Python loop over every trough. The test signals are noisy triangle waves like the X/Y scan commands.
+
+# imports
+import numpy as np
+import click
+import time
+from utils import *
+from scipy.signal import savgol_filter, argrelextrema
+
+def get_signal_period_overlay_loop(signal, time, window_size=11, poly_order=3):
+    # original implementation of utils.get_signal_period_overlay, kept as the benchmark reference
+    smoothed_x_command = savgol_filter(signal, window_size, poly_order)
+    trough_indices = argrelextrema(smoothed_x_command, np.less)
+    periods = np.diff(time[trough_indices])
+    adjusted_periods = np.empty_like(signal)
+    for i in range(len(periods)):
+        start = trough_indices[0][i]
+        end = trough_indices[0][i+1]
+        adjusted_periods[start:end] = periods[i]
+    if len(periods) > 0:
+        if end < len(signal):
+            adjusted_periods[end:] = periods[-1]
+    else:
+        adjusted_periods[:] = 0
+    return adjusted_periods
+
+def make_scan_signals(num_samples, num_signals, sampling_rate, samples_per_period, seed=0):
+    # triangle waves with different periods (between 1 and 5 times samples_per_period) and a little noise
+    rng = np.random.default_rng(seed)
+    t = np.arange(num_samples) / sampling_rate
+    periods = np.linspace(1, 5, num_signals) * samples_per_period / sampling_rate
+    signals = np.abs((t / periods[:, None]) % 1 - 0.5) + rng.normal(0, 1e-4, (num_signals, num_samples))
+    return signals, t
+
+@click.command()
+@click.option('--sizes', '-n', default='1e6,1e7,1e8', help='Comma separated signal lengths (samples) to benchmark.')
+@click.option('--num-signals', '-k', default=4, help='Number of signals (e.g. X/Y/FX X/FX Y commands) per size.')
+@click.option('--sampling-rate', '-r', default=1000, help='Sampling rate of the test signals in Hz.')
+@click.option('--samples-per-period', '-p', default=200, help='Shortest scan period of the test signals in samples.')
+
+def main(sizes, num_signals, sampling_rate, samples_per_period):
+    """
+    Times the loop and vectorized period overlays (one call per signal vs. one call for the stack of signals).
+    """
+    for size in [int(float(size)) for size in sizes.split(',')]:
+        signals, t = make_scan_signals(size, num_signals, sampling_rate, samples_per_period)
+
+        # time the original implementation, one signal at a time
+        t0 = time.perf_counter()
+        reference = [get_signal_period_overlay_loop(signal, t) for signal in signals]
+        loop_time = time.perf_counter() - t0
+
+        # time the vectorized implementation on the whole stack
+        t0 = time.perf_counter()
+        result = get_signal_period_overlay(signals, t)
+        vectorized_time = time.perf_counter() - t0
+
+        # compare the results after the first trough (before it the original leaves the array uninitialized)
+        first_troughs = [argrelextrema(savgol_filter(signal, 11, 3), np.less)[0][0] for signal in signals]
+        match = all(np.array_equal(ref[first:], res[first:]) for ref, res, first in zip(reference, result, first_troughs))
+
+        print(f'{size:>12d} samples x {num_signals}: loop {loop_time:8.3f} s, vectorized {vectorized_time:8.3f} s, '
+              f'speedup {loop_time/vectorized_time:6.1f}x, identical: {match}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+# Benchmark of the cold start time of the command line scripts (time until the --help text is printed, which includes
+# importing utils and all the plotting libraries), and of the time to render a figure title with LaTeX and with mathtext.
+
+# imports
+import numpy as np
+import click
+import glob
+import os
+import subprocess
+import sys
+import time
+
+# code that renders the experiment title of a log header once, run in a fresh process for each text rendering mode
+RENDER_CODE = """
+import matplotlib
+matplotlib.use('Agg')
+import time
+import pandas as pd
+from utils import *
+set_text_rendering()
+df_header = pd.DataFrame([['P', 1e-3, 'LPS', 0.5, 'Z Set Point', 0.5], ['I', 2e-4, 'Size X', 50000, 'Offset X', 1000], ['D', 0, 'Size Y', 40000, 'Offset Y', -2000]])
+start_time = time.perf_counter()
+fig, ax = plt.subplots()
+ax.set_title(get_experiment_info_string(df_header))
+ax.set_xlabel('X Command ($\\\\mu m$)')
+fig.canvas.draw()
+print(time.perf_counter() - start_time)
+"""
+
+def get_cli_scripts(directory):
+    """
+    Returns the scripts of the directory that have a click command line interface (except this benchmark).
+    """
+    scripts = []
+    for path in sorted(glob.glob(os.path.join(directory, '*.py'))):
+        if os.path.basename(path) == os.path.basename(__file__):
+            continue
+        with open(path, 'r') as f:
+            if '@click.command' in f.read():
+                scripts.append(path)
+
+    return scripts
+
+def time_command(args, repeats, env=None):
+    """
+    Returns the wall clock times (s) of running a command repeats times, or None if it fails.
+    """
+    times = []
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        result = subprocess.run(args, capture_output=True, env=env, cwd=os.path.dirname(os.path.abspath(__file__)))
+        times.append(time.perf_counter() - start_time)
+        if result.returncode != 0:
+            return None
+
+    return np.array(times)
+
+@click.command()
+@click.option('--repeats', '-r', default=3, help='Number of runs of every command (the minimum time is reported).')
+@click.option('--scripts', '-s', default='', help='Comma separated scripts to time (defaults to every script with a command line interface).')
+
+def main(repeats, scripts):
+    """
+    Times the start up of every command line script and the rendering of a figure title with LaTeX and mathtext.
+    """
+    directory = os.path.dirname(os.path.abspath(__file__))
+    scripts = [os.path.join(directory, script.strip()) for script in scripts.split(',')] if scripts else get_cli_scripts(directory)
+
+    # time the import of utils alone and with the heavy dependencies it loads lazily
+    print('\n\n Import times (min of {} runs)\n'.format(repeats))
+    for name, code in [('utils', 'import utils'), ('utils + librosa, scipy.signal, soundfile, soxr', 'import utils, librosa.core, scipy.signal, soundfile, soxr')]:
+        times = time_command([sys.executable, '-c', code], repeats)
+        print(f' {name:50s} {times.min():.2f} s' if times is not None else f' {name:50s} FAILED')
+
+    # time the start up of every script
+    print('\n\n Start up times (--help, min of {} runs)\n'.format(repeats))
+    for script in scripts:
+        times = time_command([sys.executable, script, '--help'], repeats)
+        print(f' {os.path.basename(script):50s} {times.min():.2f} s' if times is not None else f' {os.path.basename(script):50s} FAILED')
+
+    # time the rendering of a title with LaTeX and mathtext (LaTeX fails if no TeX installation is found)
+    print('\n\n Title rendering times (first draw, min of {} runs)\n'.format(repeats))
+    for name, mathtext in [('LaTeX (usetex)', '0'), ('mathtext', '1')]:
+        env = dict(os.environ, AFM_MATHTEXT=mathtext)
+        draw_times = []
+        for _ in range(repeats):
+            result = subprocess.run([sys.executable, '-c', RENDER_CODE], capture_output=True, text=True, env=env, cwd=directory)
+            if result.returncode != 0:
+                break
+            draw_times.append(float(result.stdout.strip().splitlines()[-1]))
+        print(f' {name:50s} {min(draw_times):.3f} s' if len(draw_times) == repeats else f' {name:50s} FAILED (is TeX installed?)')
+
+if __name__ == '__main__':
+    main()
@@ -1,78 +1,305 @@
 # the main  goal of this code is to characterize the PGMFC microcontroller by analyzing the first order
 # response of the system and calculating the time constant.
+#
+# Every step of a pressure log is found (from the command column if the log has one, otherwise from the plateaus of the
+# pressure itself), and a first order model and a first order plus dead time (FOPDT) model are fitted to the response
+# to each step. Both fits are linear least squares on the log of the remaining error, ln((y_inf - y)/(y_inf - y0)),
+# which is -t/tau for a first order system and -(t - theta)/tau with a dead time theta. They are solved for all steps
+# at once with per-step weighted sums (np.bincount), and many logs are analysed in parallel.
 
 # import libraries
 import numpy as np
 import matplotlib.pyplot as plt
 import pandas as pd
 import click
+import glob
 import os
 import pyperclip
+from concurrent.futures import ProcessPoolExecutor
 from utils import *
 
-# use latex for font rendering, use serif font
-plt.rc('text', usetex=True)
-plt.rc('font', family='serif')
+# use latex for font rendering (set AFM_MATHTEXT=1 to use mathtext instead, which starts faster)
+set_text_rendering()
 
-@click.command()
-@click.option('--use-clipboard-for-experiment-folder-name', '-c', default=True, help='Use the clipboard for the experiment folder name.')
-
-def main(use_clipboard_for_experiment_folder_name):
-    if use_clipboard_for_experiment_folder_name:
-        # get the filename from the clipboard
-        file_name = pyperclip.paste()
-    else:
-        file_name = input('Please Paste your filename here (no file extension, just the name): ')
-    
-    # make the direcrory path absolute (user would have to change this depending on their Dropbox folder name)
-    directory = os.path.expanduser('~/Dropbox (MIT)/Qatar 3D Printing/Reports/report-data-dump')
+# fraction of the step size between which the remaining error is fitted (outside, the log is dominated by noise)
+FIT_ERROR_LIMITS = (0.05, 0.95)
 
-    # print the directory
-    print('Log Directory: {}'.format(directory))
+def read_pressure_log(file_path, time_column=0, pressure_column=1, command_column=None, loop_delay=10e-3):
+    """
+    Reads a tab separated pressure log and returns its time (s), pressure and command (None if the log has no command
+    column) samples. Time samples are in loop iterations of loop_delay seconds.
+    """
+    df = pd.read_csv(file_path, sep='\t')
 
-    # add the .txt extension to the filename
-    filename = file_name + '.txt'
+    # convert time steps to seconds given that the sampling frequency is 1/T
+    time_seconds = df.iloc[:, time_column].to_numpy(dtype=np.float64) * loop_delay
+    pressures = df.iloc[:, pressure_column].to_numpy(dtype=np.float64)
+    commands = df.iloc[:, command_column].to_numpy(dtype=np.float64) if command_column is not None else None
 
-    # make sure the filename + directory exists
-    fullfile = os.path.join(directory,filename)
+    return time_seconds, pressures, commands
 
-    # if the file doesn't exist, print an error message and exit
-    if not os.path.isfile(fullfile):
-        print('File {} does not exist!'.format(fullfile))
-        exit()
+def get_time_slice(time_seconds, slice_start=None, slice_end=None):
+    """
+    Returns the slice of the (sorted) time samples between slice_start and slice_end seconds.
+    """
+    start_idx = np.searchsorted(time_seconds, slice_start, side='left') if slice_start is not None else 0
+    end_idx = np.searchsorted(time_seconds, slice_end, side='right') if slice_end is not None else len(time_seconds)
+
+    return slice(start_idx, end_idx)
+
+def find_response_plateaus(response, window=50, tolerance=0.01):
+    """
+    Returns the start and end samples of the plateaus of a response, i.e. the runs of samples where every window of
+    window samples has a range (max - min) below tolerance, and their levels (the mean of the last window samples,
+    which is the most settled part of the plateau).
+    """
+    if len(response) < window:
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int64), np.array([])
+
+    # windows of the response that are steady
+    windows = np.lib.stride_tricks.sliding_window_view(response, window)
+    steady = (windows.max(axis=1) - windows.min(axis=1)) < tolerance
+
+    # runs of steady windows, as samples [start, end) covered by the windows of the run
+    edges = np.diff(np.concatenate([[0], steady.astype(np.int8), [0]]))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1) + window - 1
+
+    # level of every plateau from the cumulative sum of the response
+    cumulative = np.concatenate([[0.0], np.cumsum(response)])
+    levels = (cumulative[ends] - cumulative[ends - window]) / window
+
+    return starts, ends, levels
+
+def find_response_steps(response, window=50, tolerance=0.01, min_step=0.05):
+    """
+    Finds the steps of a response without a command: the jumps of more than min_step between the levels of consecutive
+    plateaus (plateaus in between whose levels differ by less, e.g. while the response creeps into its final value, are
+    part of the same level). Returns the step start samples (the end of the plateau before the jump), the step end
+    samples (the end of the last plateau before the next jump), and the levels before and after every step. The step
+    starts once the response has left the plateau, so the dead time is measured from there.
+    """
+    starts, ends, levels = find_response_plateaus(response, window, tolerance)
+    jumps = np.flatnonzero(np.abs(np.diff(levels)) > min_step)
+
+    # the level after a jump is the one of the last plateau before the next jump
+    settled = np.append(jumps[1:], len(levels) - 1)
+
+    return ends[jumps], ends[settled], levels[jumps], levels[settled]
+
+def find_command_steps(response, command, plateau_samples=50):
+    """
+    Finds the steps of a response from its command. Returns the step start samples (where the command changes), the
+    step end samples (the next change), and the response levels before and after every step, i.e. the mean of the
+    plateau_samples samples before the step and before the next step.
+    """
+    step_starts, _, _ = get_command_steps(command)
+    step_ends = np.append(step_starts[1:], len(response))
+
+    # mean of the plateau_samples samples before every sample from the cumulative sum of the response
+    cumulative = np.concatenate([[0.0], np.cumsum(response)])
+    def level_before(indices, earliest):
+        first = np.maximum(indices - plateau_samples, earliest)
+        return (cumulative[indices] - cumulative[first]) / np.maximum(indices - first, 1)
+
+    previous_starts = np.concatenate([[0], step_starts[:-1]])
+    return step_starts, step_ends, level_before(step_starts, previous_starts), level_before(step_ends, step_starts)
+
+def fit_step_responses(time_seconds, response, step_starts, step_ends, initial_levels, final_levels, confidence=0.95, error_limits=FIT_ERROR_LIMITS):
+    """
+    Fits a first order model and a FOPDT model to the response to every step [start, end) at once. Returns a dataframe
+    with one row per step with the time constants and dead time, and their confidence intervals (NaN where a step has
+    too few samples to fit, and an infinite bound where the interval includes a non-decaying response).
+    """
+    num_steps = len(step_starts)
+    samples = np.arange(len(response))
+
+    # step of every sample (-1 before the first step or after the end of its step)
+    step = np.searchsorted(step_starts, samples, side='right') - 1
+    step = np.where((step >= 0) & (samples < step_ends[np.maximum(step, 0)]), step, -1) if num_steps > 0 else np.full(len(response), -1)
+    safe_step = np.maximum(step, 0)
+
+    # remaining error of every sample as a fraction of its step, which decays as exp(-(t - theta)/tau)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        remaining = (final_levels[safe_step] - response) / (final_levels[safe_step] - initial_levels[safe_step]) if num_steps > 0 else np.zeros(len(response))
+        used = (step >= 0) & (remaining > error_limits[0]) & (remaining < error_limits[1])
+        z = np.log(np.where(used, remaining, 1.0))
+    x = time_seconds - time_seconds[step_starts[safe_step]] if num_steps > 0 else np.zeros(len(response))
+
+    # the noise of ln(remaining) grows as 1/remaining, so the samples are weighted by remaining^2 (weighted least squares)
+    weights = np.where(used, remaining, 0.0)**2
+
+    # per step (weighted) sums of the regression, only over the samples that are used
+    def step_sum(values):
+        return np.bincount(step[used], weights=values[used], minlength=num_steps) if num_steps > 0 else np.array([])
+    n = step_sum(np.ones(len(response)))
+    sw, swx, swz, swxx, swxz, swzz = step_sum(weights), step_sum(weights*x), step_sum(weights*z), step_sum(weights*x*x), step_sum(weights*x*z), step_sum(weights*z*z)
 
-    # read the data from the CSV file
-    df = pd.read_csv(fullfile, sep=r'\t')
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # first order model: z = a x (through the origin, since the response starts decaying at the step), tau = -1/a
+        a = swxz / swxx
+        dof = n - 1
+        variance = np.maximum(swzz - a*swxz, 0) / dof
+        a_error = np.sqrt(variance / swxx) * scipy_stats.t.ppf((1 + confidence) / 2, np.where(dof > 0, dof, np.nan))
+        tau, tau_low, tau_high = get_time_constant_interval(a, a_error)
 
-    # get the time and pressure data. Time samples is the first column, and pressure samples is the second column
-    time_samples = df.iloc[:,0]
-    pressure_samples = df.iloc[:,1]
+        # FOPDT model: z = a x + b, tau = -1/a and theta = b tau = -b/a
+        mean_x = swx / sw
+        sxx_c = swxx - swx*swx/sw
+        sxz_c = swxz - swx*swz/sw
+        szz_c = swzz - swz*swz/sw
+        a_d = sxz_c / sxx_c
+        b_d = (swz - a_d*swx) / sw
+        dof_d = n - 2
+        variance_d = np.maximum(szz_c - a_d*sxz_c, 0) / dof_d
+        t_d = scipy_stats.t.ppf((1 + confidence) / 2, np.where(dof_d > 0, dof_d, np.nan))
+        var_a, var_b, cov_ab = variance_d / sxx_c, variance_d * (1/sw + mean_x*mean_x/sxx_c), -mean_x * variance_d / sxx_c
+        tau_d, tau_d_low, tau_d_high = get_time_constant_interval(a_d, np.sqrt(var_a) * t_d)
 
-    # define the slice to look at for the first order response
-    slice_start = 560 # seconds
-    slice_end = 588 # seconds
+        # dead time interval from the linearised variance of -b/a
+        dead_time = -b_d / a_d
+        dead_time_error = np.sqrt(np.maximum(var_b/a_d**2 + b_d**2*var_a/a_d**4 - 2*b_d*cov_ab/a_d**3, 0)) * t_d
 
-    # convert time steps to seconds given that the sampling frequency is 1/T where T = 10 ms
-    T = 10e-3 # second period loop
-    sampling_frequency = 1/T # Hz
-    time_seconds = time_samples/sampling_frequency
+    return pd.DataFrame({
+        'step_time': time_seconds[step_starts] if num_steps > 0 else np.array([]),
+        'initial_level': initial_levels,
+        'final_level': final_levels,
+        'num_samples': n.astype(np.int64),
+        'tau': tau,
+        'tau_low': tau_low,
+        'tau_high': tau_high,
+        'fopdt_tau': tau_d,
+        'fopdt_tau_low': tau_d_low,
+        'fopdt_tau_high': tau_d_high,
+        'dead_time': dead_time,
+        'dead_time_low': dead_time - dead_time_error,
+        'dead_time_high': dead_time + dead_time_error,
+    })
 
-    # get the indices of the slice start and end
-    slice_start_idx = np.where(np.abs(time_seconds - slice_start) < 1e-2)[0][0]
-    slice_end_idx = np.where(np.abs(time_seconds - slice_end) < 1e-2)[0][0]
+def get_time_constant_interval(slope, slope_error):
+    """
+    Returns the time constant -1/slope of a decay rate and its interval from the interval of the slope (the upper bound
+    is infinite where the slope interval reaches 0).
+    """
+    tau = np.where(slope < 0, -1/slope, np.nan)
+    tau_low = -1/(slope - slope_error)
+    tau_high = np.where(slope + slope_error < 0, -1/(slope + slope_error), np.inf)
 
-    # get the data slices
-    time_seconds = time_seconds[slice_start_idx:slice_end_idx]
-    pressures = pressure_samples[slice_start_idx:slice_end_idx]
+    return tau, np.where(np.isnan(tau), np.nan, tau_low), np.where(np.isnan(tau), np.nan, tau_high)
 
+def characterize_pressure_log(file_path, loop_delay=10e-3, command_column=None, slice_start=None, slice_end=None, plateau_window=50, plateau_tolerance=0.01, min_step=0.05, confidence=0.95):
+    """
+    Finds and fits every step of one pressure log. Returns (file, dataframe of the steps, error message or None), so
+    that a failing file does not stop the batch.
+    """
+    try:
+        time_seconds, pressures, commands = read_pressure_log(file_path, command_column=command_column, loop_delay=loop_delay)
+
+        # get the data slices
+        data_slice = get_time_slice(time_seconds, slice_start, slice_end)
+        time_seconds, pressures = time_seconds[data_slice], pressures[data_slice]
+
+        # find the steps and fit them
+        if commands is not None:
+            steps = find_command_steps(pressures, commands[data_slice], plateau_window)
+        else:
+            steps = find_response_steps(pressures, plateau_window, plateau_tolerance, min_step)
+        fits = fit_step_responses(time_seconds, pressures, *steps, confidence=confidence)
+        fits.insert(0, 'step', np.arange(len(fits)))
+        fits.insert(0, 'file', os.path.basename(file_path))
+        return file_path, fits, None
+    except Exception as e:
+        return file_path, pd.DataFrame(), f'{type(e).__name__}: {e}'
+
+def plot_step_fits(file_path, fits, loop_delay=10e-3, command_column=None):
+    """
+    Plots the pressure response of a log with the FOPDT fit of every step.
+    """
+    time_seconds, pressures, _ = read_pressure_log(file_path, command_column=command_column, loop_delay=loop_delay)
 
     # plot the data
-    plt.plot(time_seconds, pressures)
+    plt.plot(time_seconds, pressures, label='Pressure')
+
+    # plot the fit of every step, from the step until the response is within 1% of the final level
+    for i, fit in enumerate(fits.itertuples()):
+        if np.isnan(fit.fopdt_tau):
+            continue
+        dead_time = max(fit.dead_time, 0)
+        t = np.linspace(0, dead_time + 5*fit.fopdt_tau, 200)
+        model = fit.final_level + (fit.initial_level - fit.final_level)*np.exp(-np.maximum(t - dead_time, 0)/fit.fopdt_tau)
+        plt.plot(fit.step_time + t, model, 'k--', linewidth=0.8, label='FOPDT fit' if i == 0 else None)
+
     plt.xlabel('Time (s)')
     plt.ylabel('Pressure (psi)')
     plt.title('PGMFC Pressure Command Response')
+    plt.legend()
     plt.tight_layout()
     plt.show()
 
+@click.command()
+@click.option('--use-clipboard-for-experiment-folder-name', '-c', default=True, help='Use the clipboard for the experiment folder name (when no file pattern is given).')
+@click.option('--directory', '-d', default='~/Dropbox (MIT)/Qatar 3D Printing/Reports/report-data-dump', help='Directory where the pressure logs are stored.')
+@click.option('--file-pattern', '-p', default=None, help='Glob pattern (relative to the directory) of the pressure logs to analyse in parallel.')
+@click.option('--loop-delay', '-l', default=10e-3, help='Loop delay of the time samples in seconds.')
+@click.option('--command-column', '-C', default=None, type=int, help='Column of the pressure command (steps are found from the pressure plateaus if not given).')
+@click.option('--slice-start', default=None, type=float, help='Only analyse the samples after this time (s).')
+@click.option('--slice-end', default=None, type=float, help='Only analyse the samples before this time (s).')
+@click.option('--plateau-window', '-w', default=50, help='Number of samples of the windows a plateau is made of (and averaged over for the levels).')
+@click.option('--plateau-tolerance', default=0.01, help='Maximum pressure range (psi) within a plateau window.')
+@click.option('--min-step', default=0.05, help='Minimum pressure change (psi) between plateaus that counts as a step.')
+@click.option('--confidence', default=0.95, help='Confidence level of the intervals.')
+@click.option('--workers', '-j', default=os.cpu_count(), help='Number of worker processes.')
+@click.option('--output-file', '-o', default='pgmfc-steps.csv', help='CSV file to write the results to (relative to the directory).')
+@click.option('--plot', '-P', default=True, help='Plot the fits of the first log.')
+
+def main(use_clipboard_for_experiment_folder_name, directory, file_pattern, loop_delay, command_column, slice_start, slice_end, plateau_window, plateau_tolerance, min_step, confidence, workers, output_file, plot):
+    # make the direcrory path absolute (user would have to change this depending on their Dropbox folder name)
+    directory = os.path.expanduser(directory)
+
+    # print the directory
+    print('Log Directory: {}'.format(directory))
+
+    if file_pattern is None:
+        if use_clipboard_for_experiment_folder_name:
+            # get the filename from the clipboard
+            file_name = pyperclip.paste()
+        else:
+            file_name = input('Please Paste your filename here (no file extension, just the name): ')
+
+        # add the .txt extension to the filename
+        file_pattern = glob.escape(file_name + '.txt')
+
+    # find the files matching the pattern
+    file_paths = sorted(path for path in glob.glob(os.path.join(directory, file_pattern)) if os.path.isfile(path))
+
+    # if no file matches, print an error message and exit
+    if len(file_paths) == 0:
+        print('No files matching {} in {}!'.format(file_pattern, directory))
+        exit()
+
+    # find and fit the steps of all files in parallel
+    print(f'\n\n Analysing {len(file_paths)} files with {workers} workers\n\n')
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(characterize_pressure_log, path, loop_delay, command_column, slice_start, slice_end, plateau_window, plateau_tolerance, min_step, confidence) for path in file_paths]
+        results = [future.result() for future in futures]
+
+    for file_path, fits, error in results:
+        if error is not None:
+            print(f' {os.path.basename(file_path)}: FAILED ({error})')
+        else:
+            print(f' {os.path.basename(file_path)}: {len(fits)} steps, median tau {fits["tau"].median():.3f} s, median FOPDT tau {fits["fopdt_tau"].median():.3f} s, median dead time {fits["dead_time"].median():.3f} s')
+
+    # save the results
+    fits = [fits for _, fits, error in results if error is None and len(fits) > 0]
+    if len(fits) > 0:
+        output_path = os.path.join(directory, output_file)
+        pd.concat(fits, ignore_index=True).to_csv(output_path, index=False)
+        print(f'\n Results saved to {output_path}\n')
+
+    # plot the fits of the first log
+    if plot and len(fits) > 0:
+        first = fits[0]
+        plot_step_fits(os.path.join(directory, first['file'].iloc[0]), first, loop_delay, command_column)
+
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -3,130 +3,117 @@
 
 import numpy as np
 import matplotlib.pyplot as plt
+import click
 import time
 
-# specify the amount of time to wait between each loop iteration (basically specifying how fast to run the loop)
-loopDelay = 0.01 # units: seconds --> clock rate = 1/loopDelay
-clockRate = 1/loopDelay # units: Hz
-N = 1000 # number of loop iterations
-
-# print the loop delay and clock rate
-print(f'\n\nLoop delay: {loopDelay} seconds')
-print(f'Loop rate: {clockRate} loops/second\n')
-
-# define the triangle wave constants
-xOffset = 30000
-yOffset = 30000
-xRange = 10000
-yRange = 10000
-xFreq = 1 # Hz
-yFreq = 0.1 # Hz
-xPeriod = 1/xFreq # seconds per cycle
-yPeriod = 1/yFreq # seconds per cycle
-
-# calculate the triangle wave amplitudes
-xAmp = xRange/2
-yAmp = yRange/2
-
-# convert amps and offsets to units of microns (divide by 1000)
-xAmp = xAmp/1000
-yAmp = yAmp/1000
-xOffset = xOffset/1000
-yOffset = yOffset/1000
-
-# get the amount of time between each loop iteration
-loop_times = []
-for i in range(0,1000):
-    t0 = time.time()
-    t1 = time.time()
-    loop_times.append(t1-t0)
-
-# calculate the average clock period
-baseClockPeriod = np.mean(loop_times) # units: seconds per clock cycle
-
-# print the average clock period
-print(f'\n\nAverage clock period: {baseClockPeriod} seconds per loop iteration')
-
-# calculate the average clock rate
-baseClockRate = 1/baseClockPeriod # units: clock cycles per second
-
-# print the average clock rate
-print(f'\n\nAverage clock rate: {baseClockRate} Hz')
-
-# assert that the user specified loopDelay is less than the baseClockPeriod
-assert loopDelay > baseClockPeriod, "loopDelay must be less than the baseClockPeriod"
-
-# calcuate the corrected x and y freqyuencies/periods
-xPeriodCorrected = xPeriod*clockRate
-yPeriodCorrected = yPeriod*clockRate
-xFreqCorrected = 1/xPeriodCorrected
-yFreqCorrected = 1/yPeriodCorrected
-
-# print the corrected x and y frequencies/periods
-print(f'\n\nCorrected x frequency: {xFreqCorrected} cycles per loop iteration')
-print(f'Corrected y frequency: {yFreqCorrected} cycles per loop iteration')
-print(f'Corrected x period: {xPeriodCorrected} loop iterations per cycle')
-print(f'Corrected y period: {yPeriodCorrected} loop iterations per cycle\n')
-
-
-# define x and y command functions
+# define x and y command functions (i can be a single loop iteration or an array of them)
 def xCommand(Amp,fi,offset,Ti,i):
-    return 4*Amp*fi*i - Amp + offset if i >= 0 and i < Ti/2 else -4*Amp*fi*i + 3*Amp + offset 
+    return np.where((i >= 0) & (i < Ti/2), 4*Amp*fi*i - Amp + offset, -4*Amp*fi*i + 3*Amp + offset)
 
 def yCommand(Amp,fi,offset,Ti,i):
-    return -4*Amp*fi*i + Amp + offset if i >= 0 and i < Ti/2 else 4*Amp*fi*i - 3*Amp + offset
-
-# initialize the x and y commands
-xCommands = []
-yCommands = []
-
-# perform the main loop
-i = -1
-ix = -1
-iy = -1
-while i < N:
-    # get the current time
-    t0 = time.time()
-
-    # specify the loop iteration
-    ix = ix + 1 if ix < xPeriodCorrected else 0
-    iy = iy + 1 if iy < yPeriodCorrected else 0
-    i += 1
-
-    print(f'ix: {ix}, iy: {iy}')
-
-    # calculate the current x and y commands
-    xCommandCurrent = xCommand(xAmp,xFreqCorrected,xOffset,xPeriodCorrected,ix)
-    yCommandCurrent = yCommand(yAmp,yFreqCorrected,yOffset,yPeriodCorrected,iy)
-
-    # print the current x and y commands
-    print(f'xCommandCurrent: {xCommandCurrent}, yCommandCurrent: {yCommandCurrent}')
-
-    # append the current x and y commands to the x and y commands lists
-    xCommands.append(xCommandCurrent)
-    yCommands.append(yCommandCurrent)
-
-    # get the current time
-    t1 = time.time()
-
-    # calculate the time to wait before the next loop iteration
-    waitTime = loopDelay - (t1-t0)
-
-    print(f'waitTime: {waitTime}')
-
-    # wait until the next loop iteration
-    time.sleep(waitTime)
-
-# plot the x and y commands in a 2x1 subplot
-fig, ax = plt.subplots(2,1)
-
-# plot the x commands
-ax[0].plot(xCommands)
-ax[0].set_title('xCommands')
-
-# plot the y commands
-ax[1].plot(yCommands)
-ax[1].set_title('yCommands')
-
-# show the plot
-plt.show()
\ No newline at end of file
+    return np.where((i >= 0) & (i < Ti/2), -4*Amp*fi*i + Amp + offset, 4*Amp*fi*i - 3*Amp + offset)
+
+def getLoopIndices(periodCorrected, N):
+    """
+    Returns the per-axis loop iteration counters of the N+1 loop iterations of the scan loop, where the counter is
+    incremented until it reaches the (corrected) period and then wraps around to 0.
+    """
+    # the counter goes 0, 1, ..., ceil(period) and wraps around, so each cycle is ceil(period) + 1 iterations long
+    cycleLength = int(np.ceil(periodCorrected)) + 1
+
+    return np.arange(N+1) % cycleLength
+
+def getScanCommandTrajectory(xOffset, yOffset, xRange, yRange, xFreq, yFreq, loopDelay, N):
+    """
+    Returns the X and Y commands (um) of the first N+1 iterations of the scan loop as NumPy arrays, without running the
+    loop. Offsets and ranges are in nm, frequencies in Hz and the loop delay in seconds.
+    """
+    # calculate the triangle wave amplitudes and convert amps and offsets to units of microns (divide by 1000)
+    xAmp = xRange/2/1000
+    yAmp = yRange/2/1000
+    xOffset = xOffset/1000
+    yOffset = yOffset/1000
+
+    # calcuate the corrected x and y frequencies/periods (in loop iterations)
+    clockRate = 1/loopDelay
+    xPeriodCorrected = clockRate/xFreq
+    yPeriodCorrected = clockRate/yFreq
+    xFreqCorrected = 1/xPeriodCorrected
+    yFreqCorrected = 1/yPeriodCorrected
+
+    # calculate the x and y commands of all loop iterations at once
+    ix = getLoopIndices(xPeriodCorrected, N)
+    iy = getLoopIndices(yPeriodCorrected, N)
+    xCommands = xCommand(xAmp,xFreqCorrected,xOffset,xPeriodCorrected,ix)
+    yCommands = yCommand(yAmp,yFreqCorrected,yOffset,yPeriodCorrected,iy)
+
+    return xCommands, yCommands
+
+def paceScanCommands(xCommands, yCommands, loopDelay, callback=None):
+    """
+    Real-time mode for timing studies: steps through the commands one loop iteration every loopDelay seconds (calling
+    callback(i, xCommand, yCommand) if given) and returns the time (s) at which each iteration started. The iterations
+    are scheduled on absolute deadlines, so the time spent in an iteration doesn't accumulate as drift.
+    """
+    iterationTimes = np.empty(len(xCommands))
+    t0 = time.perf_counter()
+    for i in range(len(xCommands)):
+        # wait until the start of this loop iteration
+        waitTime = t0 + i*loopDelay - time.perf_counter()
+        if waitTime > 0:
+            time.sleep(waitTime)
+        iterationTimes[i] = time.perf_counter() - t0
+
+        if callback is not None:
+            callback(i, xCommands[i], yCommands[i])
+
+    return iterationTimes
+
+@click.command()
+@click.option('--loop-delay', '-l', default=0.01, help='Time between loop iterations in seconds (clock rate = 1/loop delay).')
+@click.option('--num-iterations', '-n', default=1000, help='Number of loop iterations.')
+@click.option('--x-offset', default=30000.0, help='X offset in nm.')
+@click.option('--y-offset', default=30000.0, help='Y offset in nm.')
+@click.option('--x-range', default=10000.0, help='X range in nm.')
+@click.option('--y-range', default=10000.0, help='Y range in nm.')
+@click.option('--x-freq', default=1.0, help='X frequency in Hz.')
+@click.option('--y-freq', default=0.1, help='Y frequency in Hz.')
+@click.option('--real-time', '-r', default=False, help='Also step through the commands in real time (one iteration every loop delay) and report the timing jitter.')
+
+def main(loop_delay, num_iterations, x_offset, y_offset, x_range, y_range, x_freq, y_freq, real_time):
+    # print the loop delay and clock rate
+    print(f'\n\nLoop delay: {loop_delay} seconds')
+    print(f'Loop rate: {1/loop_delay} loops/second\n')
+
+    # print the corrected x and y frequencies/periods
+    print(f'\n\nCorrected x frequency: {x_freq*loop_delay} cycles per loop iteration')
+    print(f'Corrected y frequency: {y_freq*loop_delay} cycles per loop iteration')
+    print(f'Corrected x period: {1/(x_freq*loop_delay)} loop iterations per cycle')
+    print(f'Corrected y period: {1/(y_freq*loop_delay)} loop iterations per cycle\n')
+
+    # calculate the whole trajectory at once
+    xCommands, yCommands = getScanCommandTrajectory(x_offset, y_offset, x_range, y_range, x_freq, y_freq, loop_delay, num_iterations)
+
+    if real_time:
+        # step through the trajectory in real time and compare the iteration start times to the schedule
+        iterationTimes = paceScanCommands(xCommands, yCommands, loop_delay)
+        lateness = iterationTimes - np.arange(len(iterationTimes))*loop_delay
+        print(f'\n\nReal time: {len(iterationTimes)} iterations in {iterationTimes[-1]:.3f} s (expected {(len(iterationTimes)-1)*loop_delay:.3f} s)')
+        print(f'Iteration start lateness: mean {lateness.mean()*1000:.3f} ms, max {lateness.max()*1000:.3f} ms\n')
+
+    # plot the x and y commands in a 2x1 subplot
+    fig, ax = plt.subplots(2,1)
+
+    # plot the x commands
+    ax[0].plot(xCommands)
+    ax[0].set_title('xCommands')
+
+    # plot the y commands
+    ax[1].plot(yCommands)
+    ax[1].set_title('yCommands')
+
+    # show the plot
+    plt.show()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+# This code applies a chain of image corrections (plane subtraction, per-line polynomial leveling, median line correction
+# and scar removal, see utils.correct_image) to the topography images of many experiment folders at once, without
+# opening any windows. The corrected image of every folder is saved as a .npy file and, optionally, as a figure.
+
+# Import libraries (the Agg backend has to be selected before pyplot is imported)
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import numpy as np
+import click
+import glob
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from utils import set_text_rendering, load_cached_image, correct_image, parse_image_corrections
+
+def correct_folder_image(folder_dir, channel, corrections, save_format=None):
+    """
+    Corrects the image channel of one folder and saves it as <channel>-corrected.npy (and as a figure in save_format
+    if given). Returns (folder, time spent correcting in s, error message or None), so that a failing folder does not
+    stop the batch.
+    """
+    try:
+        image = load_cached_image(folder_dir, channel)
+
+        # correct the image
+        start_time = time.perf_counter()
+        corrected = correct_image(image, corrections)
+        elapsed = time.perf_counter() - start_time
+
+        # save the corrected image through a temporary file so readers never see a partial file
+        npy_path = os.path.join(folder_dir, channel + '-corrected.npy')
+        tmp_path = npy_path + f'.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.save(f, corrected.astype(image.dtype))
+        os.replace(tmp_path, npy_path)
+
+        # save the figure of the raw and corrected images side by side
+        if save_format is not None:
+            fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(10, 5))
+            fig.suptitle(os.path.basename(folder_dir))
+            fig.colorbar(ax1.imshow(image, cmap='plasma'), ax=ax1, fraction=0.046, pad=0.04)
+            ax1.set_title('Raw')
+            fig.colorbar(ax2.imshow(corrected, cmap='plasma'), ax=ax2, fraction=0.046, pad=0.04)
+            ax2.set_title('Corrected')
+            plt.tight_layout()
+            fig.savefig(os.path.join(folder_dir, channel + '-corrected.' + save_format))
+            plt.close(fig)
+
+        return folder_dir, elapsed, None
+    except Exception as e:
+        plt.close('all')
+        return folder_dir, 0.0, f'{type(e).__name__}: {e}'
+
+@click.command()
+@click.option('--directory', '-d', default='~/Dropbox (MIT)/Qatar 3D Printing/LabVIEW Files (Malek)/2023-Qatar-3D-Printing/afm-data-logs/', help='Directory where the data is stored')
+@click.option('--folder-pattern', '-p', default='data-log-*', help='Glob pattern (relative to the directory) of the data log folders to correct.')
+@click.option('--channel', '-c', default='topo-image', help='Image channel to correct (topo-image or error-image).')
+@click.option('--corrections', '-C', default='plane,line,median,scars', help='Comma separated chain of corrections (plane, line[:order], median, scars[:threshold]).')
+@click.option('--save-format', '-f', default='png', help='Save format for the figures (png, pdf or svg), or none to only save the .npy files.')
+@click.option('--workers', '-j', default=os.cpu_count(), help='Number of worker processes.')
+
+def main(directory, folder_pattern, channel, corrections, save_format, workers):
+    """
+    Corrects the image of every data log folder matching the pattern in a process pool and prints a summary.
+    """
+    # check the corrections before starting the workers
+    parse_image_corrections(corrections)
+    save_format = None if save_format == 'none' else save_format
+    if save_format is not None:
+        # use latex for font rendering (set AFM_MATHTEXT=1 to use mathtext instead, which starts faster)
+        set_text_rendering()
+
+    # expand the directory and find the data log folders with the image
+    directory = os.path.expanduser(directory)
+    folders = sorted(path for path in glob.glob(os.path.join(directory, folder_pattern)) if os.path.isfile(os.path.join(path, channel + '.csv')))
+
+    # if no folder matches, print an error message and exit
+    if len(folders) == 0:
+        print('No folders matching {} with a {}.csv in {}!'.format(folder_pattern, channel, directory))
+        exit()
+
+    # correct the folders in parallel
+    print(f'\n\n Correcting {channel} of {len(folders)} folders ({corrections}) with {workers} workers\n\n')
+    start_time = time.perf_counter()
+    failed = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(correct_folder_image, folder, channel, corrections, save_format) for folder in folders]
+        for future in as_completed(futures):
+            folder_dir, elapsed, error = future.result()
+            if error is None:
+                print(f' {os.path.basename(folder_dir)}: corrected in {elapsed*1000:.1f} ms')
+            else:
+                failed += 1
+                print(f' {os.path.basename(folder_dir)}: FAILED ({error})')
+
+    print(f'\n\n Corrected {len(folders) - failed} folders ({failed} failed) in {time.perf_counter() - start_time:.2f} s\n\n')
+
+if __name__ == '__main__':
+    main()
@@ -4,21 +4,17 @@ import numpy as np
 import pyperclip
 import os
 import pandas as pd
+from utils import load_cached_channel, set_text_rendering
 
 # get the folder path from the clipboard
 folderPath = "/Users/malek8/Dropbox (MIT)/Qatar 3D Printing/LabVIEW Files (Malek)/2023-Qatar-3D-Printing/afm-data-logs/data-log-[17-13-59]-experiment"
 
-# use latex for font rendering
-plt.rc('text', usetex=True)
-plt.rc('font', family='serif')
+# use latex for font rendering (set AFM_MATHTEXT=1 to use mathtext instead, which starts faster)
+set_text_rendering()
 
-# load the data vectors (zCommand, obdyData)
-zCommandPath = os.path.join(folderPath, 'z-command.csv')
-obdyDataPath = os.path.join(folderPath, 'obd-y.csv')
-
-# load the data vectors
-xData = pd.read_csv(zCommandPath, header=None).values
-yData = pd.read_csv(obdyDataPath, header=None).values
+# load the data vectors (zCommand, obdyData) through the binary channel cache
+xData = load_cached_channel(folderPath, 'z-command')
+yData = load_cached_channel(folderPath, 'obd-y')
 
 # Initial plot setup
 fig, (ax1, ax2, ax_zoom) = plt.subplots(3, 1, figsize=(10, 8))
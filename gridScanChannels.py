@@ -0,0 +1,101 @@
+# This code reconstructs topography images from the streamed scan channels of data log folders that have no image logs
+# (topo-image.csv), by binning the (x-command, y-command, z-command) samples into a regular raster covering the scan
+# area of the experiment header. Trace (x increasing) and retrace (x decreasing) samples are binned into separate
+# images, and the channels are streamed in chunks so the memory use does not depend on the length of the experiment.
+
+# Import libraries (the Agg backend has to be selected before pyplot is imported)
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import numpy as np
+import click
+import glob
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from utils import set_text_rendering, grid_scan_channels
+
+def grid_folder(folder_dir, shape, z_channel, chunk_size, save_format=None):
+    """
+    Grids the scan channels of one folder and saves the trace and retrace images as <z_channel>-trace.npy and
+    <z_channel>-retrace.npy (and a figure in save_format if given). Returns (folder, elapsed time in s, number of
+    samples, error message or None), so that a failing folder does not stop the batch.
+    """
+    start_time = time.perf_counter()
+    try:
+        trace, retrace, gridder = grid_scan_channels(folder_dir, shape, z_channel, chunk_size)
+
+        # save the images
+        for name, image in [('trace', trace), ('retrace', retrace)]:
+            np.save(os.path.join(folder_dir, f'{z_channel}-{name}.npy'), image.astype(np.float32))
+
+        # save the figure of the trace and retrace images side by side
+        if save_format is not None:
+            x_range, y_range = gridder.x_range, gridder.y_range
+            fig, axs = plt.subplots(1, 2, figsize=(10, 5))
+            fig.suptitle(os.path.basename(folder_dir))
+            for ax, name, image in zip(axs, ['Trace', 'Retrace'], [trace, retrace]):
+                im = ax.imshow(image, cmap='plasma', extent=(x_range[0], x_range[1], y_range[0], y_range[1]))
+                fig.colorbar(im, ax=ax, fraction=0.046, pad=0.04)
+                ax.set_title(name)
+                ax.set_xlabel('X Command ($\\mu m$)')
+            axs[0].set_ylabel('Y Command ($\\mu m$)')
+            plt.tight_layout()
+            fig.savefig(os.path.join(folder_dir, f'{z_channel}-grid.{save_format}'))
+            plt.close(fig)
+
+        return folder_dir, time.perf_counter() - start_time, int(gridder.counts.sum()), None
+    except Exception as e:
+        plt.close('all')
+        return folder_dir, time.perf_counter() - start_time, 0, f'{type(e).__name__}: {e}'
+
+@click.command()
+@click.option('--directory', '-d', default='~/Dropbox (MIT)/Qatar 3D Printing/LabVIEW Files (Malek)/2023-Qatar-3D-Printing/afm-data-logs/', help='Directory where the data is stored')
+@click.option('--folder-pattern', '-p', default='data-log-*', help='Glob pattern (relative to the directory) of the data log folders to grid.')
+@click.option('--resolution', '-n', default='256,256', help='Comma separated number of rows and columns of the images.')
+@click.option('--z-channel', '-z', default='z-command', help='Channel to grid (e.g. z-command or obd-sum).')
+@click.option('--chunk-size', '-k', default=1000000, help='Number of samples read at a time.')
+@click.option('--save-format', '-f', default='png', help='Save format for the figures (png, pdf or svg), or none to only save the .npy files.')
+@click.option('--workers', '-j', default=os.cpu_count(), help='Number of worker processes.')
+
+def main(directory, folder_pattern, resolution, z_channel, chunk_size, save_format, workers):
+    """
+    Grids the scan channels of every data log folder matching the pattern in a process pool and prints a summary.
+    """
+    shape = tuple(int(value) for value in resolution.split(','))
+    save_format = None if save_format == 'none' else save_format
+    if save_format is not None:
+        # use latex for font rendering (set AFM_MATHTEXT=1 to use mathtext instead, which starts faster)
+        set_text_rendering()
+
+    # expand the directory and find the data log folders with the scan channels
+    directory = os.path.expanduser(directory)
+    channels = ['x-command', 'y-command', z_channel]
+    folders = sorted(path for path in glob.glob(os.path.join(directory, folder_pattern))
+                     if all(os.path.isfile(os.path.join(path, channel + '.csv')) for channel in channels + ['experiment-info']))
+
+    # if no folder matches, print an error message and exit
+    if len(folders) == 0:
+        print('No folders matching {} with {} in {}!'.format(folder_pattern, ', '.join(channels), directory))
+        exit()
+
+    # grid the folders in parallel
+    print(f'\n\n Gridding {z_channel} of {len(folders)} folders into {shape[0]}x{shape[1]} images with {workers} workers\n\n')
+    start_time = time.perf_counter()
+    failed, total_samples = 0, 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(grid_folder, folder, shape, z_channel, chunk_size, save_format) for folder in folders]
+        for future in as_completed(futures):
+            folder_dir, elapsed, num_samples, error = future.result()
+            if error is None:
+                total_samples += num_samples
+                print(f' {os.path.basename(folder_dir)}: {num_samples} samples in {elapsed:.2f} s')
+            else:
+                failed += 1
+                print(f' {os.path.basename(folder_dir)}: FAILED ({error})')
+    total_time = time.perf_counter() - start_time
+
+    print(f'\n\n Gridded {len(folders) - failed} folders ({failed} failed) in {total_time:.2f} s ({total_samples / total_time / 1e6:.2f} M samples/s)\n\n')
+
+if __name__ == '__main__':
+    main()
@@ -10,16 +10,16 @@ import pyperclip
 from utils import *
 from mpl_toolkits.axes_grid1 import make_axes_locatable 
 
-# use latex for font rendering, use serif font
-plt.rc('text', usetex=True)
-plt.rc('font', family='serif')
+# use latex for font rendering (set AFM_MATHTEXT=1 to use mathtext instead, which starts faster)
+set_text_rendering()
 
 @click.command()
 @click.option('--use-clipboard-for-experiment-folder-name', '-c', default=True, help='Use the clipboard for the experiment folder name.')
 @click.option('--topo-low', '-l', default=None, help='The default min color value to use for the topography plots.')
 @click.option('--topo-high', '-h', default=None, help='The default max color value to use for the topography plots.')
+@click.option('--corrections', '-C', default='', help='Comma separated chain of corrections applied to the topography (plane, line[:order], median, scars[:threshold]).')
 
-def main(use_clipboard_for_experiment_folder_name, topo_low, topo_high):
+def main(use_clipboard_for_experiment_folder_name, topo_low, topo_high, corrections):
     """
     Plots the data from the AFM data log CSV file specified by the filename in the user's clipboard.
             
@@ -59,12 +59,18 @@ def main(use_clipboard_for_experiment_folder_name, topo_low, topo_high):
         topo_range = [topo_low, topo_high]
     
     # use a custom plot function to plot the data
-    plot_image(topo_fullfile, error_fullfile, topo_range)
+    plot_image(topo_fullfile, error_fullfile, topo_range, corrections)
 
-def plot_image(topo_fullfile, error_fullfile, topo_range=None):
-    # read the data from the CSV file
-    df = pd.read_csv(topo_fullfile, sep=r'\t', header=None)
-    df_error = pd.read_csv(error_fullfile, sep=r'\t', header=None)
+def plot_image(topo_fullfile, error_fullfile, topo_range=None, corrections=''):
+    # load the tiled pyramids of both images at the same time (built and cached next to the images on the first read)
+    topo_pyramid, error_pyramid = load_image_pyramids([topo_fullfile, error_fullfile])
+
+    # remove the tilt and the line offsets of the topography (e.g. 'plane,line,median,scars')
+    if corrections:
+        topo_pyramid = ImagePyramid.build(correct_image(topo_pyramid.data, corrections))
+
+    # the full resolution topography (a memory map unless it was corrected)
+    img = topo_pyramid.data
 
     # obtain the path of the experimental log data
     directory = os.path.dirname(topo_fullfile)
@@ -85,12 +91,13 @@ def plot_image(topo_fullfile, error_fullfile, topo_range=None):
     title = get_experiment_info_string(header)
 
     # get the range of the scan for this experiment from the title
-    x_range = float(title.split('L_X$ = ')[1].split('~')[0])
-    y_range = float(title.split('L_Y$ = ')[1].split('~')[0])
+    # (the value is followed by ~$\mu m$ with LaTeX and by $~\mu m$ with mathtext)
+    x_range = float(title.split('L_X$ = ')[1].split('~')[0].rstrip('$'))
+    y_range = float(title.split('L_Y$ = ')[1].split('~')[0].rstrip('$'))
 
-    # get the xtick range by using the df shape
-    xtick_range = df.shape[0]
-    ytick_range = df.shape[1]
+    # get the xtick range by using the image shape
+    xtick_range = img.shape[1]
+    ytick_range = img.shape[0]
 
     # create ticks with 10 equally spaced ticks using the xtick_range and ytick_range
     xticks = np.linspace(0,xtick_range-1,10)
@@ -99,10 +106,6 @@ def plot_image(topo_fullfile, error_fullfile, topo_range=None):
     # get the experiment date string from the folder name
     experiment_time = os.path.basename(directory).split('[')[-1].split(']')[0].replace('-',':')[0:-3]
 
-    # get the image data
-    img = df.iloc[:,:].to_numpy().T
-    img_error = df_error.iloc[:,:].to_numpy().T
-
     # create a 2 column subplot
     fig, (ax1, ax2) = plt.subplots(1,2,figsize=(10,5))
 
@@ -111,20 +114,21 @@ def plot_image(topo_fullfile, error_fullfile, topo_range=None):
 
     # create the topo range
     if topo_range is None:
-        topo_range = [img.min(), img.max()]
+        topo_range = [topo_pyramid.vmin, topo_pyramid.vmax]
 
-    # Plot the topo image on the left.
-    im1 = ax1.imshow(img, cmap='plasma', clim=topo_range)
+    # Plot the topo image on the left (only the tiles in view are drawn, at the resolution of the screen).
+    topo_view = TiledImageView(ax1, topo_pyramid, cmap='plasma', clim=topo_range)
+    im1 = topo_view.image
     ax1.set_title('Topography Image ($\mu$m)')
 
     # Define the click event handler
     def onclick(event):
         if event.inaxes == ax1:
             x, y = int(event.xdata), int(event.ydata)
-            value = img[y, x]
-            ax1.annotate(f"{value:.2f}", (x, y), color='white' if img[y, x] < 0.5 else 'black', 
+            value = topo_pyramid.value(x, y)
+            ax1.annotate(f"{value:.2f}", (x, y), color='white' if value < 0.5 else 'black', 
                         ha='center', va='center')
-            fig.canvas.draw()
+            fig.canvas.draw_idle()
 
     # Set ticks.
     ax1.set_xticks(xticks)
@@ -144,7 +148,8 @@ def plot_image(topo_fullfile, error_fullfile, topo_range=None):
     fig.colorbar(im1, cax=cax)
 
     # plot the error image on the right
-    im2 = ax2.imshow(img_error,cmap='plasma')
+    error_view = TiledImageView(ax2, error_pyramid, cmap='plasma')
+    im2 = error_view.image
     ax2.set_title('Error Image (V)')
     ax2.set_xticks(xticks)
     ax2.set_yticks(yticks)
@@ -1,9 +1,9 @@
 import matplotlib.pyplot as plt
 import pandas as pd
+from utils import set_text_rendering
 
-# use latex for font rendering
-plt.rc('text', usetex=True)
-plt.rc('font', family='serif')
+# use latex for font rendering (set AFM_MATHTEXT=1 to use mathtext instead, which starts faster)
+set_text_rendering()
 
 # load the data using pd read csv
 csv_path = "/Users/malek8/Dropbox (MIT)/Qatar 3D Printing/Reports/mrl-report-23/bioprinting/afm-test-v1/afm-tracking-test.csv"
@@ -10,9 +10,8 @@ import os
 import pyperclip
 from utils import *
 
-# use latex for font rendering
-plt.rc('text', usetex=True)
-plt.rc('font', family='serif')
+# use latex for font rendering (set AFM_MATHTEXT=1 to use mathtext instead, which starts faster)
+set_text_rendering()
 
 # constant definitions
 LOOP_DELAY = 10 # ms
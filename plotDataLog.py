@@ -10,9 +10,8 @@ import os
 import pyperclip
 from utils import *
 
-# use latex for font rendering
-plt.rc('text', usetex=True)
-plt.rc('font', family='serif')
+# use latex for font rendering (set AFM_MATHTEXT=1 to use mathtext instead, which starts faster)
+set_text_rendering()
 
 # constant definitions
 LOOP_DELAY = 100 # ms
@@ -69,50 +68,26 @@ def plot_data(folder_dir, scale_factor,time_units,vs_distance, save, save_name,
         time_label = 'Time (ms)'
         div_factor = 1/1000
     
-    # define data filenames
-    info_file = os.path.join(folder_dir,'experiment-info.csv')
-    x_file = os.path.join(folder_dir,'x-command.csv')
-    y_file = os.path.join(folder_dir,'y-command.csv')
-    z_file = os.path.join(folder_dir,'z-command.csv')
-    obdx_file = os.path.join(folder_dir,'obd-x.csv')
-    obdy_file = os.path.join(folder_dir,'obd-y.csv')
-    obdsum_file = os.path.join(folder_dir,'obd-sum.csv')
-    metadata_path = os.path.join(folder_dir,'metadata.txt')
+    # open the experiment folder (each channel is only read from disk the first time it is used)
+    folder = ExperimentFolder(folder_dir)
 
-    # check if the pressure file exists. If it does, then set a flag to be true
-    pressure_file = os.path.join(folder_dir,'pressure.csv')
-    pressure_flag = os.path.isfile(pressure_file)
-
-    # specify the rt time samples file
-    rt_time_samples_file = os.path.join(folder_dir,'rt-time-samples.csv')
-
-    # get max column length
-    # num_cols = get_max_column_length(info_file)
-
-    # get the information dataframe
-    info_df = pd.read_csv(info_file, header=None)
+    # read all the plotted channels concurrently
+    folder.preload(['x-command','y-command','z-command','obd-x','obd-y','obd-sum','pressure'], verbose=True)
 
-    # read the data files
-    x_df = pd.read_csv(x_file, header=None)
-    y_df = pd.read_csv(y_file, header=None)
-    z_df = pd.read_csv(z_file, header=None)
-    obdx_df = pd.read_csv(obdx_file, header=None)
-    obdy_df = pd.read_csv(obdy_file, header=None)
-    obdsum_df = pd.read_csv(obdsum_file, header=None)
-    pressure_df = pd.read_csv(pressure_file, header=None) if pressure_flag else None
+    # check if the pressure file exists. If it does, then set a flag to be true
+    pressure_flag = 'pressure' in folder
 
     # set the header df to be the first 3 rows
-    df_header = get_log_header_info(info_df)
+    df_header = folder.header
 
     # get the loop delay from the metadata file
-    if os.path.exists(metadata_path):
-        LOOP_DELAY = 1/get_loop_delay(metadata_path) * 1000 # ms
+    loop_delay = 1/folder.loop_rate * 1000 if folder.loop_rate is not None else LOOP_DELAY # ms
 
     # specify time sample vector
-    time_samples = np.arange(0,x_df.shape[0],1)
+    time_samples = np.arange(0,folder.x_command.shape[0],1)
 
     # using loop delay, define the loop rate
-    loop_rate = 1/(LOOP_DELAY/1000)
+    loop_rate = 1/(loop_delay/1000)
 
     # using the sample rate, create the time vector
     time = time_samples/loop_rate
@@ -120,13 +95,13 @@ def plot_data(folder_dir, scale_factor,time_units,vs_distance, save, save_name,
     # convert to units of minutes
     time = time/div_factor
 
-    # get the data, where the first column is the X Command, Second is Y Command, Third is Z Command, Fourth is OBD X, Fifth is OBD Y, Sixth is OBD Sum
-    data = x_df.iloc[:,0].tolist()
-    data2 = y_df.iloc[:,0].tolist()
-    data3 = z_df.iloc[:,0].tolist()
-    data4 = obdx_df.iloc[:,0].tolist()
-    data5 = obdy_df.iloc[:,0].tolist()
-    data6 = np.array(obdsum_df.iloc[:,0].tolist())
+    # get the data (full resolution arrays, the plots are decimated to the axis width), where the first column is the X Command, Second is Y Command, Third is Z Command, Fourth is OBD X, Fifth is OBD Y, Sixth is OBD Sum
+    data = folder.x_command
+    data2 = folder.y_command
+    data3 = folder.z_command
+    data4 = folder.obd_x
+    data5 = folder.obd_y
+    data6 = np.asarray(folder.obd_sum)
 
     # create the plot title string. It should include the P, I, D parameter values in scientific notation, the LPS, Size X, and Size Y values, and the Z Set Point, Offset X, and Offset Y values
     title_string = get_experiment_info_string(df_header)
@@ -135,14 +110,14 @@ def plot_data(folder_dir, scale_factor,time_units,vs_distance, save, save_name,
     fig, ax = plt.subplots(3,2,figsize=(16,6))
 
     # plot the X Command
-    ax[0,0].plot(time, data, label='X Command')
+    plot_decimated(ax[0,0], time, data, label='X Command', pyramid=folder.pyramid('x-command'))
     ax[0,0].set_xlabel(time_label)
     ax[0,0].set_ylabel('X Command ($\mu m$)')
     ax[0,0].set_ylim([-50,50])
     ax[0,0].legend()
 
     # plot the Y Command
-    ax[1,0].plot(time, data2, label='Y Command')
+    plot_decimated(ax[1,0], time, data2, label='Y Command', pyramid=folder.pyramid('y-command'))
     ax[1,0].set_xlabel(time_label)
     ax[1,0].set_ylabel('Y Command ($\mu m$)')
     ax[1,0].set_ylim([-50,50])
@@ -156,14 +131,18 @@ def plot_data(folder_dir, scale_factor,time_units,vs_distance, save, save_name,
         z_xlabel = time_label
         z_xdata = time
 
-    ax[2,0].plot(z_xdata, data3, label='Z Command')
+    # (the Z Command vs. distance is not sorted along x, so it can't be decimated by x-axis window)
+    if vs_distance:
+        ax[2,0].plot(z_xdata, data3, label='Z Command')
+    else:
+        plot_decimated(ax[2,0], z_xdata, data3, label='Z Command', pyramid=folder.pyramid('z-command'))
     ax[2,0].set_xlabel(z_xlabel)
     ax[2,0].set_ylabel('Z Command ($\mu m$)')
     ax[2,0].set_ylim([-50,50])
     ax[2,0].legend()
 
     # plot the OBD X
-    ax[0,1].plot(time, data4, label='OBD X')
+    plot_decimated(ax[0,1], time, data4, label='OBD X', pyramid=folder.pyramid('obd-x'))
     ax[0,1].set_xlabel(time_label)
     ax[0,1].set_ylabel('OBD X ($V$)')
     ax[0,1].set_ylim([-data6.max()*scale_factor,data6.max()*scale_factor])
@@ -177,14 +156,14 @@ def plot_data(folder_dir, scale_factor,time_units,vs_distance, save, save_name,
     # ax[1,1].legend()
 
     # Plot the OBD Y
-    ax[1,1].plot(time, data5, label='OBD Y')
+    plot_decimated(ax[1,1], time, data5, label='OBD Y', pyramid=folder.pyramid('obd-y'))
     ax[1,1].set_xlabel(time_label)
     ax[1,1].set_ylabel('OBD Y ($V$)')
     ax[1,1].set_ylim([-data6.max()*scale_factor,data6.max()*scale_factor])
     ax[1,1].legend()
 
     # plot the OBD Sum
-    ax[2,1].plot(time, data6, label='OBD Sum')
+    plot_decimated(ax[2,1], time, data6, label='OBD Sum', pyramid=folder.pyramid('obd-sum'))
     ax[2,1].set_xlabel(time_label)
     ax[2,1].set_ylabel('OBD Sum ($V$)')
     ax[2,1].set_ylim([-data6.max()*scale_factor,data6.max()*scale_factor])
@@ -224,35 +203,33 @@ def plot_data(folder_dir, scale_factor,time_units,vs_distance, save, save_name,
         # initialize a new figure with 4 rows and 1 column
         fig2, ax2 = plt.subplots(4,1,figsize=(16,6))
 
-        # get the pressure data
-        pressure_data = pressure_df.iloc[:,0].tolist()
-
         # get the time samples based on the first/last time sample of the fpga time samples and interpolate based on the number of pressure samples
         initial_time = time[0]
         final_time = time[-1]
+        pressure_data = folder.pressure
         pressure_time_samples = np.linspace(initial_time, final_time, len(pressure_data))
 
         # in the first row plot the pressure data
-        ax2[0].plot(pressure_time_samples, pressure_data)
+        plot_decimated(ax2[0], pressure_time_samples, pressure_data, pyramid=folder.pyramid('pressure'))
         ax2[0].set_xlabel(time_label)
         ax2[0].set_ylabel('Pressure (mbar)')
         ax2[0].set_title(title_string)
         ax2[0].grid(True)
 
         # in the second row plot the OBD Y data
-        ax2[1].plot(time, data5)
+        plot_decimated(ax2[1], time, data5, pyramid=folder.pyramid('obd-y'))
         ax2[1].set_xlabel(time_label)
         ax2[1].set_ylabel('OBD Y ($V$)')
         ax2[1].grid(True)
 
         # in the third row plot the OBD X data
-        ax2[2].plot(time, data4)
+        plot_decimated(ax2[2], time, data4, pyramid=folder.pyramid('obd-x'))
         ax2[2].set_xlabel(time_label)
         ax2[2].set_ylabel('OBD X ($V$)')
         ax2[2].grid(True)
 
         # in the fourth row plot the OBD Sum data
-        ax2[3].plot(time, data6)
+        plot_decimated(ax2[3], time, data6, pyramid=folder.pyramid('obd-sum'))
         ax2[3].set_xlabel(time_label)
         ax2[3].set_ylabel('OBD Sum ($V$)')
         ax2[3].grid(True)
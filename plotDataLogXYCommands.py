@@ -11,10 +11,9 @@ import pyperclip
 import matplotlib as mpl
 from utils import *
 
-# use latex for font rendering
+# use latex for font rendering (set AFM_MATHTEXT=1 to use mathtext instead, which starts faster)
 mpl.rcParams.update(mpl.rcParamsDefault)
-plt.rc('text', usetex=True)
-plt.rc('font', family='serif')
+set_text_rendering()
 
 # constant definitions
 LOOP_DELAY = 1 # ms
@@ -14,10 +14,9 @@ import threading
 from matplotlib.collections import LineCollection
 from utils import *
 
-# use latex for font rendering
+# use latex for font rendering (set AFM_MATHTEXT=1 to use mathtext instead, which starts faster)
 mpl.rcParams.update(mpl.rcParamsDefault)
-plt.rc('text', usetex=True)
-plt.rc('font', family='serif')
+set_text_rendering()
 
 # constant definitions
 LOOP_DELAY = 1 # ms
@@ -85,27 +84,20 @@ def plot_command_animation(folder_dir, scale_factor,time_units,vs_distance,title
             timer.stop()
         return line,
         
-    # define data filenames
-    info_file = os.path.join(folder_dir,'experiment-info.csv')
-    x_file = os.path.join(folder_dir,'x-command.csv')
-    y_file = os.path.join(folder_dir,'y-command.csv')
-    pressure_file = os.path.join(folder_dir,'pressure.csv')
-    timestamp_file = os.path.join(folder_dir,'time-samples.csv')
-
-    # load the dfs
-    x_df = pd.read_csv(x_file, delimiter = ',', header = None)
-    y_df = pd.read_csv(y_file, delimiter = ',', header = None)
-    pressure_df = pd.read_csv(pressure_file, delimiter = ',', header = None)
-    timestamp_df = pd.read_csv(timestamp_file, delimiter = ',', header = None)
-
-    # Assuming timestamp_df contains the timestamps in seconds
-    total_duration = timestamp_df.iloc[-1, 0] - timestamp_df.iloc[0, 0]
-    normalized_timestamps = (timestamp_df.iloc[:, 0] - timestamp_df.iloc[0, 0])
-    average_interval = (total_duration * 1000) / len(timestamp_df)
-
-    # get the data, where the first column is the X Command, Second is Y Command, Third is Z Command, Fourth is OBD X, Fifth is OBD Y, Sixth is OBD Sum
-    x_data = x_df.iloc[:, 0].tolist()
-    y_data = y_df.iloc[:,0].tolist()
+    # open the experiment folder (each channel is only read from disk the first time it is used)
+    folder = ExperimentFolder(folder_dir)
+
+    # get the channels
+    x_data = folder.x_command
+    y_data = folder.y_command
+    pressure_data = folder.pressure
+    timestamps = folder.time_samples
+
+    # Assuming timestamps contains the timestamps in seconds
+    total_duration = timestamps[-1] - timestamps[0]
+    normalized_timestamps = (timestamps - timestamps[0])
+    average_interval = (total_duration * 1000) / len(timestamps)
+
     # create the plot title string. It should include the P, I, D parameter values in scientific notation, the LPS, Size X, and Size Y values, and the Z Set Point, Offset X, and Offset Y values
 
     # create a a 3x2 plot
@@ -145,25 +137,18 @@ def plot_custom_command_animation(folder_dir,title_string):
     # timer = Timer(dt=0.1)
     # timer_thread = threading.Thread(target=timer.start)
 
-    # define data filenames
-    info_file = os.path.join(folder_dir,'experiment-info.csv')
-    x_file = os.path.join(folder_dir,'x-command.csv')
-    y_file = os.path.join(folder_dir,'y-command.csv')
-    pressure_file = os.path.join(folder_dir,'pressure.csv')
-    timestamp_file = os.path.join(folder_dir,'time-samples.csv')
-
-    # load the dfs
-    x_df = pd.read_csv(x_file, delimiter = ',', header = None)
-    y_df = pd.read_csv(y_file, delimiter = ',', header = None)
-    pressure_df = pd.read_csv(pressure_file, delimiter = ',', header = None)
-    timestamp_df = pd.read_csv(timestamp_file, delimiter = ',', header = None)
+    # open the experiment folder (each channel is only read from disk the first time it is used)
+    folder = ExperimentFolder(folder_dir)
 
-    # Assuming timestamp_df contains the timestamps in seconds
-    total_duration = timestamp_df.iloc[-1, 0] - timestamp_df.iloc[0, 0]
-    normalized_timestamps = np.array(timestamp_df.iloc[:, 0] - timestamp_df.iloc[0, 0])
+    # get the channels
+    x_data = folder.x_command
+    y_data = folder.y_command
+    pressure_data = folder.pressure
+    timestamps = folder.time_samples
 
-    x_data = np.array(x_df.iloc[:, 0])
-    y_data = np.array(y_df.iloc[:,0])
+    # Assuming timestamps contains the timestamps in seconds
+    total_duration = timestamps[-1] - timestamps[0]
+    normalized_timestamps = np.array(timestamps - timestamps[0])
 
     # specify lines to be stored 
     lines = []
@@ -204,7 +189,7 @@ def plot_custom_command_animation(folder_dir,title_string):
             segment = [(x_data[i], y_data[i]) for i in range(prev_index, current_index+1)]
             segments.append(segment)
             
-            color = 'blue' if np.array(pressure_df)[current_index][0] == 0 else 'limegreen'
+            color = 'blue' if pressure_data[current_index] == 0 else 'limegreen'
             colors.append(color)
 
             lw = 1 if color == 'blue' else 2
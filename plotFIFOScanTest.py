@@ -13,9 +13,8 @@ import os
 import pyperclip
 from utils import *
 
-# use latex for font rendering
-plt.rc('text', usetex=True)
-plt.rc('font', family='serif')
+# use latex for font rendering (set AFM_MATHTEXT=1 to use mathtext instead, which starts faster)
+set_text_rendering()
 
 # constants
 FPGA_CLK_FREQ = 40e6 # Hz
@@ -26,8 +25,10 @@ FIFO_SAMPLE_FREQ = FPGA_CLK_FREQ / FIFO_SAMPLE_PERIOD # Hz
 @click.command()
 @click.option('--use-clipboard-for-filename', '-c', default=True, help='Use the clipboard for the filename.')
 @click.option('--file-directory','-d', default='~/Dropbox (MIT)/Qatar 3D Printing/LabVIEW Files (Malek)/2023-Qatar-3D-Printing/afm-data-logs/', help='Directory where the data is stored')
+@click.option('--streaming', '-S', default=False, help='Read the log in chunks (constant memory) and plot decimated traces, for logs larger than RAM.')
+@click.option('--chunk-size', '-k', default=1000000, help='Number of rows per chunk in streaming mode.')
 
-def main(use_clipboard_for_filename,file_directory):
+def main(use_clipboard_for_filename,file_directory,streaming,chunk_size):
     if use_clipboard_for_filename:
         # get the filename from the clipboard
         filename = pyperclip.paste()
@@ -48,47 +49,56 @@ def main(use_clipboard_for_filename,file_directory):
         print('\n\n ERROR: File {} does not exist!\n\n'.format(fullfile))
         exit()
 
-    # read the afm log data
-    df, header = read_afm_log_csv(fullfile)
-
-    # get the x command data malek
-    x_command = df['X Command (um)'].to_numpy()
+    if streaming:
+        # stream the log in chunks, keeping only min/max decimated traces and the run-length period tracks in memory
+        columns = ['X Command (um)','Y Command (um)']
+        traces, tracks = stream_log_traces(fullfile, columns, columns, FIFO_SAMPLE_FREQ, chunk_size=chunk_size, window_size=int(FIFO_SAMPLE_FREQ//10))
+
+        # get the decimated x and y commands, their time vectors and their periods
+        x_idx, x_command = traces['X Command (um)']
+        y_idx, y_command = traces['Y Command (um)']
+        x_t, y_t = x_idx / FIFO_SAMPLE_FREQ, y_idx / FIFO_SAMPLE_FREQ
+        x_period_overlay = sample_period_track(*tracks['X Command (um)'][:2], x_idx)
+        y_period_overlay = sample_period_track(*tracks['Y Command (um)'][:2], y_idx)
+    else:
+        # read the afm log data
+        df, header = read_afm_log_csv(fullfile)
 
-    # get the y command
-    y_command = df['Y Command (um)'].to_numpy()
+        # get the x command data malek
+        x_command = df['X Command (um)'].to_numpy()
 
-    # get the time vector
-    t = np.arange(0,len(x_command)) / FIFO_SAMPLE_FREQ
+        # get the y command
+        y_command = df['Y Command (um)'].to_numpy()
 
-    # obtain the x period signal overlay
-    x_period_overlay = get_signal_period_overlay(x_command,t,window_size=int(FIFO_SAMPLE_FREQ//10))
+        # get the time vector
+        x_t = y_t = np.arange(0,len(x_command)) / FIFO_SAMPLE_FREQ
 
-    # obtain the y period signal overlay
-    y_period_overlay = get_signal_period_overlay(y_command,t,window_size=int(FIFO_SAMPLE_FREQ//10))
+        # obtain the x and y period signal overlays in one call
+        x_period_overlay, y_period_overlay = get_signal_period_overlay(np.stack([x_command,y_command]),x_t,window_size=int(FIFO_SAMPLE_FREQ//10))
 
     # create a 2x1 figure
     fig, (ax1,ax2) = plt.subplots(2,1,sharex=True)
 
     # plot the x command
-    ax1.plot(t,x_command)
+    ax1.plot(x_t,x_command)
     ax1.set_ylabel('X Command (um)')
     ax1.grid(True)
 
     # create a second twin axis for the x period overlay
     ax1_2 = ax1.twinx()
-    ax1_2.plot(t,x_period_overlay,'r')
+    ax1_2.plot(x_t,x_period_overlay,'r')
     ax1_2.set_ylabel('X Period Overlay (s)')
     ax1_2.set_ylim(bottom=0,top=1.1*np.max(x_period_overlay[-len(x_command)//2::]))
 
     # plot the y command
-    ax2.plot(t,y_command)
+    ax2.plot(y_t,y_command)
     ax2.set_ylabel('Y Command (um)')
     ax2.set_xlabel('Time (s)')
     ax2.grid(True)
 
     # create a second twin axis for the y period overlay
     ax2_2 = ax2.twinx()
-    ax2_2.plot(t,y_period_overlay,'r')
+    ax2_2.plot(y_t,y_period_overlay,'r')
     ax2_2.set_ylabel('Y Period Overlay (s)')
     ax2_2.set_ylim(bottom=0,top=1.1*np.max(y_period_overlay[-len(y_command)//2::]))
 
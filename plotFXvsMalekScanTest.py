@@ -10,9 +10,8 @@ import os
 import pyperclip
 from utils import *
 
-# use latex for font rendering
-plt.rc('text', usetex=True)
-plt.rc('font', family='serif')
+# use latex for font rendering (set AFM_MATHTEXT=1 to use mathtext instead, which starts faster)
+set_text_rendering()
 
 # constants
 RT_CLK_FREQ = 1000 # Hz
@@ -67,11 +66,8 @@ def main(use_clipboard_for_filename,file_directory,rt_loop_delay):
     # specify the time vector
     time = np.arange(0,len(x_command_malek)/sampling_rate,1/sampling_rate)
 
-    # obtain the period overlay for each of the command signals
-    period_x_malek = get_signal_period_overlay(x_command_malek,time)
-    period_y_malek = get_signal_period_overlay(y_command_malek,time)
-    period_x_fx = get_signal_period_overlay(x_command_fx,time)
-    period_y_fx = get_signal_period_overlay(y_command_fx,time)
+    # obtain the period overlay for all of the command signals in one call
+    period_x_malek, period_y_malek, period_x_fx, period_y_fx = get_signal_period_overlay(np.stack([x_command_malek,y_command_malek,x_command_fx,y_command_fx]),time)
 
     # create a 2x2 plot first row should be malek, second row should be fx
     fig, ((ax0,ax1),(ax2,ax3)) = plt.subplots(2,2,sharex=True)
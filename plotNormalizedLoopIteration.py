@@ -17,9 +17,8 @@ import os
 from utils import *
 from scipy.signal import savgol_filter, argrelextrema
 
-# use latex for font rendering
-plt.rc('text', usetex=True)
-plt.rc('font', family='serif')
+# use latex for font rendering (set AFM_MATHTEXT=1 to use mathtext instead, which starts faster)
+set_text_rendering()
 
 # ultimately we want to plot a 2x2 subplot with the following:
 # (1,1) - X command vs. time
@@ -78,11 +77,8 @@ def main(use_clipboard_for_filename,file_directory,rt_loop_delay):
     # set time to be arange of the length of the x command data
     time = np.arange(len(x_command))/fs
 
-    # get the period overlay for the x command
-    adjusted_periods = get_signal_period_overlay(x_command, time)
-
-    # get the adjusted periods for the normalized x loop iteration
-    adjusted_periods_normalized_x_loop_iteration = get_signal_period_overlay(normalized_x_loop_iteration, time)
+    # get the period overlays for the x command and the normalized x loop iteration in one call
+    adjusted_periods, adjusted_periods_normalized_x_loop_iteration = get_signal_period_overlay(np.stack([x_command, normalized_x_loop_iteration]), time)
 
     # create the subplots
     fig,ax = plt.subplots(2,2,sharex=True)
@@ -11,9 +11,8 @@ import pyperclip
 from utils import *
 from functools import partial
 
-# use latex for font rendering
-plt.rc('text', usetex=True)
-plt.rc('font', family='serif')
+# use latex for font rendering (set AFM_MATHTEXT=1 to use mathtext instead, which starts faster)
+set_text_rendering()
 
 # constant definitions
 LOOP_DELAY = 100 # ms
@@ -70,33 +69,23 @@ def plot_obd_with_distributions(folder_dir, scale_factor,time_units,vs_distance,
         time_label = 'Time (ms)'
         div_factor = 1/1000
     
-    # define data filenames
-    info_file = os.path.join(folder_dir,'experiment-info.csv')
-    metadata_path = os.path.join(folder_dir,'metadata.txt')
-    obdx_file = os.path.join(folder_dir,'obd-x.csv')
-    obdy_file = os.path.join(folder_dir,'obd-y.csv')
-    obdsum_file = os.path.join(folder_dir,'obd-sum.csv')
+    # open the experiment folder (only the OBD channels are read from disk)
+    folder = ExperimentFolder(folder_dir)
 
-    # get the loop delay from the metadata file
-    if os.path.exists(metadata_path):
-        LOOP_DELAY = 1/get_loop_delay(metadata_path) * 1000 # ms
-
-    # get the information dataframe
-    info_df = pd.read_csv(info_file, header=None)
+    # read the OBD channels concurrently
+    folder.preload(['obd-x','obd-y','obd-sum'], verbose=True)
 
-    # read the data files
-    obdx_df = pd.read_csv(obdx_file, header=None)
-    obdy_df = pd.read_csv(obdy_file, header=None)
-    obdsum_df = pd.read_csv(obdsum_file, header=None)
+    # get the loop delay from the metadata file
+    loop_delay = 1/folder.loop_rate * 1000 if folder.loop_rate is not None else LOOP_DELAY # ms
 
     # set the header df to be the first 3 rows
-    df_header = get_log_header_info(info_df)
+    df_header = folder.header
 
     # specify time sample vector
-    time_samples = np.arange(0,obdx_df.shape[0],1)
+    time_samples = np.arange(0,folder.obd_x.shape[0],1)
 
     # using loop delay, define the loop rate
-    loop_rate = 1/(LOOP_DELAY/1000)
+    loop_rate = 1/(loop_delay/1000)
 
     # using the sample rate, create the time vector
     time = time_samples/loop_rate
@@ -105,9 +94,9 @@ def plot_obd_with_distributions(folder_dir, scale_factor,time_units,vs_distance,
     time = time/div_factor
 
     # get the data, where the first column is the X Fourth is OBD X, Fifth is OBD Y, Sixth is OBD Sum
-    data4 = np.array(obdx_df.iloc[:,0])
-    data5 = np.array(obdy_df.iloc[:,0])
-    data6 = np.array(obdsum_df.iloc[:,0])
+    data4 = np.asarray(folder.obd_x)
+    data5 = np.asarray(folder.obd_y)
+    data6 = np.asarray(folder.obd_sum)
 
     # create the plot title string. It should include the P, I, D parameter values in scientific notation, the LPS, Size X, and Size Y values, and the Z Set Point, Offset X, and Offset Y values
     title_string = get_experiment_info_string(df_header)
@@ -116,7 +105,7 @@ def plot_obd_with_distributions(folder_dir, scale_factor,time_units,vs_distance,
     fig, ax = plt.subplots(3,2,figsize=(16,6))
 
     # plot the OBD X
-    ax[0,1].plot(time, data4, label='OBD X')
+    plot_decimated(ax[0,1], time, data4, label='OBD X', pyramid=folder.pyramid('obd-x'))
     ax[0,1].set_xlabel(time_label)
     ax[0,1].set_ylabel('OBD X ($V$)')
     ax[0,1].set_ylim([-data6.max()*scale_factor,data6.max()*scale_factor])
@@ -130,14 +119,14 @@ def plot_obd_with_distributions(folder_dir, scale_factor,time_units,vs_distance,
     # ax[1,1].legend()
 
     # Plot the OBD Y
-    ax[1,1].plot(time, data5, label='OBD Y')
+    plot_decimated(ax[1,1], time, data5, label='OBD Y', pyramid=folder.pyramid('obd-y'))
     ax[1,1].set_xlabel(time_label)
     ax[1,1].set_ylabel('OBD Y ($V$)')
     ax[1,1].set_ylim([-data6.max()*scale_factor,data6.max()*scale_factor])
     ax[1,1].legend()
 
     # plot the OBD Sum
-    ax[2,1].plot(time, data6, label='OBD Sum')
+    plot_decimated(ax[2,1], time, data6, label='OBD Sum', pyramid=folder.pyramid('obd-sum'))
     ax[2,1].set_xlabel(time_label)
     ax[2,1].set_ylabel('OBD Sum ($V$)')
     ax[2,1].set_ylim([-data6.max()*scale_factor,data6.max()*scale_factor])
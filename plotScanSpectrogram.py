@@ -9,9 +9,8 @@ import os
 import pyperclip
 from utils import *
 
-# use latex for font rendering
-plt.rc('text', usetex=True)
-plt.rc('font', family='serif')
+# use latex for font rendering (set AFM_MATHTEXT=1 to use mathtext instead, which starts faster)
+set_text_rendering()
 
 # define a click argument for the input file name, add optional argument for file directory
 @click.command()
@@ -23,8 +22,13 @@ plt.rc('font', family='serif')
 @click.option('--spectrogram-type', '-t', default='mel', help='Type of spectrogram to plot. Options are mel or linear.')
 @click.option('--window-size', '-w', default=2048, help='Window size for the spectrogram in samples.')
 @click.option('--n-mels', '-m', default=265, help='Number of mel bins to use for the spectrogram.')
+@click.option('--streaming', '-S', default=False, help='Compute the spectrogram in chunks to a .npy file next to the log and plot a decimated view (for captures larger than RAM).')
+@click.option('--chunk-size', '-k', default=1000000, help='Number of samples read at a time in streaming mode.')
+@click.option('--audio-format', '-f', default='wav', help='Format of the audio file. Options are wav or flac (flac requires int16 samples).')
+@click.option('--audio-dtype', '-b', default='float64', help='Sample format of the audio file. Options are float64, float32, or int16 (int16 is peak normalized).')
+@click.option('--resample-audio', '-R', default=False, help='Resample the audio from the loop rate in the metadata.txt next to the log to the sampling rate.')
 
-def main(use_clipboard_for_filename, file_directory, signal_type, save_audio_flag, sampling_rate, spectrogram_type, window_size, n_mels):
+def main(use_clipboard_for_filename, file_directory, signal_type, save_audio_flag, sampling_rate, spectrogram_type, window_size, n_mels, streaming, chunk_size, audio_format, audio_dtype, resample_audio):
     if use_clipboard_for_filename:
         # get the filename from the clipboard
         filename = pyperclip.paste()
@@ -49,7 +53,8 @@ def main(use_clipboard_for_filename, file_directory, signal_type, save_audio_fla
     f_max = sampling_rate/2
     
     # use a custom plot function to plot the spectrogram data
-    plot_spectrogram(fullfile, signal_type, save_audio_flag, sampling_rate, f_max, spectrogram_type, window_size, n_mels)
+    plot_spectrogram(fullfile, signal_type, save_audio_flag, sampling_rate, f_max, spectrogram_type, window_size, n_mels, streaming=streaming, chunk_size=chunk_size,
+                     audio_format=audio_format, audio_dtype=audio_dtype, resample_audio=resample_audio)
 
 if __name__ == '__main__':
     main()
@@ -10,9 +10,8 @@ import pyperclip
 from utils import *
 from scipy.interpolate import interp1d
 
-# use latex for font rendering
-plt.rc('text', usetex=True)
-plt.rc('font', family='serif')
+# use latex for font rendering (set AFM_MATHTEXT=1 to use mathtext instead, which starts faster)
+set_text_rendering()
 
 # define a click argument for the input file name, add optional argument for file directory
 @click.command()
@@ -20,13 +19,15 @@ plt.rc('font', family='serif')
 @click.option('--file-directory','-d', default='~/Dropbox (MIT)/Qatar 3D Printing/LabVIEW Files (Malek)/2023-Qatar-3D-Printing/afm-data-logs/', help='Directory where the data is stored')
 @click.option('--loop-delay', '-l', default=10, help='Loop delay in microseconds.')
 @click.option('--clock-frequency', '-f', default=1000, help='Clock frequency in Hz.')
+@click.option('--streaming', '-S', default=False, help='Read the log in chunks (constant memory) and plot decimated traces, for logs larger than RAM.')
+@click.option('--chunk-size', '-k', default=1000000, help='Number of rows per chunk in streaming mode.')
 
-def main(use_clipboard_for_filename,file_directory,loop_delay,clock_frequency):
+def main(use_clipboard_for_filename,file_directory,loop_delay,clock_frequency,streaming,chunk_size):
     if use_clipboard_for_filename:
         # get the filename from the clipboard
         filename = pyperclip.paste()
     else:
-        input('Please Paste your filename here: ')
+        filename = input('Please Paste your filename here: ')
     
     # expand the file directory
     directory = os.path.expanduser(file_directory)
@@ -42,31 +43,41 @@ def main(use_clipboard_for_filename,file_directory,loop_delay,clock_frequency):
         print('\n\n ERROR: File {} does not exist!\n\n'.format(fullfile))
         exit()
 
-    # read the afm log data
-    df, header = read_afm_log_csv(fullfile)
-
-    # get the scan loop delay data
-    scan_loop_delay = df['FPGA XY Scan Loop Delay (Ticks)']
-
-    # get the X command data
-    x_command = df['X Command (um)'].to_numpy()
-
     # specify the sampling rate
     sampling_rate = clock_frequency/loop_delay
 
     print(f'Sampling rate is {sampling_rate} Hz')
 
-    # specify the time vector
-    time = np.arange(0,len(x_command))/sampling_rate
+    if streaming:
+        # stream the log in chunks, keeping only min/max decimated traces and the run-length period track in memory
+        traces, tracks = stream_log_traces(fullfile, ['FPGA XY Scan Loop Delay (Ticks)','X Command (um)'], ['X Command (um)'], sampling_rate, chunk_size=chunk_size)
+
+        # get the decimated scan loop delay and X command data with their time vectors, and the periods of the X command
+        delay_idx, scan_loop_delay = traces['FPGA XY Scan Loop Delay (Ticks)']
+        x_idx, x_command = traces['X Command (um)']
+        delay_time, time = delay_idx/sampling_rate, x_idx/sampling_rate
+        adjusted_periods = sample_period_track(*tracks['X Command (um)'][:2], x_idx)
+    else:
+        # read the afm log data
+        df, header = read_afm_log_csv(fullfile)
+
+        # get the scan loop delay data
+        scan_loop_delay = df['FPGA XY Scan Loop Delay (Ticks)']
+
+        # get the X command data
+        x_command = df['X Command (um)'].to_numpy()
+
+        # specify the time vector
+        time = delay_time = np.arange(0,len(x_command))/sampling_rate
 
-    # get the adjusted periods
-    adjusted_periods = get_signal_period_overlay(x_command, time)
+        # get the adjusted periods
+        adjusted_periods = get_signal_period_overlay(x_command, time)
 
     # create a 3x1 subplot with the loop delay data on top and the x command data on the bottom
     fig, (ax1, ax2) = plt.subplots(2,1,sharex=True)
 
     # plot the scan loop delay data
-    ax1.plot(time, scan_loop_delay)
+    ax1.plot(delay_time, scan_loop_delay)
     ax1.set_ylabel('FPGA XY Scan Loop Delay (ticks)')
     ax1.set_title('FPGA XY Scan Loop Delay (ticks) vs. Time (s)')
     ax1.grid()
@@ -0,0 +1,146 @@
+# This code validates the scan command math of checkScanCommands over a grid of scan parameters (LPS, Size X/Y,
+# Offset X/Y, loop delay) instead of checking one hand-edited parameter set at a time. For every combination the X and
+# Y command trajectories are generated and compared with what the parameters ask for: the expected vs. realised period,
+# the peak-to-peak amplitude, and whether the commands leave the travel range of the stage (clipping).
+#
+# As in plotNormalizedLoopIteration, one X cycle takes 1/LPS seconds, and one Y cycle takes num_lines X cycles.
+
+# imports
+import numpy as np
+import pandas as pd
+import click
+import itertools
+import functools
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from checkScanCommands import xCommand, yCommand, getLoopIndices
+
+# columns of the sweep parameters, in the order they are swept
+SWEEP_PARAMETERS = ['lps', 'size_x', 'size_y', 'offset_x', 'offset_y', 'loop_delay', 'num_lines']
+
+def get_cycle_starts(commands):
+    """
+    Returns the loop iterations at which a triangle wave starts rising again after falling (or staying flat), i.e. the
+    start of every cycle except the first one.
+    """
+    slope = np.diff(commands)
+
+    return np.nonzero((slope[1:] > 0) & (slope[:-1] <= 0))[0] + 1
+
+def evaluate_axis(command_function, size, offset, freq, loop_delay, num_cycles, max_iterations, command_limits):
+    """
+    Generates num_cycles cycles (at most max_iterations loop iterations) of one axis and returns its realised period
+    (s, NaN if fewer than 2 cycles fit), peak-to-peak (um), and fraction of iterations outside the command limits (um).
+    """
+    # same units as checkScanCommands: size and offset in nm, commands in um, periods in loop iterations
+    amp = size/2/1000
+    period_corrected = 1/(freq*loop_delay)
+    num_iterations = int(min(num_cycles*(np.ceil(period_corrected) + 1), max_iterations))
+
+    # generate the commands of the axis
+    i = getLoopIndices(period_corrected, num_iterations)
+    commands = command_function(amp, 1/period_corrected, offset/1000, period_corrected, i)
+
+    # measure the period from the starts of the cycles
+    cycle_starts = get_cycle_starts(commands)
+    realised_period = np.mean(np.diff(cycle_starts))*loop_delay if len(cycle_starts) >= 2 else np.nan
+
+    # measure the amplitude and the clipping
+    peak_to_peak = commands.max() - commands.min()
+    clipped_fraction = np.mean((commands < command_limits[0]) | (commands > command_limits[1]))
+
+    return realised_period, peak_to_peak, clipped_fraction
+
+def evaluate_combination(lps, size_x, size_y, offset_x, offset_y, loop_delay, num_lines, num_cycles=3, max_iterations=2000000, command_limits=(-50, 50)):
+    """
+    Returns a dict with the expected and realised period, peak-to-peak and clipping of the X and Y commands of one
+    combination of scan parameters.
+    """
+    x_freq = lps
+    y_freq = lps/num_lines
+    result = dict(lps=lps, size_x=size_x, size_y=size_y, offset_x=offset_x, offset_y=offset_y, loop_delay=loop_delay, num_lines=num_lines)
+
+    for axis, command_function, size, offset, freq in [('x', xCommand, size_x, offset_x, x_freq), ('y', yCommand, size_y, offset_y, y_freq)]:
+        realised_period, peak_to_peak, clipped_fraction = evaluate_axis(command_function, size, offset, freq, loop_delay, num_cycles, max_iterations, command_limits)
+        result[f'{axis}_expected_period'] = 1/freq
+        result[f'{axis}_realised_period'] = realised_period
+        result[f'{axis}_period_error'] = realised_period*freq - 1
+        result[f'{axis}_expected_peak_to_peak'] = size/1000
+        result[f'{axis}_peak_to_peak'] = peak_to_peak
+        result[f'{axis}_clipped_fraction'] = clipped_fraction
+
+    return result
+
+def evaluate_combinations(combinations, **kwargs):
+    """
+    Evaluates a list of parameter combinations (tuples in the order of SWEEP_PARAMETERS) in one worker.
+    """
+    return [evaluate_combination(*combination, **kwargs) for combination in combinations]
+
+def sweep_scan_commands(combinations, num_workers=None, chunk_size=64, **kwargs):
+    """
+    Evaluates all the parameter combinations in parallel (in chunks of chunk_size combinations per task) and returns
+    the results as a dataframe with one row per combination.
+    """
+    chunks = [combinations[i:i + chunk_size] for i in range(0, len(combinations), chunk_size)]
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        results = executor.map(functools.partial(evaluate_combinations, **kwargs), chunks)
+
+    return pd.DataFrame([row for rows in results for row in rows])
+
+def parse_values(values):
+    """
+    Parses a comma separated list of numbers.
+    """
+    return [float(value) for value in values.split(',')]
+
+@click.command()
+@click.option('--lps', '-l', default='0.1,0.5,1,2', help='Comma separated lines per second values.')
+@click.option('--size-x', '-x', default='10000,50000,100000', help='Comma separated X scan sizes in nm.')
+@click.option('--size-y', '-y', default='10000,50000,100000', help='Comma separated Y scan sizes in nm.')
+@click.option('--offset-x', default='0,30000', help='Comma separated X offsets in nm.')
+@click.option('--offset-y', default='0,30000', help='Comma separated Y offsets in nm.')
+@click.option('--loop-delay', '-d', default='0.01,0.001,0.0001', help='Comma separated loop delays in seconds.')
+@click.option('--num-lines', '-n', default='10', help='Comma separated numbers of X cycles (lines) per Y cycle.')
+@click.option('--num-cycles', '-c', default=3, help='Number of cycles of each axis to generate.')
+@click.option('--max-iterations', '-m', default=2000000, help='Maximum number of loop iterations generated per axis.')
+@click.option('--command-limits', default='-50,50', help='Travel range of the stage in um (commands outside are counted as clipped).')
+@click.option('--workers', '-j', default=os.cpu_count(), help='Number of worker processes.')
+@click.option('--output-file', '-o', default='scan-command-sweep.csv', help='CSV file to write the results to.')
+@click.option('--period-tolerance', '-t', default=0.01, help='Relative period error above which a combination is reported.')
+
+def main(lps, size_x, size_y, offset_x, offset_y, loop_delay, num_lines, num_cycles, max_iterations, command_limits, workers, output_file, period_tolerance):
+    """
+    Evaluates every combination of the given scan parameters, writes the results to a CSV file, and prints the
+    combinations whose period is off or whose commands clip.
+    """
+    # build the grid of parameter combinations
+    values = [parse_values(lps), parse_values(size_x), parse_values(size_y), parse_values(offset_x), parse_values(offset_y), parse_values(loop_delay), parse_values(num_lines)]
+    combinations = list(itertools.product(*values))
+    print(f'\n\n Evaluating {len(combinations)} combinations with {workers} workers\n\n')
+
+    # evaluate all combinations in parallel
+    start_time = time.perf_counter()
+    results = sweep_scan_commands(combinations, num_workers=workers, num_cycles=num_cycles, max_iterations=max_iterations, command_limits=tuple(parse_values(command_limits)))
+    total_time = time.perf_counter() - start_time
+
+    # save the results
+    results.to_csv(output_file, index=False)
+    print(f' Evaluated {len(results)} combinations in {total_time:.2f} s ({len(results)/total_time:.1f} combinations/s), results saved to {output_file}\n')
+
+    # report the combinations whose period is off, whose period could not be measured, or whose commands clip
+    period_off = (results[['x_period_error', 'y_period_error']].abs() > period_tolerance).any(axis=1)
+    unmeasured = results[['x_realised_period', 'y_realised_period']].isna().any(axis=1)
+    clipped = (results[['x_clipped_fraction', 'y_clipped_fraction']] > 0).any(axis=1)
+    print(f' Period error above {period_tolerance*100:.1f}%: {period_off.sum()}')
+    print(f' Period not measured (fewer than 2 cycles in {max_iterations} iterations): {unmeasured.sum()}')
+    print(f' Clipping commands: {clipped.sum()}\n')
+
+    with pd.option_context('display.max_rows', 20, 'display.width', 200):
+        flagged = results[period_off | clipped]
+        if len(flagged) > 0:
+            print(flagged[SWEEP_PARAMETERS + ['x_period_error', 'y_period_error', 'x_clipped_fraction', 'y_clipped_fraction']])
+
+if __name__ == '__main__':
+    main()
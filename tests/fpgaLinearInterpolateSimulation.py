@@ -1,8 +1,249 @@
 import numpy as np
 
+# the commands are clipped to +/- CLIP_LIMIT and the FPGA clock runs at BASE_CLOCK_RATE ticks per second
+CLIP_LIMIT = 64
+BASE_CLOCK_RATE = 40E6
+
 def linear_interpolate(start_value, slope, tick_count):
     return start_value + slope * tick_count
 
+def get_num_iterations(total_ticks, loop_delay):
+    # the loop runs while tick_count_fxp <= total_ticks, so iterations k = 0, 1, ..., floor(total_ticks / loop_delay)
+    return np.floor(np.asarray(total_ticks) / loop_delay).astype(np.int64) + 1
+
+def interpolate_correct(start_value, slope, loop_delay, k, limit=CLIP_LIMIT):
+    # command of iteration k, always interpolated from the start value
+    return np.clip(linear_interpolate(start_value, slope, k * loop_delay), -limit, limit)
+
+def interpolate_accumulating(start_value, slope, loop_delay, k, limit=CLIP_LIMIT):
+    # command of iteration k when it is interpolated from the previous command (fpgaLinearInterpolateSimulationWrong):
+    # x_k = x_(k-1) + slope * k * loop_delay = x_0 + slope * loop_delay * k * (k + 1) / 2. The commands move in one
+    # direction only, so once they are clipped they stay at the limit.
+    start_value = np.clip(start_value, -limit, limit)
+    return np.clip(start_value + slope * loop_delay * k * (k + 1) / 2, -limit, limit)
+
+def simulate_interpolation_batch(slopes, start_values, total_ticks, loop_delays, limit=CLIP_LIMIT, base_clock_rate=BASE_CLOCK_RATE, tolerance=1E-6):
+    """
+    Closed form simulation of a batch of linear interpolation moves (the arguments are broadcast against each other),
+    without stepping through the loop iterations. The start values are assumed to be inside the clip limits.
+
+    Returns a dict of arrays with, for every move, the number of loop iterations, the duration (s), the end command of
+    the correct and of the accumulating formulation, the largest difference between the two over the whole move, the
+    first iteration at which they differ by more than tolerance (-1 if never) and whether they diverge.
+    """
+    slopes, start_values, total_ticks, loop_delays = np.broadcast_arrays(*[np.asarray(a, dtype=np.float64) for a in (slopes, start_values, total_ticks, loop_delays)])
+    num_iterations = get_num_iterations(total_ticks, loop_delays)
+    last = (num_iterations - 1).astype(np.float64)
+
+    # end commands of both formulations
+    end_correct = interpolate_correct(start_values, slopes, loop_delays, last, limit)
+    end_accumulating = interpolate_accumulating(start_values, slopes, loop_delays, last, limit)
+
+    def divergence(k):
+        return np.abs(interpolate_accumulating(start_values, slopes, loop_delays, k, limit) - interpolate_correct(start_values, slopes, loop_delays, k, limit))
+
+    # first iteration kc at which the accumulating commands reach the limit, i.e. kc (kc + 1) / 2 >= r
+    step = slopes * loop_delays
+    moving = step != 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        r = np.where(moving, (np.sign(step) * limit - np.clip(start_values, -limit, limit)) / np.where(moving, step, 1), np.inf)
+    kc = np.ceil((np.sqrt(1 + 8 * r) - 1) / 2)
+    kc = np.where(moving, kc + (kc * (kc + 1) / 2 < r) - ((kc > 0) & ((kc - 1) * kc / 2 >= r)), np.inf)
+
+    # the accumulating commands pull away from the correct ones until they clip, after which the correct ones catch up,
+    # so the largest difference is at kc - 1 or kc (or at the end of the move)
+    k1 = np.clip(kc - 1, 0, last)
+    k2 = np.clip(kc, 0, last)
+    max_divergence = np.maximum(divergence(k1), divergence(k2))
+
+    # before clipping the difference is |step| k (k - 1) / 2, so solve for the first k where it exceeds the tolerance
+    with np.errstate(divide='ignore', invalid='ignore'):
+        m = np.where(moving, 2 * tolerance / np.abs(np.where(moving, step, 1)), np.inf)
+    k_tol = np.floor((1 + np.sqrt(1 + 4 * m)) / 2)
+    k_tol = k_tol + (np.abs(step) * k_tol * (k_tol - 1) / 2 <= tolerance)
+    first_divergence = np.where((k_tol < kc) & (k_tol <= last), k_tol, np.where((kc <= last) & (divergence(k2) > tolerance), kc, -1)).astype(np.int64)
+
+    return {
+        'num_iterations': num_iterations,
+        'duration': num_iterations * loop_delays / base_clock_rate,
+        'end_correct': end_correct,
+        'end_accumulating': end_accumulating,
+        'max_divergence': max_divergence,
+        'first_divergence': first_divergence,
+        'diverged': first_divergence >= 0,
+    }
+
+def interpolation_trajectories(slopes, start_values, total_ticks, loop_delays, accumulate=False, limit=CLIP_LIMIT):
+    """
+    Returns the commands of every loop iteration of a batch of moves as a 2D (moves, iterations) array, padded with NaN
+    after the end of the shorter moves, together with the tick count of every iteration.
+    """
+    slopes, start_values, total_ticks, loop_delays = [a.ravel() for a in np.broadcast_arrays(*[np.asarray(a, dtype=np.float64) for a in (slopes, start_values, total_ticks, loop_delays)])]
+    num_iterations = get_num_iterations(total_ticks, loop_delays)
+
+    # iteration index of every column, NaN after the end of each move
+    k = np.arange(num_iterations.max(), dtype=np.float64)[np.newaxis]
+    k = np.where(k < num_iterations[:, np.newaxis], k, np.nan)
+
+    interpolate = interpolate_accumulating if accumulate else interpolate_correct
+    commands = interpolate(start_values[:, np.newaxis], slopes[:, np.newaxis], loop_delays[:, np.newaxis], k, limit)
+
+    return k * loop_delays[:, np.newaxis], commands
+
+class FixedPointFormat:
+    """
+    Fixed-point number format like LabVIEW's FXP type: word_length bits, of which integer_length are integer bits
+    (fractional_length = word_length - integer_length, integer_length can be negative or larger than word_length).
+    Values are held as raw integers in int64 NumPy arrays, i.e. value = raw * 2**-fractional_length.
+
+    rounding is 'truncate' (towards -inf), 'nearest' (round half up) or 'convergent' (round half to even), and overflow
+    is 'saturate' or 'wrap'.
+    """
+    def __init__(self, word_length, integer_length, signed=True, rounding='nearest', overflow='saturate'):
+        if not 1 <= word_length <= 63:
+            raise ValueError(f'word_length must be between 1 and 63 bits, not {word_length}!')
+        if rounding not in ('truncate', 'nearest', 'convergent'):
+            raise ValueError(f'Unknown rounding mode {rounding}!')
+        if overflow not in ('saturate', 'wrap'):
+            raise ValueError(f'Unknown overflow mode {overflow}!')
+
+        self.word_length = word_length
+        self.integer_length = integer_length
+        self.fractional_length = word_length - integer_length
+        self.signed = signed
+        self.rounding = rounding
+        self.overflow = overflow
+
+        # range of the raw integers
+        self.min_raw = -(1 << (word_length - 1)) if signed else 0
+        self.max_raw = (1 << (word_length - 1)) - 1 if signed else (1 << word_length) - 1
+
+    def __repr__(self):
+        return f"<{'+/-' if self.signed else '+'},{self.word_length},{self.integer_length}>"
+
+    @property
+    def resolution(self):
+        return 2.0 ** -self.fractional_length
+
+    def handle_overflow(self, raw):
+        # saturate or wrap raw integers that don't fit in the word length
+        if self.overflow == 'saturate':
+            return np.clip(raw, self.min_raw, self.max_raw)
+        return ((raw - self.min_raw) & ((1 << self.word_length) - 1)) + self.min_raw
+
+    def round_shift(self, raw, shift):
+        # divide raw integers by 2**shift (or multiply if shift is negative) with the rounding mode of the format
+        raw = np.asarray(raw, dtype=np.int64)
+        if shift <= 0:
+            # saturate before shifting left so that the int64 intermediate can't overflow
+            if self.overflow == 'saturate':
+                raw = np.clip(raw, self.min_raw >> -shift, -((-self.max_raw) >> -shift))
+            return raw << -shift
+
+        quotient = raw >> shift
+        if self.rounding == 'truncate':
+            return quotient
+        remainder = raw - (quotient << shift)
+        half = 1 << (shift - 1)
+        if self.rounding == 'nearest':
+            return quotient + (remainder >= half)
+        return quotient + ((remainder > half) | ((remainder == half) & (quotient & 1 == 1)))
+
+    def from_raw(self, raw, fractional_length):
+        # convert raw integers with fractional_length fractional bits to this format
+        return self.handle_overflow(self.round_shift(raw, fractional_length - self.fractional_length))
+
+    def quantize(self, values):
+        # convert floats to raw integers of this format
+        scaled = np.asarray(values, dtype=np.float64) * 2.0 ** self.fractional_length
+        if self.rounding == 'truncate':
+            scaled = np.floor(scaled)
+        elif self.rounding == 'nearest':
+            scaled = np.floor(scaled + 0.5)
+        else:
+            scaled = np.round(scaled)
+
+        # saturate in floating point so the conversion to int64 can't overflow (wrapping is done on the integers)
+        if self.overflow == 'saturate':
+            return np.clip(scaled, self.min_raw, self.max_raw).astype(np.int64)
+        return self.handle_overflow(np.clip(scaled, -2.0**62, 2.0**62).astype(np.int64))
+
+    def to_float(self, raw):
+        return np.asarray(raw, dtype=np.float64) * self.resolution
+
+def fxp_multiply(a_raw, a_format, b_raw, b_format, out_format):
+    # the full precision product has the fractional bits of both operands, it is then rounded to the output format
+    if a_format.word_length + b_format.word_length > 64:
+        raise ValueError(f'The product of {a_format} and {b_format} does not fit in 64 bits!')
+    product = np.asarray(a_raw, dtype=np.int64) * np.asarray(b_raw, dtype=np.int64)
+    return out_format.from_raw(product, a_format.fractional_length + b_format.fractional_length)
+
+def fxp_add(a_raw, a_format, b_raw, b_format, out_format):
+    # align both operands to the finer resolution before adding, then round to the output format
+    fractional_length = max(a_format.fractional_length, b_format.fractional_length)
+    a_aligned = np.asarray(a_raw, dtype=np.int64) << (fractional_length - a_format.fractional_length)
+    b_aligned = np.asarray(b_raw, dtype=np.int64) << (fractional_length - b_format.fractional_length)
+    return out_format.from_raw(a_aligned + b_aligned, fractional_length)
+
+# default fixed-point formats: integer tick counts, slopes down to ~1e-16 per tick, and commands with ~6e-8 resolution
+TICK_FORMAT = FixedPointFormat(32, 32)
+SLOPE_FORMAT = FixedPointFormat(32, -20)
+COMMAND_FORMAT = FixedPointFormat(32, 8)
+
+def interpolate_fixed_point(start_raw, slope_raw, delay_raw, k, tick_format=TICK_FORMAT, slope_format=SLOPE_FORMAT, command_format=COMMAND_FORMAT, limit=CLIP_LIMIT):
+    # command (raw) of iteration k computed in fixed point as on the FPGA. tick_count_fxp += loop_delay is repeated k
+    # times, which is k * loop_delay with the overflow behaviour of the tick format (saturating stays at the maximum)
+    tick_raw = tick_format.handle_overflow(np.asarray(k, dtype=np.int64) * delay_raw)
+    command_raw = fxp_add(start_raw, command_format, fxp_multiply(slope_raw, slope_format, tick_raw, tick_format, command_format), command_format, command_format)
+
+    # clip the commands to +/- limit
+    limit_raw = command_format.quantize(limit)
+    return np.clip(command_raw, -limit_raw, limit_raw)
+
+def simulate_fixed_point_batch(slopes, start_values, total_ticks, loop_delays, tick_format=TICK_FORMAT, slope_format=SLOPE_FORMAT,
+                               command_format=COMMAND_FORMAT, limit=CLIP_LIMIT, chunk_size=4000000):
+    """
+    Simulates a batch of moves in fixed-point arithmetic and compares every iteration with the ideal float
+    trajectory (interpolate_correct). The iterations are processed in blocks of about chunk_size commands of the whole
+    batch, so long moves are simulated in constant memory.
+
+    Returns a dict of arrays with, for every move, the number of iterations, the fixed-point and ideal end commands,
+    and the worst-case absolute position error with the iteration at which it happens.
+    """
+    slopes, start_values, total_ticks, loop_delays = [a.ravel() for a in np.broadcast_arrays(*[np.asarray(a, dtype=np.float64) for a in (slopes, start_values, total_ticks, loop_delays)])]
+    num_iterations = get_num_iterations(total_ticks, loop_delays)
+
+    # quantize the parameters of every move
+    start_raw = command_format.quantize(start_values)[:, np.newaxis]
+    slope_raw = slope_format.quantize(slopes)[:, np.newaxis]
+    delay_raw = tick_format.quantize(loop_delays)[:, np.newaxis]
+
+    max_error = np.zeros(len(slopes))
+    max_error_iteration = np.zeros(len(slopes), dtype=np.int64)
+    block = max(1, chunk_size // len(slopes))
+    for k0 in range(0, int(num_iterations.max()), block):
+        # iterations of this block (past the end of a move, the last iteration is repeated)
+        k = np.minimum(np.arange(k0, k0 + block, dtype=np.int64)[np.newaxis], num_iterations[:, np.newaxis] - 1)
+        fixed_point = command_format.to_float(interpolate_fixed_point(start_raw, slope_raw, delay_raw, k, tick_format, slope_format, command_format, limit))
+        ideal = interpolate_correct(start_values[:, np.newaxis], slopes[:, np.newaxis], loop_delays[:, np.newaxis], k.astype(np.float64), limit)
+
+        # keep the worst error of every move
+        error = np.abs(fixed_point - ideal)
+        block_worst = np.argmax(error, axis=1)
+        block_error = error[np.arange(len(slopes)), block_worst]
+        worse = block_error > max_error
+        max_error = np.where(worse, block_error, max_error)
+        max_error_iteration = np.where(worse, k[np.arange(len(slopes)), block_worst], max_error_iteration)
+
+    last = num_iterations - 1
+    return {
+        'num_iterations': num_iterations,
+        'end_fixed_point': command_format.to_float(interpolate_fixed_point(start_raw[:, 0], slope_raw[:, 0], delay_raw[:, 0], last, tick_format, slope_format, command_format, limit)),
+        'end_ideal': interpolate_correct(start_values, slopes, loop_delays, last.astype(np.float64), limit),
+        'max_error': max_error,
+        'max_error_iteration': max_error_iteration,
+    }
+
 def compute_end_values():
     # Given Parameters
     slope = -1E-7
@@ -12,33 +253,30 @@ def compute_end_values():
     loop_delay = 40E6  # Ticks
     base_clock_rate = 40E6  # Ticks which is equal to 1 second
 
-    # Initial values
-    tick_count_fxp = 0
-    iteration_count = 0
-    x_command = start_x_command
-    y_command = start_y_command
-
-    while tick_count_fxp <= total_ticks:
-        # Update the commands
-        x_command = np.clip(linear_interpolate(start_x_command, slope, tick_count_fxp), -64,64)
-        y_command = np.clip(linear_interpolate(start_y_command, slope, tick_count_fxp), -64,64)
-
-        print('-----------------------------------')
-        print(f'Iteration: {iteration_count}')
-        print(f'X Command: {x_command}')
-        print(f'Y Command: {y_command}')
-        print(f'Elapsed Seconds: {tick_count_fxp / base_clock_rate}')
+    # simulate the X and Y moves as a batch of two
+    results = simulate_interpolation_batch(slope, [start_x_command, start_y_command], total_ticks, loop_delay, base_clock_rate=base_clock_rate)
+    x_command, y_command = results['end_correct']
+    duration = results['duration'][0]  # in seconds
 
-        # Simulate the delay (increment the tick count by the loop delay)
-        tick_count_fxp += loop_delay
+    return x_command, y_command, duration
 
-        # Update iteration count
-        iteration_count += 1
+if __name__ == '__main__':
+    end_x, end_y, duration = compute_end_values()
+    print(f"End X Command: {end_x}")
+    print(f"End Y Command: {end_y}")
+    print(f"Interpolation Duration: {duration} seconds")
 
-    duration = iteration_count * (1 / (base_clock_rate / loop_delay))  # in seconds
-    return x_command, y_command, duration
+    # compare the correct and the accumulating formulations over a range of loop delays (down to 1 tick, 4E8 iterations)
+    loop_delays = np.array([40E6, 4E6, 4E5, 4E4, 4E3, 400, 40, 4, 1])
+    results = simulate_interpolation_batch(-1E-7, 0, 4E8, loop_delays)
+    print(f"\n{'Loop delay (ticks)':>20} {'Iterations':>12} {'End (correct)':>14} {'End (accum.)':>14} {'Max divergence':>15} {'First divergence':>17}")
+    for i, loop_delay in enumerate(loop_delays):
+        print(f"{loop_delay:>20.0f} {results['num_iterations'][i]:>12d} {results['end_correct'][i]:>14.6f} {results['end_accumulating'][i]:>14.6f} {results['max_divergence'][i]:>15.6f} {results['first_divergence'][i]:>17d}")
 
-end_x, end_y, duration = compute_end_values()
-print(f"End X Command: {end_x}")
-print(f"End Y Command: {end_y}")
-print(f"Interpolation Duration: {duration} seconds")
\ No newline at end of file
+    # worst-case position error of the fixed-point commands against the ideal float trajectory
+    print(f"\nFixed point: ticks {TICK_FORMAT}, slope {SLOPE_FORMAT}, commands {COMMAND_FORMAT}")
+    slopes = np.array([-1E-7, -1E-7, 3.3E-9, 1.234567E-10])
+    results = simulate_fixed_point_batch(slopes, 0, 4E8, 400)
+    print(f"{'Slope':>14} {'Iterations':>12} {'End (fixed point)':>18} {'End (ideal)':>14} {'Max error':>12} {'At iteration':>13}")
+    for i, slope in enumerate(slopes):
+        print(f"{slope:>14.6e} {results['num_iterations'][i]:>12d} {results['end_fixed_point'][i]:>18.9f} {results['end_ideal'][i]:>14.9f} {results['max_error'][i]:>12.3e} {results['max_error_iteration'][i]:>13d}")
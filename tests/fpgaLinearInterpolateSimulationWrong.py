@@ -1,7 +1,5 @@
 import numpy as np
-
-def linear_interpolate(start_value, slope, tick_count):
-    return start_value + slope * tick_count
+from fpgaLinearInterpolateSimulation import simulate_interpolation_batch
 
 def compute_end_values():
     # Given Parameters
@@ -12,33 +10,15 @@ def compute_end_values():
     loop_delay = 40E6  # Ticks
     base_clock_rate = 40E6  # Ticks which is equal to 1 second
 
-    # Initial values
-    tick_count_fxp = 0
-    iteration_count = 0
-    x_command = start_x_command
-    y_command = start_y_command
-
-    while tick_count_fxp <= total_ticks:
-        # Update the commands
-        x_command = np.clip(linear_interpolate(x_command, slope, tick_count_fxp), -64,64)
-        y_command = np.clip(linear_interpolate(y_command, slope, tick_count_fxp), -64,64)
-
-        print('-----------------------------------')
-        print(f'Iteration: {iteration_count}')
-        print(f'X Command: {x_command}')
-        print(f'Y Command: {y_command}')
-        print(f'Elapsed Seconds: {tick_count_fxp / base_clock_rate}')
-
-        # Simulate the delay (increment the tick count by the loop delay)
-        tick_count_fxp += loop_delay
-
-        # Update iteration count
-        iteration_count += 1
+    # simulate the X and Y moves with the bug: every command is interpolated from the previous command instead of the
+    # start value (x_command = linear_interpolate(x_command, slope, tick_count_fxp)), see interpolate_accumulating
+    results = simulate_interpolation_batch(slope, [start_x_command, start_y_command], total_ticks, loop_delay, base_clock_rate=base_clock_rate)
+    x_command, y_command = results['end_accumulating']
+    duration = results['duration'][0]  # in seconds
 
-    duration = iteration_count * (1 / (base_clock_rate / loop_delay))  # in seconds
     return x_command, y_command, duration
 
 end_x, end_y, duration = compute_end_values()
 print(f"End X Command: {end_x}")
 print(f"End Y Command: {end_y}")
-print(f"Interpolation Duration: {duration} seconds")
\ No newline at end of file
+print(f"Interpolation Duration: {duration} seconds")
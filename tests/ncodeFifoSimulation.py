@@ -0,0 +1,129 @@
+import numpy as np
+import pandas as pd
+import time
+from fpgaLinearInterpolateSimulation import get_num_iterations, BASE_CLOCK_RATE
+
+# Discrete event model of the ncode pipeline of flowcharts/producerNcodeFlowchart.tex and consumerNcodeFlowchart.tex:
+#   - the producer (RT host) fills the FIFO with the first fifo_depth commands before consumption commences, and then
+#     wakes up every host_loop_period seconds and tops the FIFO up (with at most writes_per_loop commands)
+#   - the consumer (FPGA) reads the next command as soon as it has finished the previous one, and runs
+#     LinearInterpolationCommand() for floor(total_ticks / loop_delay) + 1 iterations of loop_delay ticks each
+#   - if the FIFO is empty when the consumer needs a command, it underruns and waits for the next host write
+
+# columns of an ncode command list (the local variables read from the ncode FIFOs)
+NCODE_COLUMNS = ['x_start', 'y_start', 'x_slope', 'y_slope', 'total_ticks']
+
+def load_ncode_commands(csv_path):
+    """
+    Reads an ncode command list (one command per row with the NCODE_COLUMNS columns) from a CSV file.
+    """
+    return pd.read_csv(csv_path, usecols=NCODE_COLUMNS)
+
+def get_command_durations(total_ticks, loop_delay, tick_rate=BASE_CLOCK_RATE, command_overhead_ticks=0):
+    # time (s) the consumer spends on every command: the interpolation iterations plus reading the FIFO
+    return (get_num_iterations(total_ticks, loop_delay) * loop_delay + command_overhead_ticks) / tick_rate
+
+def get_next_host_loop(times, host_loop_period):
+    # time of the first host loop at or after times (a time that falls on a loop up to rounding errors counts as on it)
+    return np.maximum(np.ceil(np.asarray(times) / host_loop_period - 1E-9) * host_loop_period, times)
+
+def simulate_ncode_fifo(durations, fifo_depth, host_loop_period, writes_per_loop=None):
+    """
+    Simulates the producer/consumer pipeline for commands that take durations (s) to consume.
+
+    The consumer start times follow the max-plus recurrence read[i] = max(read[i-1] + durations[i-1], written[i]), and
+    command i can only be written at the first host loop after command i - fifo_depth has been read. Since written[i]
+    only depends on reads fifo_depth commands earlier, blocks of fifo_depth commands are solved at once with a
+    cumulative maximum, so the Python loop runs len(durations) / fifo_depth times.
+
+    Returns a dict with the write and read times of every command, the stall (underrun) time before every command, the
+    number of underruns, the total stall time and the end-to-end duration (s).
+    """
+    durations = np.asarray(durations, dtype=np.float64)
+    num_commands = len(durations)
+    written = np.zeros(num_commands)
+    read = np.zeros(num_commands)
+
+    # end time of every command if it started at time 0, to turn the recurrence into a cumulative maximum
+    ends = np.concatenate([[0.0], np.cumsum(durations)])
+
+    for start in range(0, num_commands, fifo_depth):
+        block = slice(start, min(start + fifo_depth, num_commands))
+
+        if start == 0:
+            # the FIFO is filled before consumption commences
+            written[block] = 0.0
+        else:
+            # the slot of command i frees up when command i - fifo_depth is read, and is filled at the next host loop
+            freed = read[start - fifo_depth:block.stop - fifo_depth]
+            written[block] = get_next_host_loop(freed, host_loop_period)
+
+        # the host only writes writes_per_loop commands per loop, so command i is written at least one loop after command
+        # i - writes_per_loop (the prefill is not limited). For every residue modulo writes_per_loop this is again a
+        # cumulative maximum: written[i] = max(written[i], written[i - writes_per_loop] + host_loop_period)
+        if writes_per_loop is not None:
+            first_limited = max(start, fifo_depth + writes_per_loop)
+            for first in range(first_limited, min(block.stop, first_limited + writes_per_loop)):
+                limited = np.arange(first, block.stop, writes_per_loop)
+                offsets = np.arange(len(limited)) * host_loop_period
+                seed = written[first - writes_per_loop] + host_loop_period
+                written[limited] = offsets + np.maximum.accumulate(np.maximum(written[limited] - offsets, seed))
+
+        # read[i] = max(read[i-1] + durations[i-1], written[i]), i.e. ends[i] + max over j <= i of (written[j] - ends[j])
+        carry = read[start - 1] + durations[start - 1] - ends[start] if start > 0 else -np.inf
+        read[block] = ends[block] + np.maximum.accumulate(np.maximum(written[block] - ends[block], carry))
+
+    # the consumer stalls whenever the next command was not in the FIFO when it finished the previous one
+    ready = np.concatenate([[0.0], read[:-1] + durations[:-1]])
+    stalls = np.maximum(read - ready, 0.0)
+
+    return {
+        'written': written,
+        'read': read,
+        'stalls': stalls,
+        'num_underruns': int(np.count_nonzero(stalls > 0)),
+        'stall_time': stalls.sum(),
+        'duration': read[-1] + durations[-1] if num_commands > 0 else 0.0,
+    }
+
+def get_fifo_occupancy(written, read):
+    """
+    Returns the times at which the FIFO occupancy changes and the occupancy after each change. Events at equal times
+    are taken in pipeline order: the write of command i comes after the read that freed its slot and before its own read.
+    """
+    times = np.concatenate([written, read])
+    changes = np.concatenate([np.ones(len(written), dtype=np.int64), -np.ones(len(read), dtype=np.int64)])
+    sequence = np.concatenate([2*np.arange(len(written)), 2*np.arange(len(read)) + 1])
+    order = np.lexsort((sequence, times))
+
+    return times[order], np.cumsum(changes[order])
+
+def simulate_ncode_fifo_loop(durations, fifo_depth, host_loop_period):
+    # event by event reference of simulate_ncode_fifo (without the write limit), one command at a time
+    written, read = np.zeros(len(durations)), np.zeros(len(durations))
+    for i in range(len(durations)):
+        written[i] = 0.0 if i < fifo_depth else get_next_host_loop(read[i - fifo_depth], host_loop_period)
+        read[i] = written[i] if i == 0 else max(read[i - 1] + durations[i - 1], written[i])
+    return written, read
+
+if __name__ == '__main__':
+    # synthetic print job: many short moves (e.g. a raster of dots) with a few long ones
+    rng = np.random.default_rng(0)
+    num_commands = 100000
+    loop_delay = 400  # Ticks (100 kHz)
+    total_ticks = np.where(rng.random(num_commands) < 0.05, rng.uniform(4E5, 4E6, num_commands), rng.uniform(4E3, 4E4, num_commands))
+    durations = get_command_durations(total_ticks, loop_delay, command_overhead_ticks=40)
+    host_loop_period = 0.01  # seconds
+
+    print(f'{num_commands} commands, {durations.sum():.1f} s of interpolation, host loop period {host_loop_period*1000:.1f} ms\n')
+    print(f"{'FIFO depth':>10} {'Underruns':>10} {'Stall time (s)':>15} {'Duration (s)':>13} {'Mean occupancy':>15} {'Sim time (ms)':>14}")
+    for fifo_depth in [1, 2, 4, 8, 16, 32, 64, 128, 256]:
+        start_time = time.perf_counter()
+        results = simulate_ncode_fifo(durations, fifo_depth, host_loop_period)
+        elapsed = (time.perf_counter() - start_time) * 1000
+
+        # time weighted mean occupancy of the FIFO over the print
+        times, occupancy = get_fifo_occupancy(results['written'], results['read'])
+        mean_occupancy = np.sum(occupancy[:-1] * np.diff(times)) / results['duration']
+
+        print(f"{fifo_depth:>10d} {results['num_underruns']:>10d} {results['stall_time']:>15.3f} {results['duration']:>13.3f} {mean_occupancy:>15.2f} {elapsed:>14.2f}")
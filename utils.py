@@ -2,37 +2,78 @@
 import numpy as np
 import matplotlib.pyplot as plt
 import pandas as pd
-import librosa as lb
 import os
+import importlib
+import json
+import functools
 import time
 import threading
-from scipy.signal import savgol_filter, argrelextrema
-from scipy.io.wavfile import write
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 
-def read_afm_log_csv(filename):
+class LazyModule:
     """
-    Reads the log CSV file and returns a pandas dataframe.
+    Stands in for a module that is slow to import (librosa, scipy.signal, ...). The module is only imported the first
+    time one of its attributes is used, so scripts that only read logs start quickly.
     """
-    # specify the max column length
-    max_cols = get_max_column_length(filename)
+    def __init__(self, name):
+        self._name = name
+        self._module = None
 
-    # read the data from the CSV file
-    df = pd.read_csv(filename,header=None, delimiter=',')
+    def __getattr__(self, attr):
+        # don't import the module for special attribute lookups (copy, pickle, inspect, ...)
+        if attr.startswith('__'):
+            raise AttributeError(attr)
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
 
-    # get the header of the log dataframe
-    df_header = get_log_header_info(df)
+        # submodules such as librosa.display may have to be imported explicitly
+        try:
+            return getattr(self._module, attr)
+        except AttributeError:
+            return importlib.import_module(self._name + '.' + attr)
 
-    # set the column names to be the fourth row
-    df.columns = df.iloc[3,:]
+# heavy dependencies, imported on first use
+lb = LazyModule('librosa')
+sf = LazyModule('soundfile')
+soxr = LazyModule('soxr')
+scipy_signal = LazyModule('scipy.signal')
+scipy_stats = LazyModule('scipy.stats')
+
+def set_text_rendering(mathtext=None):
+    """
+    Sets the font rendering of the figures. LaTeX is used by default. With mathtext=True (or the AFM_MATHTEXT
+    environment variable set to 1) matplotlib's mathtext renders the same labels without spawning a TeX process.
+    """
+    if mathtext is None:
+        mathtext = os.environ.get('AFM_MATHTEXT', '0') not in ('', '0')
 
-    # drop the first 4 rows
-    df = df.iloc[4:]
+    # use latex (or mathtext with the computer modern fonts) for font rendering
+    plt.rc('text', usetex=not mathtext)
+    plt.rc('font', family='serif')
+    plt.rc('mathtext', fontset='cm')
 
-    # reset the index
-    df = df.reset_index(drop=True)
+def read_afm_log_csv(filename, dtype=np.float64):
+    """
+    Reads the log CSV file and returns a pandas dataframe. The header rows and the data are read in a single pass,
+    with the data parsed straight into typed columns (pass dtype=np.float32 to halve the memory of large FIFO logs).
+    """
+    with open(filename, 'r') as f:
+        # read the 3 experiment header rows and the column name row
+        header_rows = [f.readline().rstrip('\r\n').split(',') for _ in range(3)]
+        column_names = f.readline().rstrip('\r\n').split(',')
 
-    # convert the data to numeric
-    df = df.apply(pd.to_numeric)
+        # parse the remaining rows directly into typed columns, continuing from the current position of the file
+        df = pd.read_csv(f, header=None, names=range(len(column_names)), delimiter=',', dtype=dtype, engine='c')
+
+    # build the header dataframe (same layout as the first 3 rows of the raw log, empty fields become NaN)
+    num_cols = max(len(column_names), *[len(row) for row in header_rows])
+    df_header = pd.DataFrame([row + [''] * (num_cols - len(row)) for row in header_rows], dtype=object)
+    df_header = df_header.replace('', np.nan)
+
+    # set the column names to be the fourth row
+    df.columns = pd.Index(column_names, name=3)
 
     return df, df_header
 
@@ -61,13 +102,19 @@ def get_experiment_info_string(df_header):
         header3_values[0], header3_values[1]/1000, header3_values[2]/1000
     )
 
+    # mathtext has no text mode ~, so move the spaces before the units inside the math
+    if not plt.rcParams['text.usetex']:
+        title_string = title_string.replace('~$', '$~')
+
     return title_string
 
 def get_max_column_length(log_csv_file_path):
-    # read the fourth row of the csv file, which contains the column names
+    # read the fourth row of the csv file, which contains the column names (without reading the rest of the file)
     with open(log_csv_file_path, 'r') as f:
-        # read the fourth row
-        row = f.readlines()[3]
+        # skip the first 3 rows and read the fourth row
+        for _ in range(3):
+            f.readline()
+        row = f.readline()
     
     # split the row by commas
     row_split = row.split(',')
@@ -77,7 +124,13 @@ def get_max_column_length(log_csv_file_path):
 
     return row_length
 
-def plot_spectrogram(log_csv_file_path, signal_type, save_audio_flag, sampling_rate, f_max, spectrogram_type, window_size, n_mels):
+def plot_spectrogram(log_csv_file_path, signal_type, save_audio_flag, sampling_rate, f_max, spectrogram_type, window_size, n_mels, streaming=False, chunk_size=1000000,
+                     audio_format='wav', audio_dtype='float64', resample_audio=False):
+    # for long captures, stream the spectrogram to disk instead of loading the whole log
+    if streaming:
+        return plot_streamed_spectrogram(log_csv_file_path, signal_type, save_audio_flag, sampling_rate, f_max, spectrogram_type, window_size, n_mels, chunk_size,
+                                         audio_format=audio_format, audio_dtype=audio_dtype, resample_audio=resample_audio)
+
     # read the afm log csv file
     log_df, df_header = read_afm_log_csv(log_csv_file_path)
 
@@ -110,25 +163,77 @@ def plot_spectrogram(log_csv_file_path, signal_type, save_audio_flag, sampling_r
         # chop the signal
         signal_data_np = signal_data_np[:sampling_rate]
     
-    # if save audio flag is true, save the audio file
+    # if save audio flag is true, stream the column from disk to the audio file
     if save_audio_flag:
-        # specify the name of the audio file by getting the base name of the log csv file and appending .wav and incorporating the signal type into the name by using the signal type index value
-        audio_file_name = os.path.basename(log_csv_file_path).split('.')[0] + '-' + f'[signalColumn-{signal_type_index}]' + '.wav'
+        save_log_audio(log_csv_file_path, signal_type, signal_type_index, sampling_rate, audio_format, audio_dtype, resample_audio, chunk_size)
 
-        # get the directory of the log csv file
-        directory = os.path.dirname(log_csv_file_path)
+    # plot the spectrogram
+    spectrogram = signal2spec(signal_data_np,sampling_rate,plot_flag=True, n_mels=n_mels, f_max=f_max, spectrogram_type=spectrogram_type, window_size=window_size)
 
-        # specify the audio file path using the directory and the audio file name
-        audio_file_path = os.path.join(directory, audio_file_name)
+def save_log_audio(log_csv_file_path, signal_type, signal_type_index, sampling_rate, audio_format='wav', audio_dtype='float64', resample_audio=False, chunk_size=1000000):
+    # specify the name of the audio file by getting the base name of the log csv file and incorporating the signal type into the name by using the signal type index value
+    audio_file_name = os.path.basename(log_csv_file_path).split('.')[0] + '-' + f'[signalColumn-{signal_type_index}]' + '.' + audio_format
 
-        # write the audio file
-        write(audio_file_path, sampling_rate, signal_data_np)
+    # get the directory of the log csv file
+    directory = os.path.dirname(log_csv_file_path)
 
-        # print sucess message
-        print(f'\n\n Audio file {audio_file_name} saved successfully at {directory}!\n\n')
+    # specify the audio file path using the directory and the audio file name
+    audio_file_path = os.path.join(directory, audio_file_name)
 
-    # plot the spectrogram
-    spectrogram = signal2spec(signal_data_np,sampling_rate,plot_flag=True, n_mels=n_mels, f_max=f_max, spectrogram_type=spectrogram_type, window_size=window_size)
+    # write the audio file block by block
+    export_log_audio(log_csv_file_path, signal_type, audio_file_path, sampling_rate, resample=resample_audio, audio_dtype=audio_dtype, chunk_size=chunk_size)
+
+    # print sucess message
+    print(f'\n\n Audio file {audio_file_name} saved successfully at {directory}!\n\n')
+
+def plot_streamed_spectrogram(log_csv_file_path, signal_type, save_audio_flag, sampling_rate, f_max, spectrogram_type, window_size, n_mels, chunk_size=1000000, range_db=80.0,
+                              audio_format='wav', audio_dtype='float64', resample_audio=False):
+    """
+    Streaming version of plot_spectrogram: the spectrogram is computed in chunks into a .npy file next to the log
+    (see stream_spectrogram) and only a decimated view of the signal and of the spectrogram is plotted.
+    """
+    # read only the column names of the log
+    with open(log_csv_file_path, 'r') as f:
+        for _ in range(4):
+            column_names = f.readline().rstrip('\r\n').split(',')
+    signal_type_index = column_names.index(signal_type)
+
+    if save_audio_flag:
+        save_log_audio(log_csv_file_path, signal_type, signal_type_index, sampling_rate, audio_format, audio_dtype, resample_audio, chunk_size)
+
+    # specify the spectrogram file path the same way as the audio file path
+    spectrogram_file_name = os.path.basename(log_csv_file_path).split('.')[0] + '-' + f'[signalColumn-{signal_type_index}]' + '-spectrogram.npy'
+    spectrogram_file_path = os.path.join(os.path.dirname(log_csv_file_path), spectrogram_file_name)
+
+    # compute the spectrogram on disk
+    spectrogram, (trace_idx, trace_values) = stream_spectrogram(log_csv_file_path, signal_type, sampling_rate, spectrogram_file_path,
+                                                                window_size=window_size, range_db=range_db, f_max=f_max, n_mels=n_mels,
+                                                                spectrogram_type=spectrogram_type, chunk_size=chunk_size)
+    print(f'\n\n Spectrogram {spectrogram_file_name} ({spectrogram.shape[0]} x {spectrogram.shape[1]}) saved at {os.path.dirname(log_csv_file_path)}\n\n')
+
+    # decimate the spectrogram to the width of the figure
+    view, factor = decimate_spectrogram(spectrogram)
+
+    # create a 2 x 1 subplot with top subplot for the signal and bottom subplot for the spectrogram
+    fig, (ax1, ax2) = plt.subplots(2, 1, figsize=(12, 8))
+
+    # plot the decimated signal
+    ax1.plot(trace_idx / sampling_rate, trace_values)
+    ax1.set_title('Signal')
+    ax1.set_xlabel('Time (s)')
+    ax1.set_ylabel('Amplitude')
+
+    # plot the decimated spectrogram, every column spans factor hops
+    y_axis = 'mel' if spectrogram_type == 'mel' else 'linear'
+    specshow = lb.display.specshow(view, x_axis='time', y_axis=y_axis, sr=sampling_rate, fmax=f_max, hop_length=(window_size // 2) * factor, cmap='jet', ax=ax2, vmin=-range_db, vmax=view.max())
+
+    fig.colorbar(specshow, ax=ax2, format='%+2.0f dB')
+    ax2.set_title('Spectrogram (dB)')
+
+    plt.tight_layout()
+    plt.show()
+
+    return spectrogram
 
 
 def signal2spec(signal: np.ndarray, sample_rate: int, plot_flag=False, window_size=2048, zero_padding_factor=1,
@@ -157,20 +262,11 @@ def signal2spec(signal: np.ndarray, sample_rate: int, plot_flag=False, window_si
     # Apply gain to the audio signal
     signal = lb.util.normalize(signal) * lb.db_to_amplitude(gain_db)
 
-    # Compute the mel-scaled spectrogram
-    fft_size = window_size * zero_padding_factor
+    # Compute the mel-scaled spectrogram with the batch engine (a batch of one signal)
     hop_length = window_size // 2
-    window = lb.filters.get_window(window_type, window_size, fftbins=True)
-    spectrogram = np.abs(lb.stft(signal, n_fft=fft_size, hop_length=hop_length, window=window))**2
-
-    if spectrogram_type == "mel":
-        spectrogram = lb.feature.melspectrogram(S=spectrogram, sr=sample_rate, n_mels=n_mels,
-                                                    fmax=f_max, htk=True, norm=None)
-    spectrogram = lb.power_to_db(spectrogram, ref=np.max)
-
-    # Apply range and high boost to the mel-scaled spectrogram
-    spectrogram = np.clip(spectrogram, a_min=-range_db, a_max=None)
-    spectrogram = spectrogram + high_boost_db
+    spectrogram = signals2spec(signal[np.newaxis], sample_rate, window_size=window_size, zero_padding_factor=zero_padding_factor,
+                               window_type=window_type, range_db=range_db, high_boost_db=high_boost_db, f_max=f_max,
+                               n_mels=n_mels, spectrogram_type=spectrogram_type, normalize=False)[0]
 
     # Plot the mel-scaled spectrogram if plot_flag is True
     if plot_flag:
@@ -194,33 +290,428 @@ def signal2spec(signal: np.ndarray, sample_rate: int, plot_flag=False, window_si
 
     return spectrogram
 
+@functools.lru_cache(maxsize=None)
+def get_stft_window(window_type, window_size):
+    """
+    Returns the STFT window of the given type and size (cached, so it is only built once per window).
+    """
+    return lb.filters.get_window(window_type, window_size, fftbins=True)
+
+@functools.lru_cache(maxsize=None)
+def get_mel_basis(sample_rate, fft_size, n_mels, f_max):
+    """
+    Returns the mel filter bank used by signal2spec (cached per sample rate, FFT size, number of mels and f_max).
+    """
+    return lb.filters.mel(sr=sample_rate, n_fft=fft_size, n_mels=n_mels, fmax=f_max, htk=True, norm=None)
+
+def signals2spec(signals, sample_rate, window_size=2048, zero_padding_factor=1, window_type='hann', gain_db=0.0,
+                 range_db=80.0, high_boost_db=0.0, f_max=20000, n_mels=1024, spectrogram_type='mel', normalize=True, output_path=None):
+    """
+    Batch version of signal2spec: converts a stack of signals (one per row, e.g. several channels of a log) into a
+    stack of spectrograms with one batched STFT and one batched mel projection.
+
+    Args:
+        signals (np.ndarray): The input signals as a 2D (num_signals, num_samples) array.
+        sample_rate (int): The sample rate of the input signals.
+        normalize (bool, optional): Whether to peak normalize every signal before applying the gain. Defaults to True.
+        output_path (str, optional): If given, the spectrograms are written to this .npy file and returned as a memory map.
+        The remaining arguments are the same as for signal2spec.
+
+    Returns:
+        np.ndarray: The (num_signals, num_bins, num_frames) spectrograms in dB, each relative to its own maximum.
+    """
+    signals = np.atleast_2d(np.asarray(signals, dtype=np.float64))
+
+    # Apply gain to the audio signals
+    if normalize:
+        signals = lb.util.normalize(signals, axis=-1)
+    signals = signals * lb.db_to_amplitude(gain_db)
+
+    # Compute the power spectrograms of all signals at once (the window and mel basis are cached)
+    fft_size = window_size * zero_padding_factor
+    hop_length = window_size // 2
+    window = get_stft_window(window_type, window_size)
+    spectrograms = np.abs(lb.stft(signals, n_fft=fft_size, hop_length=hop_length, win_length=window_size, window=window))**2
+
+    if spectrogram_type == "mel":
+        spectrograms = np.einsum("...ft,mf->...mt", spectrograms, get_mel_basis(sample_rate, fft_size, n_mels, f_max), optimize=True)
+
+    # convert to dB relative to the maximum of each spectrogram
+    ref = np.max(spectrograms, axis=(-2, -1), keepdims=True)
+    spectrograms = lb.power_to_db(spectrograms, ref=ref)
+
+    # Apply range and high boost to the spectrograms
+    spectrograms = np.clip(spectrograms, a_min=-range_db, a_max=None)
+    spectrograms = spectrograms + high_boost_db
+
+    # write the spectrograms to disk if requested
+    if output_path is not None:
+        out = np.lib.format.open_memmap(output_path, mode='w+', dtype=spectrograms.dtype, shape=spectrograms.shape)
+        out[:] = spectrograms
+        out.flush()
+        return out
+
+    return spectrograms
+
+def log_files2spec(log_csv_file_paths, signal_types, sample_rate, output_path=None, **kwargs):
+    """
+    Computes the spectrograms of the signal_types columns (a column name or a list of them) of many log CSV files with
+    one call to signals2spec. The spectrograms are ordered by file and then by signal type. Shorter signals are zero
+    padded to the length of the longest one, so all spectrograms have the same number of frames.
+    """
+    if isinstance(signal_types, str):
+        signal_types = [signal_types]
+
+    # read the chosen columns of every log file
+    signals = []
+    for path in log_csv_file_paths:
+        log_df, _ = read_afm_log_csv(path)
+        signals += [log_df[signal_type].to_numpy() for signal_type in signal_types]
+
+    # stack the signals, zero padding the shorter ones
+    stacked = np.zeros((len(signals), max(len(signal) for signal in signals)))
+    for i, signal in enumerate(signals):
+        stacked[i, :len(signal)] = signal
+
+    return signals2spec(stacked, sample_rate, output_path=output_path, **kwargs)
+
+def count_log_rows(log_csv_file_path, block_size=1 << 24):
+    """
+    Returns the number of data rows of a log CSV (see read_afm_log_csv) by counting newlines in binary blocks,
+    without parsing the file.
+    """
+    num_lines = 0
+    last_byte = b'\n'
+    with open(log_csv_file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            num_lines += block.count(b'\n')
+            last_byte = block[-1:]
+
+    # count a last row without a trailing newline, and drop the 4 header rows
+    if last_byte != b'\n':
+        num_lines += 1
+    return max(num_lines - 4, 0)
+
+def iter_stft_power_frames(chunks, fft_size, hop_length, window):
+    """
+    Yields blocks of (num_fft_bins, num_frames) power spectrogram frames of a signal that is passed in as consecutive
+    1D chunks. The frames are the same as those of lb.stft(center=True) on the whole signal: the signal is zero padded
+    by fft_size // 2 samples on both ends and fft_size - hop_length samples are carried over between chunks.
+    """
+    # the window is centered in the FFT frame, as done by lb.stft
+    window = lb.util.pad_center(window, size=fft_size)
+    pad = np.zeros(fft_size // 2)
+
+    def frames_of(buffer):
+        if len(buffer) < fft_size:
+            return None, 0
+        num_frames = (len(buffer) - fft_size) // hop_length + 1
+        frames = np.lib.stride_tricks.sliding_window_view(buffer, fft_size)[::hop_length][:num_frames]
+        return np.abs(np.fft.rfft(frames * window, axis=-1)).T**2, num_frames
+
+    buffer = pad
+    for chunk in chunks:
+        buffer = np.concatenate([buffer, chunk])
+        power, num_frames = frames_of(buffer)
+        if num_frames > 0:
+            yield power
+            buffer = buffer[num_frames * hop_length:]
+
+    # zero pad the end of the signal and emit the remaining frames
+    power, num_frames = frames_of(np.concatenate([buffer, pad]))
+    if num_frames > 0:
+        yield power
+
+def stream_spectrogram(log_csv_file_path, signal_type, sample_rate, output_path, window_size=2048, zero_padding_factor=1,
+                       window_type='hann', range_db=80.0, high_boost_db=0.0, f_max=20000, n_mels=1024,
+                       spectrogram_type='mel', chunk_size=1000000, points_per_chunk=2000):
+    """
+    Streaming version of signals2spec for a single column of a log CSV that does not fit in memory. The column is read
+    in chunks of chunk_size samples, the STFT frames are computed incrementally (see iter_stft_power_frames) and
+    written to a float32 .npy memory map at output_path, which is converted to dB in place in a second pass.
+
+    Peak normalization and gain are skipped, since the dB values are relative to the maximum of the spectrogram anyway.
+
+    Returns:
+        np.memmap: The (num_bins, num_frames) spectrogram in dB.
+        tuple: (sample indices, values) of a min/max decimated trace of the signal, for plotting.
+    """
+    fft_size = window_size * zero_padding_factor
+    hop_length = window_size // 2
+    window = get_stft_window(window_type, window_size)
+    mel_basis = get_mel_basis(sample_rate, fft_size, n_mels, f_max) if spectrogram_type == 'mel' else None
+    num_bins = n_mels if spectrogram_type == 'mel' else fft_size // 2 + 1
+
+    # the number of frames is known from the number of rows, so the whole spectrogram can be allocated on disk
+    num_samples = count_log_rows(log_csv_file_path)
+    num_frames = 1 + (num_samples + 2 * (fft_size // 2) - fft_size) // hop_length
+    spectrogram = np.lib.format.open_memmap(output_path, mode='w+', dtype=np.float32, shape=(num_bins, num_frames))
+
+    # keep a decimated trace of the signal while it streams past
+    trace_idx, trace_values = [], []
+    def samples():
+        for start, chunk in iter_log_column_chunks(log_csv_file_path, [signal_type], chunk_size=chunk_size):
+            chunk = chunk[:, 0]
+            idx, values = minmax_decimate(np.arange(start, start + len(chunk)), chunk, points_per_chunk)
+            trace_idx.append(idx)
+            trace_values.append(values)
+            yield chunk
+
+    # first pass: write the power frames to disk and keep track of the maximum
+    ref = 0.0
+    frame = 0
+    for power in iter_stft_power_frames(samples(), fft_size, hop_length, window):
+        if mel_basis is not None:
+            power = mel_basis @ power
+        spectrogram[:, frame:frame + power.shape[1]] = power
+        ref = max(ref, power.max())
+        frame += power.shape[1]
+
+    # second pass: convert to dB relative to the maximum, apply range and high boost, one block of frames at a time
+    block = max(1, chunk_size // hop_length)
+    for start in range(0, num_frames, block):
+        spectrogram_db = lb.power_to_db(spectrogram[:, start:start + block], ref=ref)
+        spectrogram[:, start:start + block] = np.clip(spectrogram_db, a_min=-range_db, a_max=None) + high_boost_db
+    spectrogram.flush()
+
+    if trace_idx:
+        trace = (np.concatenate(trace_idx), np.concatenate(trace_values))
+    else:
+        trace = (np.empty(0, dtype=int), np.empty(0))
+    return spectrogram, trace
+
+def decimate_spectrogram(spectrogram, max_frames=2000, block_frames=100000):
+    """
+    Returns a view of a (possibly memory mapped) spectrogram with at most max_frames frames for plotting, taking the
+    maximum over groups of consecutive frames so short events stay visible, and the number of frames per group.
+    """
+    num_frames = spectrogram.shape[1]
+    factor = max(1, int(np.ceil(num_frames / max_frames)))
+
+    # reduce the spectrogram in blocks that are a multiple of the group size, so the whole thing is never in memory
+    block_frames = max(factor, block_frames - block_frames % factor)
+    view = [np.maximum.reduceat(np.asarray(spectrogram[:, start:start + block_frames]), np.arange(0, min(block_frames, num_frames - start), factor), axis=1)
+            for start in range(0, num_frames, block_frames)]
+
+    return np.concatenate(view, axis=1), factor
+
 def get_signal_period_overlay(signal, time, window_size=11, poly_order=3):
+    """
+    Returns the time between consecutive troughs of a (smoothed) periodic signal, as an array of the same shape as the
+    signal where every sample holds the period it belongs to. The samples after the last trough take the last period
+    and the samples before the first trough take the first period. Signals with fewer than 2 troughs give 0.
+
+    signal can also be a 2D stack of signals sampled at the same times (one signal per row), in which case the periods
+    of all rows are computed in one call.
+    """
+    signal = np.asarray(signal)
+    signals = np.atleast_2d(signal)
+    num_rows, num_samples = signals.shape
+
     # Apply Savitzky-Golay filter
-    smoothed_x_command = savgol_filter(signal, window_size, poly_order)
+    smoothed = scipy_signal.savgol_filter(signals, window_size, poly_order, axis=-1)
 
-    # Now detect troughs
-    trough_indices = argrelextrema(smoothed_x_command, np.less)
+    # Now detect troughs, i.e. samples lower than both neighbours (same as argrelextrema(smoothed, np.less, axis=-1)
+    # but with plain slices instead of clipped takes). rows and cols are sorted by row and then by sample.
+    is_trough = (smoothed[:,1:-1] < smoothed[:,:-2]) & (smoothed[:,1:-1] < smoothed[:,2:])
+    rows, cols = np.nonzero(is_trough)
+    cols = cols + 1
 
-    # find periods
-    periods = np.diff(time[trough_indices])
+    # get the period from every trough to the next trough in the same row (NaN for the last trough of a row)
+    trough_times = np.asarray(time)[cols]
+    same_row = rows[1:] == rows[:-1]
+    next_periods = np.append(np.where(same_row, np.diff(trough_times), np.nan), np.nan)
 
-    # create a new array for the adjusted periods
-    adjusted_periods = np.empty_like(signal)
+    # the last trough of a row takes the period before it, and rows with a single trough get 0
+    prev_periods = np.insert(next_periods[:-1], 0, np.nan)
+    trough_values = np.where(np.isnan(next_periods), prev_periods, next_periods)
+    trough_values = np.nan_to_num(trough_values, nan=0.0)
 
-    # assign period values to corresponding time ranges
-    for i in range(len(periods)):
-        start = trough_indices[0][i]
-        end = trough_indices[0][i+1]
-        adjusted_periods[start:end] = periods[i]
+    # the samples before the first trough of a row take the value of that trough (0 for rows without troughs)
+    row_values = np.zeros(num_rows)
+    if len(rows) > 0:
+        first_trough = np.minimum(np.searchsorted(rows, np.arange(num_rows)), len(rows) - 1)
+        row_values = np.where(rows[first_trough] == np.arange(num_rows), trough_values[first_trough], 0.0)
 
-    # if there are remaining indices after the last trough, assign them the last period value
-    if len(periods) > 0:
-        if end < len(signal):
-            adjusted_periods[end:] = periods[-1]
-    else:
-        adjusted_periods[:] = 0
-    
-    return adjusted_periods
+    # every row start and every trough starts a segment of constant period in the flattened signals
+    segment_starts = np.concatenate([np.arange(num_rows) * num_samples, rows * num_samples + cols])
+    segment_values = np.concatenate([row_values, trough_values])
+    order = np.argsort(segment_starts, kind='stable')
+    segment_starts, segment_values = segment_starts[order], segment_values[order]
+
+    # fill the segments without a Python loop
+    segment_lengths = np.diff(np.append(segment_starts, num_rows * num_samples))
+    adjusted_periods = np.repeat(segment_values, segment_lengths)
+
+    return adjusted_periods.reshape(signal.shape)
+
+def iter_log_column_chunks(log_csv_file_path, columns, chunk_size=1000000, dtype=np.float64):
+    """
+    Yields (start sample index, 2D array) chunks of the given columns of a log CSV (see read_afm_log_csv), so that
+    logs larger than RAM can be processed in constant memory.
+    """
+    with open(log_csv_file_path, 'r') as f:
+        # skip the 3 experiment header rows and read the column names
+        for _ in range(3):
+            f.readline()
+        column_names = f.readline().rstrip('\r\n').split(',')
+        usecols = [column_names.index(column) for column in columns]
+
+        # parse the rest of the file one chunk at a time
+        reader = pd.read_csv(f, header=None, names=range(len(column_names)), usecols=usecols, delimiter=',', dtype=dtype, chunksize=chunk_size)
+        start = 0
+        for chunk in reader:
+            data = chunk[usecols].to_numpy()
+            yield start, data
+            start += len(data)
+
+class StreamingTroughDetector:
+    """
+    Chunked version of the trough detection of get_signal_period_overlay for signals that don't fit in memory.
+
+    Consecutive 1D pieces of the signal are passed to process() and the end of the signal is marked with finish().
+    The Savitzky-Golay filter is applied with window_size-1 samples of overlap between chunks (so the smoothed signal is
+    identical to filtering the whole signal at once), and the last two smoothed samples are carried over so that
+    troughs on chunk boundaries are found. Both methods return a list of (trough_index, period) events, where period
+    is the time (s) since the previous trough (NaN for the first trough).
+    """
+    def __init__(self, sampling_rate, window_size=11, poly_order=3):
+        self.sampling_rate = sampling_rate
+        self.window_size = window_size
+        self.poly_order = poly_order
+
+        # raw samples that still have to be smoothed (plus context), and the global index of their first sample
+        self.buffer = np.empty(0)
+        self.buffer_start = 0
+
+        # global index of the first sample that has not been smoothed yet
+        self.next_out = 0
+
+        # last two smoothed samples and the last trough (carried over chunk boundaries)
+        self.last_smoothed = np.full(2, np.nan)
+        self.last_trough = None
+
+    @property
+    def num_samples(self):
+        return self.buffer_start + len(self.buffer)
+
+    def process(self, chunk):
+        self.buffer = np.concatenate([self.buffer, np.asarray(chunk, dtype=np.float64)])
+
+        # smooth every sample that has a complete window in the buffer (and the start of the signal)
+        end = self.num_samples - self.window_size // 2
+        if len(self.buffer) < self.window_size or end <= self.next_out:
+            return []
+        events = self._get_events(self._smooth(end))
+
+        # only keep the context needed for the next chunk
+        keep_from = max(self.next_out - (self.window_size - 1), self.buffer_start)
+        self.buffer = self.buffer[keep_from - self.buffer_start:]
+        self.buffer_start = keep_from
+
+        return events
+
+    def finish(self):
+        # smooth the end of the signal (with the same edge handling as filtering the whole signal)
+        if self.num_samples <= self.next_out:
+            return []
+
+        return self._get_events(self._smooth(self.num_samples))
+
+    def _smooth(self, end):
+        # smooth the buffer and find the troughs of the samples next_out:end
+        smoothed = scipy_signal.savgol_filter(self.buffer, self.window_size, self.poly_order)[self.next_out - self.buffer_start:end - self.buffer_start]
+
+        # prepend the last two smoothed samples so that troughs on the chunk boundary are found
+        values = np.concatenate([self.last_smoothed, smoothed])
+        is_trough = (values[1:-1] < values[:-2]) & (values[1:-1] < values[2:])
+        troughs = np.nonzero(is_trough)[0] + 1 + self.next_out - 2
+        self.last_smoothed = values[-2:]
+        self.next_out = end
+
+        return troughs
+
+    def _get_events(self, troughs):
+        # the period of every trough is the time since the previous one
+        previous = np.insert(troughs[:-1], 0, self.last_trough if self.last_trough is not None else -1)
+        periods = np.where(previous >= 0, (troughs - previous) / self.sampling_rate, np.nan)
+        if len(troughs) > 0:
+            self.last_trough = troughs[-1]
+
+        return list(zip(troughs.tolist(), periods.tolist()))
+
+def stream_signal_troughs(chunks, sampling_rate, window_size=11, poly_order=3):
+    """
+    Generator that runs a StreamingTroughDetector over an iterable of signal chunks and yields its (trough_index, period) events.
+    """
+    detector = StreamingTroughDetector(sampling_rate, window_size, poly_order)
+    for chunk in chunks:
+        yield from detector.process(chunk)
+    yield from detector.finish()
+
+def get_period_track(events, num_samples):
+    """
+    Converts the (trough_index, period) events of a signal into a run-length period track
+    (segment_starts, segment_periods, num_samples): sample segment_starts[i] up to the next segment start holds
+    segment_periods[i], with the same values that get_signal_period_overlay assigns to the whole signal.
+    """
+    # signals with fewer than 2 troughs have a period of 0
+    if len(events) < 2:
+        return np.zeros(1, dtype=np.int64), np.zeros(1), num_samples
+
+    # every trough takes the period to the next trough (the last one the period before it), the start takes the first period
+    troughs = np.array([event[0] for event in events], dtype=np.int64)
+    periods = np.array([event[1] for event in events])
+    segment_starts = np.insert(troughs, 0, 0)
+    segment_periods = np.concatenate([[periods[1]], periods[1:], [periods[-1]]])
+
+    return segment_starts, segment_periods, num_samples
+
+def get_streaming_period_track(chunks, sampling_rate, window_size=11, poly_order=3):
+    """
+    Runs a StreamingTroughDetector over an iterable of signal chunks and returns its run-length period track (see get_period_track).
+    """
+    detector = StreamingTroughDetector(sampling_rate, window_size, poly_order)
+    events = []
+    for chunk in chunks:
+        events += detector.process(chunk)
+    events += detector.finish()
+
+    return get_period_track(events, detector.num_samples)
+
+def sample_period_track(segment_starts, segment_periods, indices):
+    """
+    Returns the period of a run-length period track (see get_period_track) at the given sample indices.
+    """
+    return segment_periods[np.searchsorted(segment_starts, indices, side='right') - 1]
+
+def stream_log_traces(log_csv_file_path, columns, period_columns, sampling_rate, chunk_size=1000000, points_per_chunk=2000, window_size=11):
+    """
+    Streams the given columns of a log CSV in chunks, without holding the full log in memory, and returns min/max
+    decimated traces of every column (a dict of column: (sample indices, values)) and the run-length period track
+    (see get_period_track) of every column in period_columns.
+    """
+    traces = {column: ([], []) for column in columns}
+    detectors = {column: StreamingTroughDetector(sampling_rate, window_size) for column in period_columns}
+    events = {column: [] for column in period_columns}
+
+    # decimate every chunk for plotting and pass the period columns on to their trough detectors
+    for start, chunk in iter_log_column_chunks(log_csv_file_path, columns, chunk_size):
+        for i, column in enumerate(columns):
+            idx, values = minmax_decimate(np.arange(start, start + len(chunk)), chunk[:,i], points_per_chunk // 2)
+            traces[column][0].append(idx)
+            traces[column][1].append(values)
+            if column in detectors:
+                events[column] += detectors[column].process(chunk[:,i])
+
+    # finish the trough detection and build the period tracks
+    tracks = {}
+    for column, detector in detectors.items():
+        events[column] += detector.finish()
+        tracks[column] = get_period_track(events[column], detector.num_samples)
+    traces = {column: (np.concatenate(idx), np.concatenate(values)) for column, (idx, values) in traces.items()}
+
+    return traces, tracks
 
 class Timer:
     def __init__(self, dt=0.01):
@@ -251,6 +742,1309 @@ def get_loop_delay(metadata_path):
 
     return loop_delay
 
+def get_command_steps(command):
+    """
+    Returns the sample indices at which a piecewise constant command changes, and the command values before and after
+    every change.
+    """
+    command = np.asarray(command)
+    step_indices = np.flatnonzero(command[1:] != command[:-1]) + 1
+
+    return step_indices, command[step_indices - 1], command[step_indices]
+
+def first_index_in_segments(mask, segment_starts, segment_ends):
+    """
+    Returns, for every segment [start, end), the first index where mask is True, or -1 if there is none.
+    """
+    true_indices = np.flatnonzero(mask)
+    if len(true_indices) == 0:
+        return np.full(len(segment_starts), -1)
+
+    # first True index at or after the start of every segment, which only counts if it is before the segment ends
+    positions = np.searchsorted(true_indices, segment_starts, side='left')
+    first = true_indices[np.minimum(positions, len(true_indices) - 1)]
+    found = (positions < len(true_indices)) & (first < segment_ends)
+
+    return np.where(found, first, -1)
+
+def last_index_in_segments(mask, segment_starts, segment_ends):
+    """
+    Returns, for every segment [start, end), the last index where mask is True, or -1 if there is none.
+    """
+    true_indices = np.flatnonzero(mask)
+    if len(true_indices) == 0:
+        return np.full(len(segment_starts), -1)
+
+    # last True index before the end of every segment, which only counts if it is at or after the segment start
+    positions = np.searchsorted(true_indices, segment_ends, side='left') - 1
+    last = true_indices[np.maximum(positions, 0)]
+    found = (positions >= 0) & (last >= segment_starts)
+
+    return np.where(found, last, -1)
+
+def get_step_response_times(response, command, time, tolerance=0.05, rise_limits=(0.1, 0.9)):
+    """
+    Measures the response to every step of a piecewise constant command (each step lasting until the next one) without
+    looping over the steps. Returns a dataframe with one row per step: the step time and values, the rise time (from
+    rise_limits[0] to rise_limits[1] of the step), the entry time (first sample within tolerance of the step size around
+    the new command), the settling time (after which the response stays within the tolerance band until the next step)
+    and the overshoot (fraction of the step size). Times the response does not reach are NaN.
+    """
+    response = np.asarray(response, dtype=np.float64)
+    time = np.asarray(time, dtype=np.float64)
+    step_starts, initial_values, final_values = get_command_steps(command)
+    step_ends = np.append(step_starts[1:], len(response))
+    step_sizes = final_values - initial_values
+
+    # normalised response of every sample with respect to the step it belongs to (0 before the first step)
+    segment = np.searchsorted(step_starts, np.arange(len(response)), side='right') - 1
+    in_step = segment >= 0
+    segment = np.maximum(segment, 0)
+    normalised = np.where(in_step, (response - initial_values[segment]) / step_sizes[segment], 0.0) if len(step_starts) > 0 else np.zeros(len(response))
+
+    def elapsed(indices):
+        # time from the step to the given sample of every step, NaN where the sample was not found
+        return np.where(indices >= 0, time[np.maximum(indices, 0)] - time[step_starts], np.nan)
+
+    # rise time between the two crossings of the rise limits
+    rise_start = first_index_in_segments(in_step & (normalised >= rise_limits[0]), step_starts, step_ends)
+    rise_end = first_index_in_segments(in_step & (normalised >= rise_limits[1]), step_starts, step_ends)
+    rise_time = np.where((rise_start >= 0) & (rise_end >= 0), elapsed(rise_end) - elapsed(rise_start), np.nan)
+
+    # the response settles after its last sample outside the tolerance band (never, if that is the last sample of the step)
+    inside = in_step & (np.abs(normalised - 1) <= tolerance)
+    entry = first_index_in_segments(inside, step_starts, step_ends)
+    last_outside = last_index_in_segments(in_step & ~inside, step_starts, step_ends)
+    settled = np.where(last_outside < 0, step_starts, last_outside + 1)
+    settling_time = np.where(settled < step_ends, elapsed(np.where(settled < step_ends, settled, -1)), np.nan)
+
+    # overshoot beyond the new command, as a fraction of the step size
+    overshoot = np.maximum.reduceat(normalised, step_starts) - 1 if len(step_starts) > 0 else np.array([])
+
+    return pd.DataFrame({
+        'step_time': time[step_starts],
+        'initial_command': initial_values,
+        'final_command': final_values,
+        'step_size': step_sizes,
+        'rise_time': rise_time,
+        'entry_time': elapsed(entry),
+        'settling_time': settling_time,
+        'overshoot': np.maximum(overshoot, 0.0),
+    })
+
+# soundfile subtypes of the audio sample formats that can be exported (FLAC only supports integer samples)
+AUDIO_SUBTYPES = {'float64': 'DOUBLE', 'float32': 'FLOAT', 'int16': 'PCM_16'}
+
+def write_audio_chunks(get_chunks, audio_file_path, sampling_rate, source_rate=None, audio_dtype='float64', normalize=False):
+    """
+    Writes a signal to a WAV or FLAC file (picked from the extension) one block at a time, so the memory used does
+    not depend on the length of the signal.
+
+    get_chunks is a function returning an iterator over consecutive 1D pieces of the signal. It is called twice when
+    the signal is normalized (once to find the peak and once to write). If source_rate is given and differs from
+    sampling_rate, the signal is resampled from source_rate to sampling_rate with a streaming soxr resampler, otherwise
+    every sample of the signal becomes one audio sample. int16 samples (and FLAC files) are always peak normalized.
+    """
+    file_format = 'FLAC' if audio_file_path.lower().endswith('.flac') else 'WAV'
+    if file_format == 'FLAC' and audio_dtype != 'int16':
+        raise ValueError(f'FLAC files only support int16 samples, not {audio_dtype}!')
+
+    # find the peak of the signal in a first pass if it has to be normalized
+    scale = 1.0
+    if normalize or audio_dtype == 'int16':
+        peak = max((np.max(np.abs(chunk)) for chunk in get_chunks() if len(chunk) > 0), default=0.0)
+        scale = 1.0 / peak if peak > 0 else 1.0
+
+    # resample in a streaming fashion only if the rates differ
+    resampler = None
+    if source_rate is not None and source_rate != sampling_rate:
+        resampler = soxr.ResampleStream(source_rate, sampling_rate, 1, dtype='float64')
+
+    num_written = 0
+    with sf.SoundFile(audio_file_path, 'w', samplerate=int(sampling_rate), channels=1, format=file_format, subtype=AUDIO_SUBTYPES[audio_dtype]) as f:
+        def write_block(block):
+            # the resampler can overshoot the peak slightly, so clip the normalized integer samples
+            if audio_dtype == 'int16':
+                block = np.clip(block, -1.0, 1.0)
+            f.write(block)
+            return len(block)
+
+        for chunk in get_chunks():
+            chunk = np.asarray(chunk, dtype=np.float64) * scale
+            if resampler is not None:
+                chunk = resampler.resample_chunk(chunk)
+            num_written += write_block(chunk)
+
+        # flush the samples held back by the resampler
+        if resampler is not None:
+            num_written += write_block(resampler.resample_chunk(np.empty(0), last=True))
+
+    return num_written
+
+def export_log_audio(log_csv_file_path, signal_type, audio_file_path, sampling_rate, resample=False, audio_dtype='float64', normalize=False, chunk_size=1000000):
+    """
+    Streams a column of a log CSV to a WAV/FLAC file (see write_audio_chunks) without loading the whole log.
+
+    If resample is True, the column is resampled from the loop rate in the metadata.txt next to the log to
+    sampling_rate. Otherwise every sample becomes one audio sample (as done by plot_spectrogram before), and signals
+    shorter than one second of audio are repeated as many whole times as fit in one second.
+    """
+    source_rate = None
+    if resample:
+        metadata_path = os.path.join(os.path.dirname(log_csv_file_path), 'metadata.txt')
+        if os.path.isfile(metadata_path):
+            source_rate = get_loop_delay(metadata_path)
+        else:
+            print(f'\n\n No metadata.txt found next to {log_csv_file_path}, writing the audio without resampling.\n\n')
+
+    # repeat short signals up to one second (of input samples), the same way plot_spectrogram tiles them
+    num_samples = count_log_rows(log_csv_file_path)
+    num_repeats = 1
+    if 0 < num_samples < (source_rate or sampling_rate):
+        num_repeats = max(1, int((source_rate or sampling_rate) / num_samples))
+
+    def get_chunks():
+        for _ in range(num_repeats):
+            for _, chunk in iter_log_column_chunks(log_csv_file_path, [signal_type], chunk_size=chunk_size):
+                yield chunk[:, 0]
+
+    return write_audio_chunks(get_chunks, audio_file_path, sampling_rate, source_rate=source_rate, audio_dtype=audio_dtype, normalize=normalize)
+
+def export_channel_audio(folder_dir, channel, audio_file_path, sampling_rate, audio_dtype='float64', normalize=False, chunk_size=1000000):
+    """
+    Streams a channel of a data log folder (e.g. 'obd-sum') to a WAV/FLAC file, resampled from the loop rate in the
+    folder's metadata.txt to sampling_rate. The channel is read in chunks from its memory mapped binary cache.
+    """
+    data = load_cached_channel(folder_dir, channel)
+    source_rate = get_loop_delay(os.path.join(folder_dir, 'metadata.txt'))
+
+    def get_chunks():
+        for start in range(0, len(data), chunk_size):
+            yield data[start:start + chunk_size]
+
+    return write_audio_chunks(get_chunks, audio_file_path, sampling_rate, source_rate=source_rate, audio_dtype=audio_dtype, normalize=normalize)
+
+# name of the hidden folder (inside each data-log folder) that holds the binary channel cache
+CHANNEL_CACHE_DIRNAME = '.channel-cache'
+
+# lock guarding the cache manifest when channels are cached from several threads at once
+_channel_cache_lock = threading.Lock()
+
+def read_channel_csv(csv_path, dtype=np.float64):
+    """
+    Reads a single-channel data log CSV (e.g. x-command.csv) and returns the first column as a NumPy array.
+    """
+    # parse only the first column straight into a typed array
+    df = pd.read_csv(csv_path, header=None, usecols=[0], delimiter=',', dtype=dtype, engine='c')
+
+    return df.iloc[:,0].to_numpy()
+
+def get_channel_cache_manifest(folder_dir):
+    """
+    Returns the channel cache manifest of a data log folder (an empty dict if the folder has not been cached yet).
+    """
+    manifest_path = os.path.join(folder_dir, CHANNEL_CACHE_DIRNAME, 'manifest.json')
+
+    # a missing or unreadable manifest simply means that every channel has to be rebuilt
+    try:
+        with open(manifest_path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def get_channel_source_info(folder_dir, channel, dtype=np.float64):
+    """
+    Returns the state of a channel CSV (mtime, size) and the cache dtype, as recorded in the cache manifest.
+    """
+    stat = os.stat(os.path.join(folder_dir, channel + '.csv'))
+
+    return {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size, 'dtype': np.dtype(dtype).str}
+
+def is_channel_cache_valid(folder_dir, channel, dtype=np.float64):
+    """
+    Returns True if the cached .npy file of a channel exists and its manifest entry still matches the channel CSV.
+    """
+    source_info = get_channel_source_info(folder_dir, channel, dtype)
+    entry = get_channel_cache_manifest(folder_dir).get(channel)
+    npy_path = os.path.join(folder_dir, CHANNEL_CACHE_DIRNAME, channel + '.npy')
+
+    return entry is not None and all(entry.get(key) == value for key, value in source_info.items()) and os.path.isfile(npy_path)
+
+def write_channel_cache(folder_dir, channel, data, source_info):
+    """
+    Writes the parsed data of a channel to the channel cache, records source_info in the manifest and returns the
+    cached data as a read-only memory map.
+    """
+    cache_dir = os.path.join(folder_dir, CHANNEL_CACHE_DIRNAME)
+    npy_path = os.path.join(cache_dir, channel + '.npy')
+
+    # write the channel through a temporary file so readers never see a partial file
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = npy_path + f'.{os.getpid()}-{threading.get_ident()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.save(f, data)
+    os.replace(tmp_path, npy_path)
+
+    # record the source state in the manifest
+    update_channel_cache_manifest(folder_dir, channel, dict(source_info, source=channel + '.csv', shape=list(data.shape)))
+
+    return np.load(npy_path, mmap_mode='r')
+
+def update_channel_cache_manifest(folder_dir, key, entry):
+    """
+    Sets a single entry of the channel cache manifest.
+    """
+    manifest_path = os.path.join(folder_dir, CHANNEL_CACHE_DIRNAME, 'manifest.json')
+
+    # read, update and atomically rewrite the manifest
+    with _channel_cache_lock:
+        manifest = get_channel_cache_manifest(folder_dir)
+        manifest[key] = entry
+        tmp_path = manifest_path + f'.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, manifest_path)
+
+def load_cached_channel(folder_dir, channel, dtype=np.float64):
+    """
+    Returns the data of a channel (e.g. 'x-command' for x-command.csv) of a data log folder as a read-only memory map.
+
+    The first call converts the CSV into a .npy file inside the folder's channel cache and records the CSV mtime and
+    size in the cache manifest. Later calls memory map the .npy file directly, unless the CSV has changed since, in
+    which case the channel is rebuilt.
+    """
+    # use the cached channel if the manifest entry still matches the source file
+    if is_channel_cache_valid(folder_dir, channel, dtype):
+        return np.load(os.path.join(folder_dir, CHANNEL_CACHE_DIRNAME, channel + '.npy'), mmap_mode='r')
+
+    # otherwise parse the CSV and write the channel to the cache
+    source_info = get_channel_source_info(folder_dir, channel, dtype)
+    data = read_channel_csv(os.path.join(folder_dir, channel + '.csv'), dtype=dtype)
+
+    return write_channel_cache(folder_dir, channel, data, source_info)
+
+# number of blocks of one pyramid level that are merged into a block of the next level
+PYRAMID_FACTOR = 8
+
+class ChannelPyramid:
+    """
+    Multi-resolution min/max/mean index of a channel, used to answer plot queries for any visible window in
+    O(pixels) time instead of O(samples).
+
+    Level k (k = 1, 2, ...) holds the min, max and mean of consecutive blocks of factor**k samples as a (3, n_blocks)
+    array. Level 0 is the full resolution data itself. Queries round the window edges to the blocks of the level they
+    read from, which are always shorter than one output bin.
+    """
+    def __init__(self, data, levels, factor=PYRAMID_FACTOR):
+        self.data = data
+        self.levels = levels
+        self.factor = factor
+
+    @classmethod
+    def build(cls, data, factor=PYRAMID_FACTOR):
+        """
+        Builds the pyramid of a channel with a single pass over the data and one pass over each (smaller) level.
+        """
+        levels = []
+        n = len(data)
+        block_size = factor
+
+        # the first level is built from the full resolution data, the next ones from the previous level
+        prev_min = prev_max = prev_sum = np.asarray(data)
+
+        # merge factor blocks of the previous level until the level would have fewer than factor blocks
+        while n > block_size:
+            starts = np.arange(0, len(prev_sum), factor)
+            counts = np.minimum(block_size, n - np.arange(len(starts)) * block_size)
+            level = np.empty((3, len(starts)))
+            level[0] = np.minimum.reduceat(prev_min, starts)
+            level[1] = np.maximum.reduceat(prev_max, starts)
+            block_sums = np.add.reduceat(prev_sum, starts)
+            level[2] = block_sums / counts
+            levels.append(level)
+            prev_min, prev_max, prev_sum = level[0], level[1], block_sums
+            block_size *= factor
+
+        return cls(data, levels, factor)
+
+    def query(self, start, end, n_bins):
+        """
+        Returns the sample indices and values of a min/max envelope of the samples start:end with about 2*n_bins points.
+        """
+        n_samples = end - start
+
+        # pick the coarsest level whose blocks are still shorter than one bin
+        level = int(np.floor(np.log(max(n_samples / n_bins, 1)) / np.log(self.factor)))
+        level = min(level, len(self.levels))
+
+        # for short windows decimate the full resolution data directly
+        if level == 0:
+            return minmax_decimate(np.arange(start, end), self.data[start:end], n_bins)
+
+        # get the blocks that cover the window
+        block_size = self.factor**level
+        first_block = start // block_size
+        last_block = -(-end // block_size)
+        mins = self.levels[level-1][0, first_block:last_block]
+        maxs = self.levels[level-1][1, first_block:last_block]
+
+        # merge the blocks into n_bins groups
+        group_starts = np.unique(np.linspace(0, len(mins), n_bins, endpoint=False).astype(int))
+        group_mins = np.minimum.reduceat(mins, group_starts)
+        group_maxs = np.maximum.reduceat(maxs, group_starts)
+
+        # place the min and max of every group at the sample in the center of the group
+        group_ends = np.append(group_starts[1:], len(mins))
+        centers = (first_block + (group_starts + group_ends) / 2) * block_size
+        centers = np.clip(centers.astype(int), start, end - 1)
+
+        return np.repeat(centers, 2), np.stack([group_mins, group_maxs], axis=1).ravel()
+
+    def query_mean(self, start, end, n_bins):
+        """
+        Returns the sample indices and mean values of about n_bins equal-length bins of the samples start:end.
+        """
+        n_samples = end - start
+
+        # pick the coarsest level whose blocks are still shorter than one bin (level 0 is the data itself)
+        level = int(np.floor(np.log(max(n_samples / n_bins, 1)) / np.log(self.factor)))
+        level = min(level, len(self.levels))
+        block_size = self.factor**level
+        first_block = start // block_size
+        last_block = -(-end // block_size)
+        if level == 0:
+            means, counts = np.asarray(self.data[start:end]), np.ones(n_samples)
+        else:
+            means = self.levels[level-1][2, first_block:last_block]
+            counts = np.full(len(means), float(block_size))
+            counts[-1] = min(len(self.data), last_block*block_size) - (last_block - 1)*block_size
+
+        # merge the blocks into n_bins groups, weighting each block by its number of samples
+        group_starts = np.unique(np.linspace(0, len(means), n_bins, endpoint=False).astype(int))
+        group_means = np.add.reduceat(means * counts, group_starts) / np.add.reduceat(counts, group_starts)
+
+        # place every mean at the sample in the center of its group
+        group_ends = np.append(group_starts[1:], len(means))
+        centers = (first_block + (group_starts + group_ends) / 2) * block_size
+        centers = np.clip(centers.astype(int), start, end - 1)
+
+        return centers, group_means
+
+def load_channel_pyramid(folder_dir, channel, factor=PYRAMID_FACTOR):
+    """
+    Returns the pyramid of a channel of a data log folder, with the levels memory mapped from the channel cache.
+
+    The pyramid is built (and stored as <channel>.pyramid-<level>.npy beside the cached channel) the first time it is
+    requested, and rebuilt whenever the channel CSV changes.
+    """
+    # get the full resolution data through the channel cache
+    data = load_cached_channel(folder_dir, channel)
+
+    # use the stored levels if the manifest entry still matches the channel CSV
+    cache_dir = os.path.join(folder_dir, CHANNEL_CACHE_DIRNAME)
+    source_info = dict(get_channel_source_info(folder_dir, channel), factor=factor)
+    entry = get_channel_cache_manifest(folder_dir).get(channel + '.pyramid')
+    if entry is not None and all(entry.get(key) == value for key, value in source_info.items()):
+        level_paths = [os.path.join(cache_dir, f'{channel}.pyramid-{level}.npy') for level in range(1, entry['num_levels'] + 1)]
+        if all(os.path.isfile(path) for path in level_paths):
+            return ChannelPyramid(data, [np.load(path, mmap_mode='r') for path in level_paths], factor)
+
+    # otherwise build the pyramid and store every level
+    pyramid = ChannelPyramid.build(data, factor)
+    for level, level_data in enumerate(pyramid.levels, start=1):
+        level_path = os.path.join(cache_dir, f'{channel}.pyramid-{level}.npy')
+        tmp_path = level_path + f'.{os.getpid()}-{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.save(f, level_data)
+        os.replace(tmp_path, level_path)
+    update_channel_cache_manifest(folder_dir, channel + '.pyramid', dict(source_info, num_levels=len(pyramid.levels)))
+
+    return pyramid
+
+# channels that are stored as tab separated 2D images instead of single-column time series
+IMAGE_CHANNELS = ('topo-image', 'error-image')
+
+# images are loaded as float32, which is plenty for display and halves the memory and cache size
+IMAGE_DTYPE = np.float32
+
+def get_channel_dtype(channel):
+    # dtype a channel is parsed and cached as
+    return IMAGE_DTYPE if channel in IMAGE_CHANNELS else np.float64
+
+# default number of workers used to load the channels of a data log folder concurrently
+CHANNEL_LOAD_WORKERS = 8
+
+def read_image_csv(csv_path, dtype=IMAGE_DTYPE):
+    """
+    Reads a tab separated image CSV (e.g. topo-image.csv) and returns it in display orientation (as plotted by
+    plotAFMImageLog) as a C contiguous 2D array.
+    """
+    # a single character separator keeps pandas on its C parser (a regex separator falls back to the Python engine)
+    df = pd.read_csv(csv_path, sep='\t', header=None, dtype=dtype, engine='c')
+
+    # the file stores the image transposed, so copy it once into display order
+    return np.ascontiguousarray(df.to_numpy().T)
+
+def load_cached_image(folder_dir, channel, dtype=IMAGE_DTYPE):
+    """
+    Returns an image channel (e.g. 'topo-image') of a data log folder as a read-only memory map, converting the CSV into
+    a .npy file of the channel cache on first use (and again whenever the CSV changes), as load_cached_channel does.
+    """
+    # use the cached image if the manifest entry still matches the source file
+    if is_channel_cache_valid(folder_dir, channel, dtype):
+        return np.load(os.path.join(folder_dir, CHANNEL_CACHE_DIRNAME, channel + '.npy'), mmap_mode='r')
+
+    # otherwise parse the CSV and write the image to the cache
+    source_info = get_channel_source_info(folder_dir, channel, dtype)
+    data = read_image_csv(os.path.join(folder_dir, channel + '.csv'), dtype=dtype)
+
+    return write_channel_cache(folder_dir, channel, data, source_info)
+
+def load_image_csvs(csv_paths, use_cache=True, dtype=IMAGE_DTYPE):
+    """
+    Loads several image CSVs (e.g. the topography and error images of an experiment) at the same time in a thread
+    pool, through the channel cache of their folders unless use_cache is False. Returns the images in the same order.
+    """
+    def load(csv_path):
+        folder_dir, file_name = os.path.split(csv_path)
+        channel = os.path.splitext(file_name)[0]
+        return load_cached_image(folder_dir, channel, dtype) if use_cache else read_image_csv(csv_path, dtype)
+
+    with ThreadPoolExecutor(max_workers=max(len(csv_paths), 1)) as executor:
+        return list(executor.map(load, csv_paths))
+
+# size (pixels) of the square tiles the levels of an image pyramid are read and cached in
+IMAGE_TILE_SIZE = 256
+
+class ImagePyramid:
+    """
+    Multi-resolution tiled version of an image, used to display only the part of a large image that is visible, at
+    about the resolution of the screen.
+
+    Level 0 is the full resolution image itself (usually a memory map, which is also where pixel values are looked up).
+    Level k (k = 1, 2, ...) is the image downsampled by 2**k, each pixel the mean of a 2**k x 2**k block (ignoring NaN
+    pixels). Levels are read in square tiles of tile_size pixels, and the most recently used tiles are kept in memory.
+    """
+    def __init__(self, data, levels, tile_size=IMAGE_TILE_SIZE, vmin=None, vmax=None, max_tiles=256):
+        self.data = data
+        self.levels = levels
+        self.tile_size = tile_size
+        self.vmin = float(np.nanmin(data)) if vmin is None else vmin
+        self.vmax = float(np.nanmax(data)) if vmax is None else vmax
+        self.max_tiles = max_tiles
+        self._tiles = OrderedDict()
+
+    @property
+    def shape(self):
+        return self.data.shape
+
+    @property
+    def num_levels(self):
+        return len(self.levels) + 1
+
+    @classmethod
+    def build(cls, data, tile_size=IMAGE_TILE_SIZE):
+        """
+        Builds the levels of an image, halving the previous level until it fits in a single tile.
+        """
+        levels = []
+        data = np.asarray(data)
+
+        # sums and counts of the valid pixels of the blocks, so that every level is the exact mean of its blocks
+        valid = ~np.isnan(data)
+        sums = np.where(valid, data, 0).astype(np.float64)
+        counts = valid.astype(np.int64)
+
+        while max(sums.shape) > tile_size:
+            # pad odd sizes with empty blocks and merge the 2x2 blocks of the previous level
+            padding = ((0, sums.shape[0] % 2), (0, sums.shape[1] % 2))
+            sums, counts = np.pad(sums, padding), np.pad(counts, padding)
+            sums = sums.reshape(sums.shape[0] // 2, 2, sums.shape[1] // 2, 2).sum(axis=(1, 3))
+            counts = counts.reshape(counts.shape[0] // 2, 2, counts.shape[1] // 2, 2).sum(axis=(1, 3))
+            with np.errstate(invalid='ignore'):
+                levels.append((sums / counts).astype(np.float32))
+
+        return cls(data, levels, tile_size)
+
+    def get_level(self, level):
+        return self.data if level == 0 else self.levels[level - 1]
+
+    def get_tile(self, level, tile_y, tile_x):
+        """
+        Returns a tile of a level (the tiles at the bottom and right edges are smaller), reading it on first access.
+        """
+        key = (level, tile_y, tile_x)
+        if key in self._tiles:
+            self._tiles.move_to_end(key)
+            return self._tiles[key]
+
+        # copy the tile out of the (memory mapped) level and add it to the LRU
+        size = self.tile_size
+        tile = np.array(self.get_level(level)[tile_y*size:(tile_y + 1)*size, tile_x*size:(tile_x + 1)*size])
+        self._tiles[key] = tile
+        while len(self._tiles) > self.max_tiles:
+            self._tiles.popitem(last=False)
+
+        return tile
+
+    def get_view_level(self, data_per_pixel):
+        """
+        Returns the coarsest level whose pixels are still no larger than data_per_pixel full resolution pixels.
+        """
+        level = int(np.floor(np.log2(max(data_per_pixel, 1))))
+
+        return min(level, self.num_levels - 1)
+
+    def get_region(self, level, x_range, y_range):
+        """
+        Returns the tiles of a level that cover the full resolution pixel ranges x_range and y_range (min, max) as one
+        array, with the extent (left, right, bottom, top) to display it at in full resolution pixel coordinates.
+        """
+        scale = 2**level
+        size = self.tile_size
+        level_shape = self.get_level(level).shape
+
+        # tiles that overlap the visible window (in pixels of the level)
+        tiles_y = np.clip([int(np.floor(min(y_range) / scale / size)), int(np.floor(max(y_range) / scale / size))], 0, (level_shape[0] - 1) // size)
+        tiles_x = np.clip([int(np.floor(min(x_range) / scale / size)), int(np.floor(max(x_range) / scale / size))], 0, (level_shape[1] - 1) // size)
+
+        # stitch the tiles together
+        rows = [np.concatenate([self.get_tile(level, tile_y, tile_x) for tile_x in range(tiles_x[0], tiles_x[1] + 1)], axis=1)
+                for tile_y in range(tiles_y[0], tiles_y[1] + 1)]
+        region = np.concatenate(rows, axis=0)
+
+        # pixel i of the level covers the full resolution pixels i*scale to (i + 1)*scale - 1 (centers at integers)
+        left = tiles_x[0]*size*scale - 0.5
+        top = tiles_y[0]*size*scale - 0.5
+
+        return region, (left, left + region.shape[1]*scale, top + region.shape[0]*scale, top)
+
+    def value(self, x, y):
+        """
+        Returns the full resolution value of the pixel at column x and row y.
+        """
+        return self.data[y, x]
+
+def load_image_pyramid(folder_dir, channel, tile_size=IMAGE_TILE_SIZE):
+    """
+    Returns the pyramid of an image channel of a data log folder, with the full resolution image and the levels memory
+    mapped from the channel cache.
+
+    The levels are built (and stored as <channel>.tiles-<level>.npy beside the cached image) the first time they are
+    requested, and rebuilt whenever the image CSV changes.
+    """
+    # get the full resolution image through the channel cache
+    data = load_cached_image(folder_dir, channel)
+
+    # use the stored levels if the manifest entry still matches the image CSV
+    cache_dir = os.path.join(folder_dir, CHANNEL_CACHE_DIRNAME)
+    source_info = dict(get_channel_source_info(folder_dir, channel, IMAGE_DTYPE), tile_size=tile_size)
+    entry = get_channel_cache_manifest(folder_dir).get(channel + '.tiles')
+    if entry is not None and all(entry.get(key) == value for key, value in source_info.items()):
+        level_paths = [os.path.join(cache_dir, f'{channel}.tiles-{level}.npy') for level in range(1, entry['num_levels'])]
+        if all(os.path.isfile(path) for path in level_paths):
+            return ImagePyramid(data, [np.load(path, mmap_mode='r') for path in level_paths], tile_size, entry['vmin'], entry['vmax'])
+
+    # otherwise build the pyramid and store every level
+    pyramid = ImagePyramid.build(data, tile_size)
+    for level, level_data in enumerate(pyramid.levels, start=1):
+        level_path = os.path.join(cache_dir, f'{channel}.tiles-{level}.npy')
+        tmp_path = level_path + f'.{os.getpid()}-{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.save(f, level_data)
+        os.replace(tmp_path, level_path)
+    update_channel_cache_manifest(folder_dir, channel + '.tiles', dict(source_info, num_levels=pyramid.num_levels, vmin=pyramid.vmin, vmax=pyramid.vmax))
+
+    return pyramid
+
+def load_image_pyramids(csv_paths, tile_size=IMAGE_TILE_SIZE):
+    """
+    Loads the pyramids of several image CSVs (e.g. the topography and error images of an experiment) at the same time
+    in a thread pool. Returns the pyramids in the same order.
+    """
+    def load(csv_path):
+        folder_dir, file_name = os.path.split(csv_path)
+        return load_image_pyramid(folder_dir, os.path.splitext(file_name)[0], tile_size)
+
+    with ThreadPoolExecutor(max_workers=max(len(csv_paths), 1)) as executor:
+        return list(executor.map(load, csv_paths))
+
+class TiledImageView:
+    """
+    Displays an ImagePyramid on an axes in full resolution pixel coordinates (like imshow of the full image), but only
+    draws the tiles of the visible window, at the level that matches the screen resolution. The displayed region is
+    updated whenever the axes limits or the figure size change (e.g. when zooming or panning), before the canvas
+    redraws.
+    """
+    def __init__(self, ax, pyramid, **imshow_kwargs):
+        self.ax = ax
+        self.pyramid = pyramid
+        self.displayed = None
+
+        # a single image artist whose data and extent are swapped for the visible region
+        imshow_kwargs.setdefault('clim', (pyramid.vmin, pyramid.vmax))
+        self.image = ax.imshow(np.full((1, 1), np.nan, dtype=np.float32), **imshow_kwargs)
+
+        # show the whole image, and keep the limits fixed when the extent of the displayed region changes
+        height, width = pyramid.shape
+        ax.set_xlim(-0.5, width - 0.5)
+        ax.set_ylim(height - 0.5, -0.5)
+        ax.set_autoscale_on(False)
+
+        # update the displayed region when the view changes
+        ax.callbacks.connect('xlim_changed', self.update)
+        ax.callbacks.connect('ylim_changed', self.update)
+        ax.figure.canvas.mpl_connect('resize_event', self.update)
+        self.update()
+
+    def update(self, *args):
+        """
+        Displays the tiles of the visible window at the level that matches the screen resolution.
+        """
+        x_range = self.ax.get_xlim()
+        y_range = self.ax.get_ylim()
+
+        # full resolution pixels per screen pixel (along the axis that needs the finer level)
+        window = self.ax.get_window_extent()
+        data_per_pixel = min(abs(x_range[1] - x_range[0]) / max(window.width, 1), abs(y_range[1] - y_range[0]) / max(window.height, 1))
+        level = self.pyramid.get_view_level(data_per_pixel)
+
+        # only swap the image data if the displayed tiles change
+        region, extent = self.pyramid.get_region(level, x_range, y_range)
+        if self.displayed != (level, extent):
+            self.displayed = (level, extent)
+            self.image.set_data(region)
+            self.image.set_extent(extent)
+
+def read_folder_channel(folder_dir, channel):
+    """
+    Parses a channel CSV of a data log folder (without going through the channel cache).
+    """
+    csv_path = os.path.join(folder_dir, channel + '.csv')
+
+    # images are tab separated and are returned in display orientation (as plotted by plotAFMImageLog)
+    if channel in IMAGE_CHANNELS:
+        return read_image_csv(csv_path)
+
+    return read_channel_csv(csv_path)
+
+def _read_folder_channel_timed(folder_dir, channel):
+    # worker function for ExperimentFolder.preload (module level so that it can be sent to a process pool)
+    start = time.perf_counter()
+    data = read_folder_channel(folder_dir, channel)
+
+    return channel, data, time.perf_counter() - start
+
+class ExperimentFolder:
+    """
+    Lazy loader for a data log folder of the following format:
+
+        data-log-[13-34-28]
+
+    The channels present in the folder are discovered from its CSV files (x-command, obd-sum, pressure,
+    rt-time-samples, time-samples, topo-image, ...). A channel is only loaded the first time it is accessed, either as
+    an attribute with underscores instead of dashes (folder.obd_sum) or by name (folder['obd-sum']), and the most
+    recently used channels are kept in memory so that repeated access is free.
+    """
+    def __init__(self, folder_dir, max_loaded=16, use_cache=True):
+        self.folder_dir = folder_dir
+        self.max_loaded = max_loaded
+        self.use_cache = use_cache
+        self._loaded = OrderedDict()
+
+        # discover the channels present in the folder (the experiment info file is the header, not a channel)
+        self.channels = sorted(os.path.splitext(name)[0] for name in os.listdir(folder_dir)
+                               if name.endswith('.csv') and name != 'experiment-info.csv')
+
+        # the experiment header and the channel pyramids are also read lazily
+        self._header = None
+        self._pyramids = {}
+
+    def __contains__(self, channel):
+        return channel in self.channels
+
+    def __getitem__(self, channel):
+        return self.get(channel)
+
+    def __getattr__(self, name):
+        # only called for attributes that don't exist, so map them onto channel names
+        channel = name.replace('_', '-')
+        if name.startswith('_') or channel not in self.__dict__.get('channels', ()):
+            raise AttributeError(f"'{type(self).__name__}' object has no attribute or channel '{name}'")
+
+        return self.get(channel)
+
+    def get(self, channel):
+        """
+        Returns the data of a channel, loading it on first access.
+        """
+        # serve already loaded channels from the LRU and mark them as most recently used
+        if channel in self._loaded:
+            self._loaded.move_to_end(channel)
+            return self._loaded[channel]
+
+        if channel not in self.channels:
+            raise KeyError(f'Channel {channel} does not exist in {self.folder_dir}!')
+
+        # load the channel and add it to the LRU
+        data = self.load_channel(channel)
+        self._store(channel, data)
+
+        return data
+
+    def _store(self, channel, data):
+        # add a loaded channel to the LRU and evict the least recently used channels if the LRU is full
+        self._loaded[channel] = data
+        self._loaded.move_to_end(channel)
+        while len(self._loaded) > self.max_loaded:
+            self._loaded.popitem(last=False)
+
+    def load_channel(self, channel):
+        """
+        Loads a channel from disk, bypassing the LRU.
+        """
+        if self.use_cache:
+            return load_cached_image(self.folder_dir, channel) if channel in IMAGE_CHANNELS else load_cached_channel(self.folder_dir, channel)
+
+        return read_folder_channel(self.folder_dir, channel)
+
+    def preload(self, channels=None, max_workers=CHANNEL_LOAD_WORKERS, use_processes=False, verbose=False):
+        """
+        Loads several channels (all channels by default) concurrently and adds them to the LRU.
+
+        Channels that are up to date in the channel cache are memory mapped directly, the remaining CSVs are parsed at
+        the same time in a thread pool (or a process pool if use_processes is True) and then written to the cache.
+        Missing and already loaded channels are skipped. Returns a dict with the load time (s) of each channel.
+        """
+        # only load channels that are present and not loaded yet
+        channels = self.channels if channels is None else channels
+        channels = [channel for channel in channels if channel in self.channels and channel not in self._loaded]
+
+        # memory map the channels that are already cached, and collect the ones that have to be parsed
+        timings = {}
+        pending = []
+        for channel in channels:
+            if self.use_cache and is_channel_cache_valid(self.folder_dir, channel, get_channel_dtype(channel)):
+                start = time.perf_counter()
+                self._store(channel, self.load_channel(channel))
+                timings[channel] = time.perf_counter() - start
+            else:
+                pending.append(channel)
+
+        # parse the remaining channels concurrently
+        if len(pending) > 0:
+            executor_class = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+            source_infos = {channel: get_channel_source_info(self.folder_dir, channel, get_channel_dtype(channel)) for channel in pending}
+            with executor_class(max_workers=min(max_workers, len(pending))) as executor:
+                futures = [executor.submit(_read_folder_channel_timed, self.folder_dir, channel) for channel in pending]
+                for future in as_completed(futures):
+                    channel, data, seconds = future.result()
+                    if self.use_cache:
+                        data = write_channel_cache(self.folder_dir, channel, data, source_infos[channel])
+                    self._store(channel, data)
+                    timings[channel] = seconds
+
+        # report the per-channel load times
+        if verbose:
+            print('Loaded channels: ' + ', '.join(f'{channel} ({seconds*1000:.1f} ms)' for channel, seconds in timings.items()))
+
+        return timings
+
+    def pyramid(self, channel):
+        """
+        Returns the multi-resolution pyramid of a channel (stored beside the channel cache), loading it on first access.
+        """
+        if channel not in self._pyramids:
+            if self.use_cache:
+                self._pyramids[channel] = load_channel_pyramid(self.folder_dir, channel)
+            else:
+                self._pyramids[channel] = ChannelPyramid.build(self.get(channel))
+
+        return self._pyramids[channel]
+
+    @property
+    def header(self):
+        """
+        The experiment header (first 3 rows of experiment-info.csv).
+        """
+        if self._header is None:
+            self._header = get_log_header_info(pd.read_csv(os.path.join(self.folder_dir, 'experiment-info.csv'), header=None))
+
+        return self._header
+
+    @property
+    def title_string(self):
+        return get_experiment_info_string(self.header)
+
+    @property
+    def loop_rate(self):
+        """
+        The FIFO record sampling rate (Hz) from metadata.txt, or None if the folder has no metadata file.
+        """
+        metadata_path = os.path.join(self.folder_dir, 'metadata.txt')
+
+        return get_loop_delay(metadata_path) if os.path.exists(metadata_path) else None
+
+def _fast_nanmedian(values, axis=None, keepdims=False):
+    # np.nanmedian is several times slower than np.median, so it is only used when there are NaNs
+    if np.isnan(values).any():
+        return np.nanmedian(values, axis=axis, keepdims=keepdims)
+
+    return np.median(values, axis=axis, keepdims=keepdims)
+
+def subtract_plane(image):
+    """
+    Subtracts the least squares plane a + b*x + c*y from an image (NaN pixels are ignored in the fit).
+    """
+    image = np.asarray(image)
+    valid = ~np.isnan(image)
+    values = np.where(valid, image, 0.0)
+
+    # centered pixel coordinates, so that the normal equations only need a handful of sums
+    y = np.arange(image.shape[0]) - (image.shape[0] - 1) / 2
+    x = np.arange(image.shape[1]) - (image.shape[1] - 1) / 2
+
+    # sums of the normal equations from row and column sums instead of full coordinate grids
+    row_counts, col_counts = valid.sum(axis=1), valid.sum(axis=0)
+    row_sums, col_sums = values.sum(axis=1), values.sum(axis=0)
+    normal = np.array([
+        [valid.sum(), col_counts @ x, row_counts @ y],
+        [col_counts @ x, col_counts @ x**2, y @ valid @ x],
+        [row_counts @ y, y @ valid @ x, row_counts @ y**2],
+    ])
+    rhs = np.array([row_sums.sum(), col_sums @ x, row_sums @ y])
+    a, b, c = np.linalg.lstsq(normal, rhs, rcond=None)[0]
+
+    return image - (a + b*x[np.newaxis, :] + c*y[:, np.newaxis])
+
+def level_lines(image, order=1):
+    """
+    Subtracts a polynomial of the given order from every scan line (row) of an image, fitted to each line separately
+    (NaN pixels are ignored). All lines are fitted at once from batched normal equations.
+    """
+    image = np.asarray(image)
+    valid = ~np.isnan(image)
+    values = np.where(valid, image, 0.0)
+
+    # Vandermonde matrix of the (scaled) pixel positions along the lines
+    x = np.linspace(-1, 1, image.shape[1])
+    vandermonde = np.vander(x, order + 1, increasing=True)
+
+    # normal equations of every line: (V^T W V) p = V^T W z, with the valid pixels as weights W
+    products = vandermonde[:, :, np.newaxis] * vandermonde[:, np.newaxis, :]
+    normal = np.tensordot(valid.astype(np.float64), products, axes=(1, 0))
+    rhs = values @ vandermonde
+
+    # a tiny ridge keeps the lines with fewer valid pixels than coefficients solvable (empty lines are left as they are)
+    normal += np.eye(order + 1) * 1e-12
+    coefficients = np.linalg.solve(normal, rhs[:, :, np.newaxis])[:, :, 0]
+
+    return image - coefficients @ vandermonde.T
+
+def median_line_correction(image):
+    """
+    Aligns the scan lines (rows) of an image by subtracting the median of every line, which removes the line to line
+    offsets without being pulled by features as a mean or a fit would be.
+    """
+    image = np.asarray(image)
+
+    return image - _fast_nanmedian(image, axis=1, keepdims=True)
+
+def remove_scars(image, threshold=3.0, min_length=16):
+    """
+    Removes scars: runs of at least min_length pixels along a scan line that jump by more than threshold times the
+    (robust) line to line noise above or below both the line before and the line after. The scarred pixels are replaced
+    by the mean of the pixels above and below them.
+    """
+    image = np.array(image, dtype=np.float64)
+    if image.shape[0] < 3:
+        return image
+
+    # differences of every inner line to the lines before and after
+    before = image[1:-1] - image[:-2]
+    after = image[1:-1] - image[2:]
+
+    # robust estimate of the line to line noise (median absolute deviation of the differences, from at most about
+    # 2^18 evenly spread differences, which is plenty for a median)
+    differences = np.diff(image, axis=0).ravel()
+    differences = differences[::max(1, len(differences) >> 18)]
+    noise = 1.4826 * _fast_nanmedian(np.abs(differences - _fast_nanmedian(differences)))
+    limit = threshold * noise
+
+    # a pixel is scarred if it sticks out in the same direction from both neighbouring lines
+    scarred = ((before > limit) & (after > limit)) | ((before < -limit) & (after < -limit))
+
+    # only keep runs of at least min_length scarred pixels (of the lines that have any): find the windows of min_length
+    # pixels that are fully scarred (from a cumulative count along the lines), then mark the pixels these windows cover
+    if min_length > 1:
+        lines = np.flatnonzero(scarred.any(axis=1))
+        width = scarred.shape[1]
+        runs = np.zeros((len(lines), width), dtype=bool)
+        if width >= min_length and len(lines) > 0:
+            counts = np.cumsum(np.pad(scarred[lines], ((0, 0), (1, 0))), axis=1)
+            full_windows = (counts[:, min_length:] - counts[:, :-min_length]) == min_length
+            window_counts = np.cumsum(np.pad(full_windows, ((0, 0), (1, 0))), axis=1)
+            pixels = np.arange(width)
+            first_start = np.maximum(pixels - min_length + 1, 0)
+            last_start = np.maximum(np.minimum(pixels, width - min_length) + 1, first_start)
+            runs = (window_counts[:, last_start] - window_counts[:, first_start]) > 0
+        scarred[lines] = runs
+
+    # replace the scarred pixels by the mean of their neighbours
+    inner = image[1:-1]
+    inner[scarred] = ((image[:-2] + image[2:]) / 2)[scarred]
+
+    return image
+
+# corrections that can be chained by name, each with the name and type of its main parameter (see parse_image_corrections)
+IMAGE_CORRECTIONS = {
+    'plane': (subtract_plane, None, None),
+    'line': (level_lines, 'order', int),
+    'median': (median_line_correction, None, None),
+    'scars': (remove_scars, 'threshold', float),
+}
+
+def parse_image_corrections(spec):
+    """
+    Parses a comma separated chain of corrections such as 'plane,line:2,median,scars:4' into a list of
+    (function, kwargs), where the number after the colon sets the main parameter of the correction (the polynomial
+    order of 'line' and the threshold of 'scars').
+    """
+    corrections = []
+    for item in filter(None, (item.strip() for item in spec.split(','))):
+        name, _, value = item.partition(':')
+        if name not in IMAGE_CORRECTIONS:
+            raise ValueError(f'Unknown image correction {name}! Options are {", ".join(IMAGE_CORRECTIONS)}.')
+        function, parameter, parameter_type = IMAGE_CORRECTIONS[name]
+        if value and parameter is None:
+            raise ValueError(f'Image correction {name} does not take a parameter!')
+        corrections.append((function, {parameter: parameter_type(value)} if value else {}))
+
+    return corrections
+
+def correct_image(image, corrections):
+    """
+    Applies a chain of corrections (a spec string for parse_image_corrections, or a list of (function, kwargs)) to an
+    image and returns the corrected float64 image.
+    """
+    if isinstance(corrections, str):
+        corrections = parse_image_corrections(corrections)
+
+    image = np.asarray(image, dtype=np.float64)
+    for function, kwargs in corrections:
+        image = function(image, **kwargs)
+
+    return image
+
+def get_scan_geometry(df_header):
+    """
+    Returns the scan size and offset (um) of an experiment from its header, as shown by get_experiment_info_string
+    (the header stores them in nm), as a dict with size_x, size_y, offset_x and offset_y.
+    """
+    sizes = df_header.iloc[:,3].apply(pd.to_numeric).tolist()
+    offsets = df_header.iloc[:,5].apply(pd.to_numeric).tolist()
+
+    return {'size_x': sizes[1]/1000, 'size_y': sizes[2]/1000, 'offset_x': offsets[1]/1000, 'offset_y': offsets[2]/1000}
+
+def iter_channel_chunks(folder_dir, channels, chunk_size=1000000, dtype=np.float64):
+    """
+    Yields (start sample index, list of 1D arrays) chunks of several channels of a data log folder in lockstep (until
+    the shortest channel ends), memory mapped from the channel cache when it is up to date and otherwise parsed from
+    the CSVs one chunk at a time, so that channels larger than RAM can be processed in constant memory.
+    """
+    if all(is_channel_cache_valid(folder_dir, channel, dtype) for channel in channels):
+        data = [load_cached_channel(folder_dir, channel, dtype) for channel in channels]
+        num_samples = min(len(channel_data) for channel_data in data)
+        for start in range(0, num_samples, chunk_size):
+            yield start, [np.asarray(channel_data[start:start + chunk_size]) for channel_data in data]
+        return
+
+    # parse the CSVs one chunk at a time
+    readers = [pd.read_csv(os.path.join(folder_dir, channel + '.csv'), header=None, usecols=[0], delimiter=',', dtype=dtype, engine='c', chunksize=chunk_size)
+               for channel in channels]
+    start = 0
+    for chunks in zip(*readers):
+        length = min(len(chunk) for chunk in chunks)
+        yield start, [chunk.iloc[:length, 0].to_numpy() for chunk in chunks]
+        start += length
+
+class ScanGridder:
+    """
+    Bins streamed (x, y, z) samples of a scan into regular trace and retrace images, for folders that only have the
+    time series of the commands and no image logs.
+
+    The images cover x_range and y_range (um, as (min, max)) with shape (rows, columns) pixels in display orientation
+    (the first row at the largest y, as plotted by plotAFMImageLog). Samples where x is increasing go to the trace
+    image and samples where x is decreasing to the retrace image (samples where x doesn't change keep the direction of
+    the previous sample). Chunks are passed to update() in order, and every pixel is the mean of the samples in it
+    (NaN where there are none).
+    """
+    def __init__(self, x_range, y_range, shape=(256, 256)):
+        self.x_range = x_range
+        self.y_range = y_range
+        self.shape = shape
+
+        # sum and number of the samples of every pixel of the trace (0) and retrace (1) images
+        self.sums = np.zeros(2 * shape[0] * shape[1])
+        self.counts = np.zeros(2 * shape[0] * shape[1], dtype=np.int64)
+
+        # last x sample and scan direction, carried over chunk boundaries
+        self.last_x = np.nan
+        self.last_direction = 0
+
+    @classmethod
+    def from_header(cls, df_header, shape=(256, 256)):
+        """
+        Returns a gridder that covers the scan area given by the size and offset of the header.
+        """
+        geometry = get_scan_geometry(df_header)
+        x_range = (geometry['offset_x'] - geometry['size_x']/2, geometry['offset_x'] + geometry['size_x']/2)
+        y_range = (geometry['offset_y'] - geometry['size_y']/2, geometry['offset_y'] + geometry['size_y']/2)
+
+        return cls(x_range, y_range, shape)
+
+    def get_directions(self, x):
+        """
+        Returns the scan direction (0 for trace, 1 for retrace) of every sample of a chunk of x.
+        """
+        # sign of the step into every sample (0 where x doesn't change)
+        steps = np.diff(np.concatenate([[self.last_x], x]))
+        directions = np.where(steps > 0, 0, np.where(steps < 0, 1, -1))
+
+        # samples where x doesn't change take the direction of the last sample that moved (forward fill)
+        moved = np.where(directions >= 0, np.arange(len(x)), -1)
+        last_moved = np.maximum.accumulate(moved)
+        directions = np.where(last_moved >= 0, directions[np.maximum(last_moved, 0)], self.last_direction)
+
+        self.last_x = x[-1]
+        self.last_direction = directions[-1]
+
+        return directions
+
+    def update(self, x, y, z):
+        """
+        Adds a chunk of samples to the images.
+        """
+        x, y, z = np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64), np.asarray(z, dtype=np.float64)
+        if len(x) == 0:
+            return
+        directions = self.get_directions(x)
+
+        # position of every sample within the scan area (0 to 1), dropping the samples outside of it
+        rows, columns = self.shape
+        fraction_x = (x - self.x_range[0]) / (self.x_range[1] - self.x_range[0])
+        fraction_y = (self.y_range[1] - y) / (self.y_range[1] - self.y_range[0])
+        inside = (fraction_x >= 0) & (fraction_x <= 1) & (fraction_y >= 0) & (fraction_y <= 1) & ~np.isnan(z)
+
+        # pixel of every sample (the far edges of the scan area belong to the last pixels)
+        column = np.minimum(np.floor(np.where(inside, fraction_x, 0) * columns).astype(np.int64), columns - 1)
+        row = np.minimum(np.floor(np.where(inside, fraction_y, 0) * rows).astype(np.int64), rows - 1)
+
+        # accumulate the samples of every pixel of both images at once
+        pixels = (directions * rows + row) * columns + column
+        self.sums += np.bincount(pixels[inside], weights=z[inside], minlength=len(self.sums))
+        self.counts += np.bincount(pixels[inside], minlength=len(self.counts))
+
+    def images(self):
+        """
+        Returns the trace and retrace images (mean of the samples of every pixel, NaN where there are none).
+        """
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = (self.sums / self.counts).reshape(2, *self.shape)
+
+        return means[0], means[1]
+
+def grid_scan_channels(folder_dir, shape=(256, 256), z_channel='z-command', chunk_size=1000000):
+    """
+    Reconstructs the trace and retrace images of z_channel of a data log folder from its x-command and y-command
+    channels, streaming the channels in chunks of chunk_size samples. The scan area is read from experiment-info.csv.
+    Returns the trace image, the retrace image and the ScanGridder (with the sample counts).
+    """
+    df_header = get_log_header_info(pd.read_csv(os.path.join(folder_dir, 'experiment-info.csv'), header=None))
+    gridder = ScanGridder.from_header(df_header, shape)
+
+    for _, (x, y, z) in iter_channel_chunks(folder_dir, ['x-command', 'y-command', z_channel], chunk_size):
+        gridder.update(x, y, z)
+
+    trace, retrace = gridder.images()
+
+    return trace, retrace, gridder
+
+def minmax_decimate(x, y, n_bins):
+    """
+    Reduces a trace to at most 2*n_bins points by keeping the min and max sample of each of n_bins equal-length
+    index bins (in their original order), so that peaks survive the decimation.
+    """
+    # short traces are returned as they are
+    n = len(y)
+    if n <= 2*n_bins:
+        return np.asarray(x), np.asarray(y)
+
+    # reshape the trace into bins (the last bin absorbs the leftover samples)
+    bin_size = n // n_bins
+    y_bins = np.asarray(y[:bin_size*n_bins]).reshape(n_bins, bin_size)
+
+    # find the min and max of every bin and keep them in time order
+    offsets = np.arange(n_bins) * bin_size
+    idx = np.stack([np.argmin(y_bins, axis=1) + offsets, np.argmax(y_bins, axis=1) + offsets], axis=1)
+    idx = np.sort(idx, axis=1).ravel()
+
+    # add the min and max of the leftover samples
+    if bin_size*n_bins < n:
+        tail = np.asarray(y[bin_size*n_bins:])
+        idx = np.concatenate([idx, np.unique([np.argmin(tail), np.argmax(tail)]) + bin_size*n_bins])
+
+    return np.asarray(x[idx]), np.asarray(y[idx])
+
+def decimate_window(x, y, xlims, n_bins):
+    """
+    Min/max decimates the part of a trace (with sorted x) that is visible between xlims, including one sample on
+    each side so that the line runs to the edges of the axis.
+    """
+    # find the visible index range with a binary search instead of a full-length mask
+    start = max(np.searchsorted(x, xlims[0], side='left') - 1, 0)
+    end = min(np.searchsorted(x, xlims[1], side='right') + 1, len(x))
+
+    return minmax_decimate(x[start:end], y[start:end], n_bins)
+
+def plot_decimated(ax, x, y, *args, points_per_pixel=2, pyramid=None, **kwargs):
+    """
+    Plots a (possibly multi-million sample) trace on ax with ax.plot, drawing only about points_per_pixel points per
+    horizontal pixel of the axis. The line is re-decimated from the full resolution arrays every time the x-axis
+    limits change, so zooming in still shows the true detail. x has to be sorted (e.g. a time vector).
+
+    If the ChannelPyramid of y is given, the visible window is read from the pyramid in O(pixels) time instead.
+    """
+    # get the number of bins from the width of the axis in pixels
+    def get_n_bins():
+        return max(int(ax.bbox.width * points_per_pixel / 2), 1)
+
+    # get the decimated trace between the x-axis limits
+    def get_window(xlims):
+        if pyramid is None:
+            return decimate_window(x, y, xlims, get_n_bins())
+
+        start = max(np.searchsorted(x, xlims[0], side='left') - 1, 0)
+        end = min(np.searchsorted(x, xlims[1], side='right') + 1, len(x))
+        idx, values = pyramid.query(start, end, get_n_bins())
+
+        return np.asarray(x[idx]), values
+
+    # plot the decimated full trace
+    line, = ax.plot(*(get_window((x[0], x[-1])) if len(x) > 0 else ([], [])), *args, **kwargs)
+
+    # re-decimate the visible window whenever the x-axis limits change
+    def on_xlim_changed(changed_ax):
+        line.set_data(*get_window(changed_ax.get_xlim()))
+
+    ax.callbacks.connect('xlim_changed', on_xlim_changed)
+
+    return line
+
+class WindowedHistogram:
+    """
+    Histogram and mean/std engine for windows of a signal y sampled at sorted x.
+
+    The bin of every sample and the per-block bin counts, sums and sums of squares (as prefix sums over blocks of
+    block_size samples) are computed once. The histogram of any x window is then the difference of two prefix sums
+    plus the bin counts of the partial blocks at the window edges, i.e. O(bins + edge samples) instead of O(samples).
+    The bin edges span the full range of y, so that all windows share the same bins.
+    """
+    def __init__(self, x, y, bins=50, block_size=4096):
+        self.x = x
+        self.y = y
+        self.bins = bins
+        self.block_size = block_size
+        y = np.asarray(y)
+
+        # get the bin edges from the range of the signal (ignoring NaNs)
+        finite = np.isfinite(y)
+        lo, hi = (np.min(y[finite]), np.max(y[finite])) if finite.any() else (0.0, 1.0)
+        if lo == hi:
+            lo, hi = lo - 0.5, hi + 0.5
+        self.edges = np.linspace(lo, hi, bins + 1)
+
+        # assign every sample to a bin (NaNs go to an extra bin that is never reported)
+        bin_ids = np.clip(((y - lo) / (hi - lo) * bins), 0, bins - 1)
+        bin_ids = np.where(finite, bin_ids, bins).astype(np.uint8 if bins < 256 else np.int32)
+        self.bin_ids = bin_ids
+
+        # center the samples before summing them so that the variance doesn't suffer from cancellation
+        self.center = (lo + hi) / 2
+        centered = np.where(finite, y - self.center, 0.0)
+
+        # compute the prefix sums of the per-block bin counts, sums and sums of squares
+        n_blocks = len(y) // block_size
+        n_full = n_blocks * block_size
+        block_ids = np.repeat(np.arange(n_blocks), block_size)
+        block_counts = np.bincount(block_ids * (bins + 1) + bin_ids[:n_full], minlength=n_blocks * (bins + 1))
+        block_counts = block_counts.reshape(n_blocks, bins + 1)[:, :bins]
+        self.count_prefix = np.vstack([np.zeros((1, bins), dtype=np.int64), np.cumsum(block_counts, axis=0)])
+        self.sum_prefix = np.concatenate([[0.0], np.cumsum(centered[:n_full].reshape(n_blocks, block_size).sum(axis=1))])
+        self.sq_prefix = np.concatenate([[0.0], np.cumsum((centered[:n_full]**2).reshape(n_blocks, block_size).sum(axis=1))])
+        self.centered = centered
+
+    def window(self, xlims):
+        """
+        Returns the bin counts, the bin edges, the mean and the standard deviation of the samples with xlims[0] <= x <= xlims[1].
+        """
+        # find the window with a binary search on the sorted x
+        start = np.searchsorted(self.x, xlims[0], side='left')
+        end = np.searchsorted(self.x, xlims[1], side='right')
+
+        # get the range of whole blocks inside the window
+        first_block = min(-(-start // self.block_size), len(self.sum_prefix) - 1)
+        last_block = max(end // self.block_size, first_block)
+
+        # the edge samples are the ones that are not covered by whole blocks
+        if first_block >= last_block:
+            edge_slices = [slice(start, end)]
+            first_block = last_block = 0
+        else:
+            edge_slices = [slice(start, first_block * self.block_size), slice(last_block * self.block_size, end)]
+
+        # add up the whole blocks and the edge samples
+        counts = self.count_prefix[last_block] - self.count_prefix[first_block]
+        total = self.sum_prefix[last_block] - self.sum_prefix[first_block]
+        total_sq = self.sq_prefix[last_block] - self.sq_prefix[first_block]
+        for edge in edge_slices:
+            counts = counts + np.bincount(self.bin_ids[edge], minlength=self.bins + 1)[:self.bins]
+            total += self.centered[edge].sum()
+            total_sq += (self.centered[edge]**2).sum()
+
+        # compute the mean and standard deviation of the (non-NaN) samples in the window
+        n = counts.sum()
+        if n == 0:
+            return counts, self.edges, np.nan, np.nan
+        mean = total / n
+        std = np.sqrt(max(total_sq / n - mean**2, 0.0))
+
+        return counts, self.edges, mean + self.center, std
+
+# windowed histogram engines of the distribution axes, so that they are only built on the first update
+_windowed_histograms = weakref.WeakKeyDictionary()
+
+def get_windowed_histogram(dist_ax, x, y, bins=50):
+    """
+    Returns the WindowedHistogram of the signal shown in a distribution axis, building it the first time.
+    """
+    histogram = _windowed_histograms.get(dist_ax)
+    if histogram is None or histogram.x is not x or histogram.y is not y or histogram.bins != bins:
+        histogram = WindowedHistogram(x, y, bins=bins)
+        _windowed_histograms[dist_ax] = histogram
+
+    return histogram
+
+def draw_window_distribution(dist_ax, signal_ax, x, y):
+    """
+    Draws the histogram of the part of the signal that is visible in signal_ax and returns its mean and standard deviation.
+    """
+    counts, edges, mean, std = get_windowed_histogram(dist_ax, x, y).window(signal_ax.get_xlim())
+    dist_ax.cla()  # Clear the current distribution plot
+    dist_ax.hist(edges[:-1], bins=edges, weights=counts, orientation='horizontal')
+
+    return mean, std
+
 def update_distribution(dist_ax, signal_ax, x, y, *args):
     """
     Update the distribution plot based on the visible range of the signal plot.
@@ -261,24 +2055,15 @@ def update_distribution(dist_ax, signal_ax, x, y, *args):
     - x: The x data of the signal.
     - y: The y data of the signal.
     """
-    # Get current x-axis view limits from the signal plot
-    xlims = signal_ax.get_xlim()
-    print(f'Current x-axis view limits: {xlims}')
-    visible_y = y[(x >= xlims[0]) & (x <= xlims[1])]
-    dist_ax.cla()  # Clear the current distribution plot
-    dist_ax.hist(visible_y, orientation='horizontal', bins=50)
-    # get the mean and standard deviation of the data
-    mean, std = np.mean(visible_y), np.std(visible_y)
+    # draw the histogram of the visible window
+    mean, std = draw_window_distribution(dist_ax, signal_ax, x, y)
     legend_string = r"$\mu = {:.2f}$, $\sigma = {:.2f}$".format(mean,std)
     dist_ax.legend([legend_string])
 
 def update_all_distributions(signal_axes, dist_axes, time, data_sets):
     # Assuming time and data_sets are lists or arrays of x and y data for each plot
     for signal_ax, dist_ax, data in zip(signal_axes, dist_axes, data_sets):
-        xlims = signal_ax.get_xlim()
-        visible_y = data[(time >= xlims[0]) & (time <= xlims[1])]
-        dist_ax.cla()
-        dist_ax.hist(visible_y, orientation='horizontal', bins=50)
+        draw_window_distribution(dist_ax, signal_ax, time, data)
 
 # This function is called periodically by the animation
 def update(frame):